@@ -0,0 +1,507 @@
+"""
+Offline benchmarks for job_application_counter.py.
+
+The listing, metadata and analysis stages run against FakeGmailService, an in-process
+stand-in for `service.users()` (messages.list/get, batch requests, getProfile and
+history.list) that holds N synthetic messages. The fake understands the query syntax the
+script sends (quoted phrases, subject:, from:, OR, parentheses, -is:draft, after:/before:
+as dates or epoch seconds) and can inject latency, transient errors and 429s.
+
+Each benchmark runs in a fresh process so peak RSS is measured per case.
+
+Usage:
+    python benchmark.py [--sizes 1000,10000,100000] [--benchmarks count,dates,incremental,analysis]
+                        [--latency-ms 0] [--error-rate 0] [--throttle-rate 0] [--quota 0]
+                        [--json results.json] [--baseline previous.json]
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import job_application_counter as jac
+
+BENCHMARK_SIZES = (1000, 10000, 100000)
+BENCHMARKS = ('count', 'dates', 'incremental', 'analysis')
+
+# Share of synthetic messages that are job application emails.
+JOB_MAIL_SHARE = 0.3
+# Messages are spread over twice the look-back window, so about half fall outside it.
+SPREAD_DAYS = 2 * jac.DAYS_TO_LOOK_BACK
+# A benchmark whose messages/sec drops by more than this fraction versus --baseline is reported.
+REGRESSION_THRESHOLD = 0.10
+
+COMPANIES = ['Acme', 'Globex', 'Initech', 'Umbrella', 'Hooli', 'Stark Industries', 'Wayne Enterprises',
+             'Siemens', 'Zalando', 'Contoso']
+ROLES = ['Data Analyst', 'Software Engineer', 'Product Manager', 'Werkstudent Data Science',
+         'BI Developer', 'Backend Developer']
+JOB_SUBJECTS = [
+    '{phrase} - {role} at {company}',
+    '{company}: {phrase}',
+    'Re: {phrase} ({role})',
+    '{phrase}! {role} position',
+]
+OTHER_SUBJECTS = [
+    'Your weekly digest', 'Invoice #{number}', 'Meeting notes {role}', 'Your order has shipped',
+    'Newsletter: {company} product update', 'Security alert for your account', 'Lunch on Friday?',
+]
+JOB_SENDERS = [
+    '{company} Recruiting Team <no-reply@{domain}>',
+    '{company} Talent Acquisition Team <careers@{domain}>',
+    'Greenhouse <no-reply@greenhouse.io>',
+    '{company} <jobs@{domain}>',
+]
+OTHER_SENDERS = ['{company} <news@{domain}>', 'Jane Doe <jane.doe@{domain}>', 'Billing <billing@{domain}>']
+BODY_SNIPPETS = ['', '', 'Log in to the application portal to track your status.',
+                 'Best regards, your talent team', 'See you soon!']
+
+def http_error(status, reason):
+    """Builds an HttpError like the one googleapiclient raises for a failed call."""
+    resp = httplib2.Response({'status': status})
+    resp.reason = reason
+    content = json.dumps({'error': {'code': status, 'message': reason, 'errors': [{'reason': reason}]}})
+    return HttpError(resp, content.encode())
+
+WORD = re.compile(r'\w+')
+
+def normalize(text):
+    """Case-folded words separated by single spaces, padded so phrases can be matched on word boundaries."""
+    return ' ' + ' '.join(WORD.findall(text.casefold())) + ' '
+
+# --- Query Evaluation ---
+
+QUERY_TOKEN = re.compile(r'\(|\)|-?[a-z]+:"[^"]*"|-?"[^"]*"|-?[a-z]+:[^\s()]+|\S+')
+
+def compile_query(query):
+    """Compiles a Gmail search query into a predicate over synthetic messages."""
+    tokens = QUERY_TOKEN.findall(query)
+    position = 0
+
+    def parse_or():
+        nonlocal position
+        terms = [parse_and()]
+        while position < len(tokens) and tokens[position] == 'OR':
+            position += 1
+            terms.append(parse_and())
+        return terms[0] if len(terms) == 1 else (lambda m: any(term(m) for term in terms))
+
+    def parse_and():
+        nonlocal position
+        items = []
+        while position < len(tokens) and tokens[position] not in ('OR', ')'):
+            items.append(parse_atom())
+        return lambda m: all(item(m) for item in items)
+
+    def parse_atom():
+        nonlocal position
+        token = tokens[position]
+        position += 1
+        if token == '(':
+            inner = parse_or()
+            position += 1  # closing parenthesis
+            return inner
+        if token.startswith('-'):
+            inner = parse_term(token[1:])
+            return lambda m: not inner(m)
+        return parse_term(token)
+
+    def parse_term(token):
+        operator, _, value = token.partition(':') if not token.startswith('"') else ('', '', token)
+        if operator in ('after', 'before'):
+            if value.isdigit():
+                bound = int(value) * 1000
+            else:
+                bound = int(datetime.strptime(value, '%Y/%m/%d').timestamp() * 1000)
+            if operator == 'after':
+                return lambda m: m['internalDate'] >= bound
+            return lambda m: m['internalDate'] < bound
+        if operator == 'is' and value == 'draft':
+            return lambda m: m['draft']
+        phrase = normalize(value.strip('"'))
+        field = {'subject': 'norm_subject', 'from': 'norm_from'}.get(operator, 'norm_all')
+        return lambda m: phrase in m[field]
+
+    return parse_or()
+
+# --- Fake Gmail Service ---
+
+class FakeRequest:
+    """A single API call; execute() counts it, applies latency and may raise an injected error."""
+
+    def __init__(self, service, kind, run):
+        self.service = service
+        self.kind = kind
+        self.run = run
+
+    def execute(self, http=None, num_retries=0):
+        self.service.record_http_call()
+        return self.service.call(self)
+
+class FakeBatch:
+    """A batch request: one HTTP round trip, with errors injected per call like Gmail does."""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback or self.callback, request_id))
+
+    def execute(self, http=None):
+        self.service.record_http_call()
+        for request, callback, request_id in self.requests:
+            try:
+                response = self.service.call(request, latency=False)
+            except HttpError as error:
+                callback(request_id, None, error)
+            else:
+                callback(request_id, response, None)
+
+class FakeHistory:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, userId='me', startHistoryId=None, historyTypes=None, pageToken=None, **kwargs):
+        service = self.service
+
+        def run():
+            start = int(startHistoryId)
+            if start < service.history_floor:
+                raise http_error(404, 'notFound')
+            records = [record for record in service.history_records if record['id'] > start]
+            offset = int(pageToken or 0)
+            response = {'history': records[offset:offset + 500], 'historyId': str(service.history_id)}
+            if offset + 500 < len(records):
+                response['nextPageToken'] = str(offset + 500)
+            return response
+        return FakeRequest(service, 'history.list', run)
+
+class FakeGmailService:
+    """
+    In-process fake of the Gmail API with `size` synthetic messages.
+    latency is added per HTTP round trip (a batch is one round trip); error_rate and
+    throttle_rate are the chances that a call fails with a 503 or a 429 rateLimitExceeded.
+    """
+
+    def __init__(self, size, seed=0, latency=0.0, error_rate=0.0, throttle_rate=0.0, page_limit=500):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.page_limit = page_limit
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.http_calls = 0
+        self.api_calls = {}
+        self.injected_errors = 0
+        self.history_id = 1000
+        self.history_floor = 0
+        self.history_records = []
+        self._next_number = 0
+        self._query_cache = {}
+
+        now_ms = int(time.time() * 1000)
+        self.mailbox = [self._make_message(now_ms - self.rng.randrange(SPREAD_DAYS * jac.MS_PER_DAY))
+                         for _ in range(size)]
+        self.mailbox.sort(key=lambda m: m['internalDate'], reverse=True)  # Gmail lists newest first
+        self.by_id = {m['id']: m for m in self.mailbox}
+
+    def _make_message(self, internal_date):
+        rng = self.rng
+        company = rng.choice(COMPANIES)
+        values = {'company': company, 'role': rng.choice(ROLES), 'number': rng.randrange(10000, 99999),
+                  'domain': company.lower().replace(' ', '') + '.example'}
+        if rng.random() < JOB_MAIL_SHARE:
+            phrase = rng.choice(jac.CORE_SEARCH_PHRASES)
+            subject = rng.choice(JOB_SUBJECTS).format(phrase=phrase, **values)
+            sender = rng.choice(JOB_SENDERS).format(**values)
+        else:
+            subject = rng.choice(OTHER_SUBJECTS).format(**values)
+            sender = rng.choice(OTHER_SENDERS).format(**values)
+        body = rng.choice(BODY_SNIPPETS)
+
+        self._next_number += 1
+        message_id = f"{0x18c0000000000000 + self._next_number * 7919:x}"
+        return {
+            'id': message_id,
+            'threadId': message_id,
+            'internalDate': internal_date,
+            'subject': subject,
+            'from': sender,
+            'draft': rng.random() < 0.01,
+            'norm_subject': normalize(subject),
+            'norm_from': normalize(sender),
+            'norm_all': normalize(f"{subject} {sender} {body}"),
+        }
+
+    # --- Call accounting and fault injection ---
+
+    def record_http_call(self):
+        with self.lock:
+            self.http_calls += 1
+
+    def call(self, request, latency=True):
+        """Runs one API call: counts it, sleeps for the round trip and injects errors."""
+        if latency and self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.api_calls[request.kind] = self.api_calls.get(request.kind, 0) + 1
+            roll = self.rng.random()
+        if roll < self.throttle_rate:
+            with self.lock:
+                self.injected_errors += 1
+            raise http_error(429, 'rateLimitExceeded')
+        if roll < self.throttle_rate + self.error_rate:
+            with self.lock:
+                self.injected_errors += 1
+            raise http_error(503, 'backendError')
+        return request.run()
+
+    def _matching(self, query):
+        with self.lock:
+            hits = self._query_cache.get(query)
+        if hits is None:
+            predicate = compile_query(query)
+            hits = [m for m in self.mailbox if predicate(m)]
+            with self.lock:
+                self._query_cache[query] = hits
+        return hits
+
+    # --- Mailbox changes (recorded in the history) ---
+
+    def add_message(self, internal_date=None):
+        message = self._make_message(internal_date or int(time.time() * 1000))
+        self.mailbox.insert(0, message)
+        self.by_id[message['id']] = message
+        self._record_change('messagesAdded', message['id'])
+        return message
+
+    def delete_message(self, message_id):
+        message = self.by_id.pop(message_id)
+        self.mailbox.remove(message)
+        self._record_change('messagesDeleted', message_id)
+
+    def _record_change(self, change, message_id):
+        self._query_cache.clear()
+        self.history_id += 1
+        self.history_records.append({'id': self.history_id, change: [{'message': {'id': message_id}}]})
+
+    # --- API surface used by job_application_counter ---
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def history(self):
+        return FakeHistory(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    def getProfile(self, userId='me'):
+        return FakeRequest(self, 'getProfile', lambda: {'historyId': str(self.history_id)})
+
+    def list(self, userId='me', q='', pageToken=None, maxResults=100, fields=None, **kwargs):
+        def run():
+            hits = self._matching(q)
+            start = int(pageToken or 0)
+            page = hits[start:start + min(maxResults or 100, self.page_limit)]
+            response = {'resultSizeEstimate': len(hits)}
+            if page:
+                response['messages'] = [{'id': m['id'], 'threadId': m['threadId']} for m in page]
+            if start + len(page) < len(hits):
+                response['nextPageToken'] = str(start + len(page))
+            return response
+        return FakeRequest(self, 'messages.list', run)
+
+    def get(self, userId='me', id=None, format='full', metadataHeaders=None, fields=None, **kwargs):
+        def run():
+            message = self.by_id.get(id)
+            if message is None:
+                raise http_error(404, 'notFound')
+            headers = [{'name': 'Subject', 'value': message['subject']}, {'name': 'From', 'value': message['from']}]
+            if metadataHeaders is not None:
+                headers = [h for h in headers if h['name'] in metadataHeaders]
+            return {'id': message['id'], 'threadId': message['threadId'],
+                    'internalDate': str(message['internalDate']), 'payload': {'headers': headers}}
+        return FakeRequest(self, 'messages.get', run)
+
+# --- Benchmarks ---
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None where it cannot be measured."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+def bench_count(service, query):
+    return jac.get_messages_count(service, search_query=query)
+
+def bench_dates(service, query):
+    return len(jac.get_message_dates(service, query))
+
+def bench_incremental(service, query, cache_file):
+    """Times an incremental sync after ~1% of the mailbox changed (the initial full sync is not timed)."""
+    cache = jac.MessageCache(cache_file)
+    try:
+        jac.sync_matching_ids(service, cache, jac.FULL_JOB_APPLICATION_QUERY, jac.DAYS_TO_LOOK_BACK)
+        changes = max(1, len(service.mailbox) // 100)
+        for _ in range(changes):
+            service.add_message()
+        for message in service.rng.sample(service.mailbox, changes // 4):
+            service.delete_message(message['id'])
+        service.http_calls = 0
+        service.api_calls = {}
+        started = time.perf_counter()
+        matched = jac.sync_matching_ids(service, cache, jac.FULL_JOB_APPLICATION_QUERY, jac.DAYS_TO_LOOK_BACK)
+        return len(matched), time.perf_counter() - started
+    finally:
+        cache.close()
+
+def run_case(name, size, options):
+    """Runs one benchmark on a new fake mailbox (in a worker process) and returns its metrics."""
+    # Every call should reach the fake quickly; the real quota would dominate the timings.
+    jac.REQUEST_SCHEDULER = jac.RequestScheduler(units_per_second=options['quota'] or 1e12,
+                                                 burst_units=options['quota'] or 1e12)
+    jac.BACKOFF_BASE_SECONDS = options['backoff_base']
+
+    service = FakeGmailService(size, seed=options['seed'], latency=options['latency'],
+                               error_rate=options['error_rate'], throttle_rate=options['throttle_rate'])
+    query = jac.create_date_query(jac.FULL_JOB_APPLICATION_QUERY, jac.DAYS_TO_LOOK_BACK)
+    rss_before = peak_rss_mb()
+
+    # The script reports progress on stdout; keep the benchmark output readable.
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        if name == 'count':
+            messages = bench_count(service, query)
+        elif name == 'dates':
+            messages = bench_dates(service, query)
+        elif name == 'incremental':
+            with tempfile.TemporaryDirectory() as tmp:
+                messages, elapsed = bench_incremental(service, query, os.path.join(tmp, 'cache.sqlite3'))
+        else:
+            timestamps = jac.np.fromiter((m['internalDate'] for m in service.mailbox), dtype=jac.np.int64,
+                                         count=len(service.mailbox))
+            started = time.perf_counter()
+            jac.analyze_timestamps(timestamps, jac.resolve_timezone('Europe/Berlin'))
+            messages = len(timestamps)
+        if name != 'incremental':
+            elapsed = time.perf_counter() - started
+
+    api_calls = sum(service.api_calls.values())
+    return {
+        'benchmark': name,
+        'size': size,
+        'messages': messages,
+        'seconds': elapsed,
+        'messages_per_second': messages / elapsed if elapsed > 0 else float('inf'),
+        'http_calls': service.http_calls,
+        'api_calls': api_calls,
+        'api_calls_per_message': api_calls / messages if messages else 0.0,
+        'injected_errors': service.injected_errors,
+        'peak_rss_mb': peak_rss_mb(),
+        'fake_rss_mb': rss_before,
+    }
+
+def run_isolated(name, size, options):
+    """Runs run_case in a freshly spawned interpreter so peak RSS is not inherited from earlier cases."""
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_case, name, size, options).result()
+
+def format_mb(value):
+    return f"{value:8.1f}" if value is not None else "     n/a"
+
+def print_results(results, baseline=None):
+    print(f"{'benchmark':<12} {'size':>7} {'messages':>8} {'wall s':>8} {'msgs/s':>10} {'HTTP':>6} "
+          f"{'API/msg':>7} {'errors':>6} {'RSS MB':>8}")
+    regressions = []
+    for r in results:
+        line = (f"{r['benchmark']:<12} {r['size']:>7} {r['messages']:>8} {r['seconds']:>8.2f} "
+                f"{r['messages_per_second']:>10.0f} {r['http_calls']:>6} {r['api_calls_per_message']:>7.3f} "
+                f"{r['injected_errors']:>6} {format_mb(r['peak_rss_mb'])}")
+        previous = (baseline or {}).get((r['benchmark'], r['size']))
+        if previous and previous['messages_per_second']:
+            change = r['messages_per_second'] / previous['messages_per_second'] - 1
+            line += f"  {change:+.0%} vs baseline"
+            if change < -REGRESSION_THRESHOLD:
+                regressions.append(r)
+        print(line)
+    return regressions
+
+def load_baseline(path):
+    with open(path, encoding='utf-8') as f:
+        return {(r['benchmark'], r['size']): r for r in json.load(f)['results']}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark job_application_counter.py against a fake Gmail service.")
+    parser.add_argument('--sizes', default=','.join(map(str, BENCHMARK_SIZES)),
+                        help="Comma-separated mailbox sizes (number of messages). Default: 1000,10000,100000.")
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS),
+                        help=f"Comma-separated benchmarks to run ({', '.join(BENCHMARKS)}). Default: all.")
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help="Simulated latency per HTTP round trip in milliseconds. Default: 0.")
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help="Chance that a call fails with a transient 503. Default: 0.")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help="Chance that a call fails with a 429 rateLimitExceeded. Default: 0.")
+    parser.add_argument('--quota', type=float, default=0,
+                        help="Quota units per second for the request scheduler (0 = unlimited). Default: 0.")
+    parser.add_argument('--backoff-base', type=float, default=0.01,
+                        help="BACKOFF_BASE_SECONDS used for retries during the benchmark. Default: 0.01.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed for the synthetic mailbox. Default: 0.")
+    parser.add_argument('--json', metavar='FILE', help="Also write the results to FILE.")
+    parser.add_argument('--baseline', metavar='FILE',
+                        help="Compare messages/sec with an earlier --json file; exits with code 1 on a regression "
+                             f"of more than {REGRESSION_THRESHOLD * 100:.0f}%%.")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size.strip()]
+    names = [name.strip() for name in args.benchmarks.split(',') if name.strip()]
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+    options = {'latency': args.latency_ms / 1000, 'error_rate': args.error_rate, 'throttle_rate': args.throttle_rate,
+               'quota': args.quota, 'backoff_base': args.backoff_base, 'seed': args.seed}
+
+    results = []
+    for size in sizes:
+        for name in names:
+            print(f"Running {name} with {size} messages...", file=sys.stderr)
+            results.append(run_isolated(name, size, options))
+
+    print()
+    regressions = print_results(results, load_baseline(args.baseline) if args.baseline else None)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'options': options, 'results': results}, f, indent=2)
+        print(f"\nResults saved to {args.json}")
+    if regressions:
+        print(f"\nFAIL: {len(regressions)} benchmark(s) are more than {REGRESSION_THRESHOLD:.0%} slower than the baseline.")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
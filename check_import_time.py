@@ -0,0 +1,82 @@
+"""
+Start-up budget check for job_application_counter.py.
+
+Runs `python -X importtime -c "import job_application_counter"` in a fresh interpreter
+and fails (exit code 1) if importing the script takes longer than the budget.
+Heavy dependencies (numpy, matplotlib, Google auth/discovery) are supposed to be
+imported lazily, so a regression usually shows up as one of them in the slowest list.
+
+Usage:
+    python check_import_time.py [--budget-ms 250] [--runs 3] [--top 10]
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+MODULE_NAME = 'job_application_counter'
+
+# Default budget for importing the script (cumulative, in milliseconds).
+IMPORT_BUDGET_MS = 250
+
+def measure_import(module_name=MODULE_NAME):
+    """
+    Imports module_name in a new interpreter with -X importtime.
+    Returns (total_ms, [(cumulative_ms, name), ...]) for every imported module.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        cwd=script_dir, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module_name} failed:\n{result.stderr}")
+
+    # Format: "import time: self [us] | cumulative | imported package". Nested imports are indented
+    # and listed before their parent, so the module's own imports are the indented lines just above it.
+    lines = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        lines.append((int(cumulative) / 1000, name.rstrip()))
+
+    for index, (total_ms, name) in enumerate(lines):
+        if name.strip() == module_name:
+            break
+    else:
+        raise RuntimeError(f"No import time reported for {module_name}.")
+
+    imports = []
+    for cumulative_ms, name in reversed(lines[:index]):
+        if not name.startswith('  '):
+            break  # previous top-level import, not part of this module
+        imports.append((cumulative_ms, name.strip()))
+    return total_ms, imports
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Check the import time of {MODULE_NAME}.py against a budget.")
+    parser.add_argument('--budget-ms', type=float, default=IMPORT_BUDGET_MS,
+                        help=f"Maximum allowed import time in milliseconds. Default: {IMPORT_BUDGET_MS}.")
+    parser.add_argument('--runs', type=int, default=3,
+                        help="Number of measurements; the fastest one is compared to the budget. Default: 3.")
+    parser.add_argument('--top', type=int, default=10,
+                        help="Number of slowest imports to list. Default: 10.")
+    args = parser.parse_args()
+
+    # The first run warms the OS file cache; take the best of several runs to reduce noise.
+    measurements = [measure_import() for _ in range(max(1, args.runs))]
+    total_ms, imports = min(measurements, key=lambda m: m[0])
+
+    print(f"Import time of {MODULE_NAME}: {total_ms:.1f} ms (budget {args.budget_ms:.0f} ms)")
+    print("\nSlowest imports (cumulative):")
+    for cumulative_ms, name in sorted(imports, reverse=True)[:args.top]:
+        print(f"  {cumulative_ms:8.1f} ms  {name}")
+
+    if total_ms > args.budget_ms:
+        print(f"\nFAIL: import time exceeds the budget by {total_ms - args.budget_ms:.1f} ms.")
+        sys.exit(1)
+    print("\nOK")
+
+if __name__ == '__main__':
+    main()
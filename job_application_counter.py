@@ -1,22 +1,67 @@
 import os.path
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+import sqlite3
+import time
+import argparse
+import re
+import unicodedata
+import threading
+import random
+import importlib
+import importlib.util
+import itertools
+import contextlib
+import functools
+import hashlib
+import json
+import gzip
+import mmap
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 from googleapiclient.errors import HttpError
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone, tzinfo
 from collections import defaultdict
+from email.utils import parseaddr
 import csv # Import the CSV library
 
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# --- Lazy Imports ---
+# numpy, matplotlib and the Google auth/discovery modules make up most of the start-up time,
+# so they are only imported when first used (a run with --no-plots never loads matplotlib).
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+
+    def __init__(self, name, before_import=None):
+        self._name = name
+        self._before_import = before_import
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            if self._before_import is not None:
+                self._before_import()
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+def _select_agg_backend():
+    import matplotlib
+    # Charts are only ever saved to files, so use the non-interactive Agg backend (works on headless servers).
+    matplotlib.use('Agg')
+
+np = LazyModule('numpy')
+asyncio = LazyModule('asyncio')
+
 # --- Visualization Imports (Needed for plotting results) ---
-try:
-    import matplotlib.pyplot as plt
-    import numpy as np
-except ImportError:
-    # Fallback to allow the script to run without plotting if the dependencies are missing.
+HAVE_MATPLOTLIB = importlib.util.find_spec('matplotlib') is not None
+if HAVE_MATPLOTLIB:
+    plt = LazyModule('matplotlib.pyplot', before_import=_select_agg_backend)
+else:
+    # Fallback to allow the script to run without plotting if the dependency is missing.
     plt = None 
-    np = None 
-    print("Warning: matplotlib or numpy not installed. Visualization will be skipped. Run 'pip install matplotlib numpy' to enable plotting.")
+    print("Warning: matplotlib not installed. Visualization will be skipped. Run 'pip install matplotlib' to enable plotting.")
 # -----------------------------------------------------------
 
 # --- Configuration ---
@@ -25,9 +70,134 @@ SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 CREDENTIALS_FILE = 'credentials.json'
 TOKEN_FILE = 'token.json'
 
+# Synchronous API transport: one pooled keep-alive HTTP session (--pool-size connections) shared by
+# all worker threads of an account.
+HTTP_POOL_SIZE = 32
+HTTP_TIMEOUT_SECONDS = 60
+# Access tokens are refreshed this long before they expire, so a long scan never sends an expired token.
+TOKEN_REFRESH_MARGIN_SECONDS = 300
+
 # Days to look back for the search query (e.g., 365 for the last year).
 DAYS_TO_LOOK_BACK = 365 
 
+# Number of message metadata requests sent per Gmail batch call (Gmail allows at most 100).
+MAX_BATCH_SIZE = 100
+METADATA_BATCH_SIZE = 100
+
+# Partial-response mask for the metadata fetch; only the fields we actually use are returned.
+METADATA_FIELDS = 'threadId,internalDate,payload/headers'
+# Headers requested with each metadata fetch (used for local phrase attribution).
+METADATA_HEADERS = ['Subject', 'From']
+
+# Page size and partial-response mask for messages.list (500 is the maximum page size Gmail allows).
+LIST_PAGE_SIZE = 500
+LIST_FIELDS = 'messages/id,nextPageToken,resultSizeEstimate'
+
+# Row-level export (--export-rows): rows buffered per month partition before a row group is written.
+EXPORT_ROW_GROUP_SIZE = 10000
+
+# Chart rendering: file formats written for every chart (--formats) and the style applied once per process.
+CHART_FORMATS = ('png',)
+CHART_STYLE = 'seaborn-v0_8-darkgrid'
+# Worker processes used to render charts in parallel (None = one per CPU, capped by the number of charts).
+RENDER_WORKERS = None
+# Point budgets of the line charts (--max-points / --max-trend-points): longer series are downsampled
+# with LTTB, which keeps their visual shape. The cumulative chart has one point per message.
+CUMULATIVE_MAX_POINTS = 2000
+TREND_MAX_POINTS = 36
+
+# Time-sharded listing (--shards): the look-back window is split into date ranges that are listed in parallel.
+SHARD_WORKERS = 8
+# Approximate number of days per shard for --shards auto.
+AUTO_SHARD_DAYS = 30
+# A shard whose first page estimates more results than this is split in two (down to single days).
+SHARD_SPLIT_THRESHOLD = 5000
+
+# Multi-account mode (--accounts): accounts processed in parallel, and the cap on
+# API calls in flight across all of them.
+ACCOUNT_PROCESSES = 4
+MAX_GLOBAL_REQUESTS = 32
+
+# --- Quota / Rate Limiting ---
+# Gmail allows 250 quota units per user per second. Every API call goes through REQUEST_SCHEDULER,
+# which spends units from a token bucket, retries throttled calls and adapts its concurrency.
+QUOTA_UNITS_PER_SECOND = 250
+# Token bucket size: how many units may be spent in a burst before the per-second rate applies.
+QUOTA_BURST_UNITS = 2500
+# Quota cost of each call type (a batch costs the sum of the calls it contains).
+QUOTA_UNITS = {
+    'messages.list': 5,
+    'messages.get': 5,
+    'history.list': 2,
+    'getProfile': 1,
+}
+# Retries for throttled (429 / rateLimitExceeded) and transient (5xx, network) errors.
+MAX_RETRIES = 6
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 64.0
+# AIMD concurrency: start here, grow by ~1 per window of successful calls, halve on throttling.
+INITIAL_CONCURRENCY = 4
+MAX_CONCURRENCY = 16
+
+# --- Async Backend (--backend async) ---
+# The listing feeds a bounded queue of message IDs that ASYNC_FETCH_WORKERS coroutines drain,
+# over a pool of keep-alive HTTP connections (requires httpx).
+GMAIL_API_ROOT = 'https://gmail.googleapis.com/gmail/v1/users/'
+ASYNC_FETCH_WORKERS = 16
+# Message IDs listed but not yet fetched; the listing pauses when the queue is full.
+ASYNC_QUEUE_SIZE = 2000
+ASYNC_MAX_CONNECTIONS = 16
+ASYNC_TIMEOUT_SECONDS = 60
+
+# --- Record / Replay (--record / --replay) ---
+# Raw messages.list/get responses are archived as gzip-compressed JSON Lines.
+ARCHIVE_VERSION = 1
+# Page tokens of queries that a replay evaluates locally (not in the archive)
+REPLAY_PAGE_TOKEN_PREFIX = 'replay:'
+
+# --- Takeout Import (--mbox) ---
+# The mbox is memory-mapped and split at 'From ' lines into chunks of about this size,
+# which MBOX_PROCESSES worker processes (None = one per CPU) parse in parallel.
+MBOX_CHUNK_BYTES = 64 * 1024 * 1024
+MBOX_PROCESSES = None
+MBOX_MAX_HEADER_BYTES = 256 * 1024
+# Only the first part of a message body is searched for phrases (attachments follow the text)
+MBOX_MAX_BODY_BYTES = 1024 * 1024
+# Gmail search skips drafts, spam and trash (X-Gmail-Labels in Takeout exports)
+MBOX_EXCLUDED_LABELS = {'draft', 'drafts', 'spam', 'trash'}
+
+# --- Watch Mode (--watch) ---
+# The daemon refreshes its counts with an incremental sync every WATCH_INTERVAL_MINUTES and serves
+# them as JSON on WATCH_HOST (local connections only) and --port.
+WATCH_INTERVAL_MINUTES = 15
+WATCH_HOST = '127.0.0.1'
+WATCH_PORT = 8765
+
+# --- Run Metrics ---
+# Every API call is traced by RUN_METRICS; a JSON summary and a Prometheus text file
+# (for the node_exporter textfile collector) are written to the output directory after each run.
+METRICS_JSON_FILE = 'job_application_metrics.json'
+METRICS_PROM_FILE = 'job_application_metrics.prom'
+# Upper bounds (seconds) of the API latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# cProfile statistics written with --profile.
+PROFILE_FILE = 'job_application_profile.pstats'
+PROFILE_TOP_FUNCTIONS = 25
+
+# Local metadata cache (stored next to token.json). internalDate never changes for a message ID,
+# so messages seen in a previous run are not fetched again.
+CACHE_FILE = os.path.join(os.path.dirname(TOKEN_FILE), 'message_cache.sqlite3')
+# Bump this when the cache schema changes; older cache files are discarded automatically.
+CACHE_VERSION = 2
+# Maximum number of messages kept in the cache. Least recently used entries are evicted first.
+MAX_CACHE_ENTRIES = 250000
+
+# Progress of a running date scan (see ScanCheckpoint); removed when the scan completes.
+CHECKPOINT_FILE = os.path.join(os.path.dirname(TOKEN_FILE), 'scan_checkpoint.json')
+CHECKPOINT_VERSION = 1
+# Minimum number of seconds between two checkpoint writes (it is also written when the scan fails).
+CHECKPOINT_INTERVAL_SECONDS = 30
+
 # List of individual core search phrases (English and German) to count.
 # These will be combined to form the full query.
 CORE_SEARCH_PHRASES = [
@@ -90,27 +260,734 @@ FULL_JOB_APPLICATION_QUERY = f'({" OR ".join(ALL_QUERIES_COMBINED)}) -is:draft'
 # --- End Query Refinement ---
 
 
-def authenticate_gmail():
-    """Shows user authentication flow using console and returns a Gmail API service object."""
+# --- Message Metadata Cache ---
+
+class MessageCache:
+    """
+    SQLite-backed cache mapping Gmail message IDs to their internalDate and headers.
+    Entries carry a last-used timestamp so the cache can be trimmed to `max_entries`.
+    """
+
+    # SQLite limits the number of bound parameters per statement; stay well below it.
+    _CHUNK_SIZE = 500
+
+    def __init__(self, path=CACHE_FILE, max_entries=MAX_CACHE_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path)
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        """Creates the tables, discarding the cache if it was written by another version."""
+        cur = self.conn.cursor()
+        cur.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value TEXT)")
+        row = cur.execute("SELECT value FROM cache_meta WHERE key = 'version'").fetchone()
+        if row is None or int(row[0]) != CACHE_VERSION:
+            if row is not None:
+                print(f"Message cache version changed ({row[0]} -> {CACHE_VERSION}); rebuilding {self.path}.")
+            for table in ('messages', 'sync_state', 'query_matches', 'exported_rows'):
+                cur.execute(f"DROP TABLE IF EXISTS {table}")
+            cur.execute("INSERT OR REPLACE INTO cache_meta (key, value) VALUES ('version', ?)", (str(CACHE_VERSION),))
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id TEXT PRIMARY KEY,"
+            " thread_id TEXT,"
+            " internal_date INTEGER NOT NULL,"
+            " subject TEXT,"
+            " sender TEXT,"
+            " last_used INTEGER NOT NULL)"
+        )
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_messages_last_used ON messages (last_used)")
+        # Incremental sync state: the mailbox historyId of the last scan and the IDs that matched.
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS sync_state ("
+            " query TEXT PRIMARY KEY,"
+            " history_id TEXT NOT NULL,"
+            " synced_at INTEGER NOT NULL)"
+        )
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS query_matches ("
+            " query TEXT NOT NULL,"
+            " id TEXT NOT NULL,"
+            " PRIMARY KEY (query, id))"
+        )
+        # Messages already written by the row-level export (so later runs only add new rows).
+        cur.execute("CREATE TABLE IF NOT EXISTS exported_rows (id TEXT PRIMARY KEY)")
+        self.conn.commit()
+
+    def get_many(self, message_ids):
+        """Returns {message_id: {'threadId', 'internalDate', 'subject', 'from'}} for the IDs present in the cache."""
+        found = {}
+        now = int(time.time())
+        cur = self.conn.cursor()
+        for start in range(0, len(message_ids), self._CHUNK_SIZE):
+            chunk = message_ids[start:start + self._CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            rows = cur.execute(
+                f"SELECT id, thread_id, internal_date, subject, sender FROM messages WHERE id IN ({placeholders})", chunk
+            ).fetchall()
+            for msg_id, thread_id, internal_date, subject, sender in rows:
+                found[msg_id] = {'threadId': thread_id, 'internalDate': internal_date, 'subject': subject, 'from': sender}
+            # Mark the hits as recently used so they survive eviction.
+            cur.execute(f"UPDATE messages SET last_used = ? WHERE id IN ({placeholders})", [now] + list(chunk))
+        self.conn.commit()
+        return found
+
+    def put_many(self, records):
+        """Stores {message_id: {'threadId', 'internalDate', 'subject', 'from'}} and evicts old entries if needed."""
+        if not records:
+            return
+        now = int(time.time())
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO messages (id, thread_id, internal_date, subject, sender, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            [(msg_id, r.get('threadId'), int(r['internalDate']), r.get('subject'), r.get('from'), now)
+             for msg_id, r in records.items()]
+        )
+        self._evict()
+        self.conn.commit()
+
+    def _evict(self):
+        """Deletes the least recently used entries beyond `max_entries`."""
+        (size,) = self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()
+        excess = size - self.max_entries
+        if excess > 0:
+            self.conn.execute(
+                "DELETE FROM messages WHERE id IN (SELECT id FROM messages ORDER BY last_used ASC LIMIT ?)", (excess,)
+            )
+
+    def get_sync_state(self, query_key):
+        """Returns {'history_id', 'synced_at', 'ids'} stored for query_key, or None if never synced."""
+        row = self.conn.execute(
+            "SELECT history_id, synced_at FROM sync_state WHERE query = ?", (query_key,)
+        ).fetchone()
+        if row is None:
+            return None
+        ids = [r[0] for r in self.conn.execute("SELECT id FROM query_matches WHERE query = ?", (query_key,))]
+        return {'history_id': row[0], 'synced_at': row[1], 'ids': ids}
+
+    def save_sync_state(self, query_key, history_id, message_ids):
+        """Replaces the stored historyId and matching message IDs for query_key."""
+        self.conn.execute("DELETE FROM query_matches WHERE query = ?", (query_key,))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO query_matches (query, id) VALUES (?, ?)",
+            [(query_key, msg_id) for msg_id in message_ids]
+        )
+        self.conn.execute(
+            "INSERT OR REPLACE INTO sync_state (query, history_id, synced_at) VALUES (?, ?, ?)",
+            (query_key, str(history_id), int(time.time()))
+        )
+        self.conn.commit()
+
+    def filter_unexported(self, message_ids):
+        """Returns the subset of message_ids not yet written by the row-level export, in the same order."""
+        exported = set()
+        for start in range(0, len(message_ids), self._CHUNK_SIZE):
+            chunk = message_ids[start:start + self._CHUNK_SIZE]
+            placeholders = ','.join('?' * len(chunk))
+            exported.update(r[0] for r in self.conn.execute(
+                f"SELECT id FROM exported_rows WHERE id IN ({placeholders})", chunk
+            ))
+        return [msg_id for msg_id in message_ids if msg_id not in exported]
+
+    def mark_exported(self, message_ids):
+        """Records that these messages have been written by the row-level export."""
+        self.conn.executemany("INSERT OR IGNORE INTO exported_rows (id) VALUES (?)", [(m,) for m in message_ids])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def metadata_to_record(response):
+    """
+    Converts a messages.get metadata response into a cache record.
+    Missing headers are stored as '' so they can be told apart from records fetched without headers (None).
+    """
+    headers = {h['name'].lower(): h['value'] for h in response.get('payload', {}).get('headers', [])}
+    return {
+        'threadId': response.get('threadId'),
+        'internalDate': int(response['internalDate']),
+        'subject': headers.get('subject', ''),
+        'from': headers.get('from', ''),
+    }
+
+# --- End Message Metadata Cache ---
+
+
+# --- Scan Checkpoints ---
+
+class IncompleteScanError(RuntimeError):
+    """Raised when a date scan stops before every listed message was processed (see ScanCheckpoint)."""
+
+class ScanCheckpoint:
+    """
+    Progress of a date scan, kept in a small JSON state file so an interrupted scan
+    (crash, quota exhaustion, expired token, Ctrl-C) can continue with --resume:
+    a hash of the query, the page token of the page being listed (unsharded listings),
+    the IDs already processed and the internalDate of each fetched one (the partial result).
+    Messages whose fetch failed are not processed, so a resumed scan fetches them again.
+    The file is replaced atomically, at most every `interval` seconds and whenever the
+    scan fails, and removed once the scan completes.
+    """
+
+    def __init__(self, path, query, interval=CHECKPOINT_INTERVAL_SECONDS):
+        self.path = path
+        self.query_hash = hashlib.sha256(query.encode('utf-8')).hexdigest()
+        self.interval = interval
+        self.page_token = None
+        # Token of the page the listing is currently reading; becomes page_token once all IDs before it are processed
+        self.listing_token = None
+        self.done_ids = set()
+        # Set once a fetch failed: the page token stays at the last page whose messages were all processed
+        self.failed = False
+        self._timestamp_chunks = []
+        self._last_save = time.monotonic()
+
+    def load(self):
+        """Loads a checkpoint for the same query. Returns False if there is none or it belongs to another query."""
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as error:
+            print(f"Warning: could not read checkpoint {self.path} ({error}); starting over.")
+            return False
+        if state.get('version') != CHECKPOINT_VERSION or state.get('query_hash') != self.query_hash:
+            print("Checkpoint belongs to a different query or look-back window; starting over.")
+            return False
+        self.page_token = state.get('page_token')
+        self.done_ids = set(state['done_ids'])
+        self._timestamp_chunks = [np.asarray(state['timestamps'], dtype=np.int64)]
+        return True
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def timestamps(self):
+        return concat_timestamps(self._timestamp_chunks)
+
+    def add_processed(self, message_ids, timestamps, failed=False):
+        """
+        Marks message_ids as processed and keeps the timestamps of the fetched ones. failed=True
+        means other messages of the same batch could not be fetched; they are left unprocessed.
+        """
+        self.done_ids.update(message_ids)
+        self._timestamp_chunks.append(timestamps)
+        self.failed = self.failed or failed
+        if not self.failed:
+            self.page_token = self.listing_token
+
+    def maybe_save(self):
+        if time.monotonic() - self._last_save >= self.interval:
+            self.save()
+
+    def save(self):
+        state = {
+            'version': CHECKPOINT_VERSION,
+            'query_hash': self.query_hash,
+            'saved_at': datetime.now().isoformat(timespec='seconds'),
+            'page_token': self.page_token,
+            'done_ids': sorted(self.done_ids),
+            'timestamps': self.timestamps().tolist(),
+        }
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(self.path + '.tmp', self.path)
+        self._last_save = time.monotonic()
+
+    def remove(self):
+        for path in (self.path, self.path + '.tmp'):
+            if os.path.exists(path):
+                os.remove(path)
+
+def save_scan_progress(checkpoint):
+    """Saves the checkpoint of a scan that stops early. Returns the note for the error message."""
+    if checkpoint is None:
+        return ''
+    checkpoint.save()
+    return "; progress was saved, run again with --resume to continue the scan"
+
+def replay_checkpoint(checkpoint, cache, on_batch, batch_size=METADATA_BATCH_SIZE):
+    """Passes the messages processed before the interruption to on_batch again, reading them from the cache."""
+    if on_batch is None:
+        return
+    if cache is None:
+        print("Warning: without the cache, messages processed before the interruption are missing from the row export.")
+        return
+    done_ids = sorted(checkpoint.done_ids)
+    for start in range(0, len(done_ids), batch_size):
+        chunk = done_ids[start:start + batch_size]
+        on_batch(chunk, cache.get_many(chunk))
+
+# --- End Scan Checkpoints ---
+
+
+# --- Run Metrics ---
+
+GMAIL_USER_PATH = re.compile(r'/users/[^/]+/(.*)$')
+
+def api_call_kind(uri):
+    """Returns the call type ('messages.list', 'messages.get', ..., or 'batch') of a Gmail API request URI."""
+    path = uri.split('?', 1)[0].rstrip('/')
+    if '/batch' in path:
+        return 'batch'
+    match = GMAIL_USER_PATH.search(path)
+    resource = match.group(1) if match else path.rsplit('/', 1)[-1]
+    if resource.startswith('messages/'):
+        return 'messages.get'
+    return {'messages': 'messages.list', 'history': 'history.list', 'profile': 'getProfile'}.get(resource, resource)
+
+class RunMetrics:
+    """
+    Collects per-call API statistics (count, latency histogram, response bytes, retries,
+    quota units, failures) by call type, and wall-clock time per pipeline stage.
+    Stage times are summed over threads and nested stages are counted in both
+    (e.g. the listing done for the phrase counts is also part of 'phrase_counts').
+    It is thread-safe; the module-level RUN_METRICS instance is shared by all threads.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.calls = {}
+        self.stages = {}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def _call_stats(self, kind):
+        stats = self.calls.get(kind)
+        if stats is None:
+            stats = self.calls[kind] = {
+                'count': 0, 'failed': 0, 'retries': 0, 'units': 0, 'response_bytes': 0,
+                'latency_sum': 0.0, 'latency_max': 0.0, 'latency_buckets': [0] * len(LATENCY_BUCKETS),
+            }
+        return stats
+
+    def record_call(self, kind, seconds, retries=0, units=0, response_bytes=0, failed=False):
+        """Records one API call; `seconds` covers all attempts, including rate-limit waits and backoff."""
+        with self._lock:
+            stats = self._call_stats(kind)
+            stats['count'] += 1
+            stats['failed'] += int(failed)
+            stats['retries'] += retries
+            stats['units'] += units
+            stats['response_bytes'] += response_bytes
+            stats['latency_sum'] += seconds
+            stats['latency_max'] = max(stats['latency_max'], seconds)
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    stats['latency_buckets'][index] += 1
+                    break
+
+    def add(self, kind, retries=0, response_bytes=0):
+        """Adds retries (batch parts) or response bytes (counted by the HTTP transports) to a call type."""
+        with self._lock:
+            stats = self._call_stats(kind)
+            stats['retries'] += retries
+            stats['response_bytes'] += response_bytes
+
+    def add_stage_time(self, name, seconds):
+        with self._lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager that adds the time spent in its block to stage `name`."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage_time(name, time.perf_counter() - started)
+
+    def set_value(self, name, value):
+        with self._lock:
+            self.values[name] = value
+
+    def summary(self):
+        """Returns the collected metrics as a JSON-serializable dict."""
+        with self._lock:
+            return {
+                'started': self.started,
+                'duration_seconds': time.time() - self.started,
+                'calls': {kind: dict(stats, latency_buckets=list(stats['latency_buckets']))
+                          for kind, stats in self.calls.items()},
+                'stages': dict(self.stages),
+                'values': dict(self.values),
+            }
+
+    def merge(self, summary):
+        """Adds the calls and stage times of another run's summary (e.g. from an account worker)."""
+        with self._lock:
+            for kind, other in summary['calls'].items():
+                stats = self._call_stats(kind)
+                for key in ('count', 'failed', 'retries', 'units', 'response_bytes', 'latency_sum'):
+                    stats[key] += other[key]
+                stats['latency_max'] = max(stats['latency_max'], other['latency_max'])
+                stats['latency_buckets'] = [a + b for a, b in zip(stats['latency_buckets'], other['latency_buckets'])]
+            for name, seconds in summary['stages'].items():
+                self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def to_prometheus(self):
+        """Formats the metrics in the Prometheus text exposition format."""
+        summary = self.summary()
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append(f"# HELP job_application_{name} {help_text}")
+            lines.append(f"# TYPE job_application_{name} {metric_type}")
+            for labels, value in samples:
+                label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+                lines.append(f"job_application_{name}{{{label_text}}} {value}" if labels else
+                             f"job_application_{name} {value}")
+
+        calls = sorted(summary['calls'].items())
+        metric('api_calls_total', 'counter', "Gmail API calls by type.",
+               [((('kind', kind),), stats['count']) for kind, stats in calls])
+        metric('api_failed_calls_total', 'counter', "Gmail API calls that failed after all retries.",
+               [((('kind', kind),), stats['failed']) for kind, stats in calls])
+        metric('api_retries_total', 'counter', "Retried Gmail API calls (throttled or transient errors).",
+               [((('kind', kind),), stats['retries']) for kind, stats in calls])
+        metric('api_quota_units_total', 'counter', "Gmail quota units spent.",
+               [((('kind', kind),), stats['units']) for kind, stats in calls])
+        metric('api_response_bytes_total', 'counter', "Size of the API response bodies received.",
+               [((('kind', kind),), stats['response_bytes']) for kind, stats in calls])
+
+        samples = []
+        for kind, stats in calls:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats['latency_buckets']):
+                cumulative += count
+                samples.append(((('kind', kind), ('le', f"{bound:g}")), cumulative))
+            samples.append(((('kind', kind), ('le', '+Inf')), stats['count']))
+        lines.append("# HELP job_application_api_latency_seconds Gmail API call latency, including retries.")
+        lines.append("# TYPE job_application_api_latency_seconds histogram")
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{val}"' for key, val in labels)
+            lines.append(f"job_application_api_latency_seconds_bucket{{{label_text}}} {value}")
+        for kind, stats in calls:
+            lines.append(f'job_application_api_latency_seconds_sum{{kind="{kind}"}} {stats["latency_sum"]:.6f}')
+            lines.append(f'job_application_api_latency_seconds_count{{kind="{kind}"}} {stats["count"]}')
+
+        metric('stage_seconds', 'gauge', "Time spent per pipeline stage in the last run.",
+               [((('stage', name),), f"{seconds:.6f}") for name, seconds in sorted(summary['stages'].items())])
+        metric('run_duration_seconds', 'gauge', "Wall-clock duration of the last run.",
+               [((), f"{summary['duration_seconds']:.6f}")])
+        metric('last_run_timestamp_seconds', 'gauge', "Unix time at which the last run finished.",
+               [((), f"{summary['started'] + summary['duration_seconds']:.0f}")])
+        for name, value in sorted(summary['values'].items()):
+            metric(name, 'gauge', f"{name.replace('_', ' ').capitalize()} in the last run.", [((), value)])
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_dir='.'):
+        """Writes the JSON summary and the Prometheus file; each is replaced atomically so scrapers never see half a file."""
+        paths = []
+        for filename, content in ((METRICS_JSON_FILE, json.dumps(self.summary(), indent=2)),
+                                  (METRICS_PROM_FILE, self.to_prometheus())):
+            path = os.path.join(output_dir, filename)
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(path + '.tmp', path)
+            paths.append(path)
+        return paths
+
+    def print_summary(self):
+        """Prints API call counts, latencies and stage times to the console."""
+        summary = self.summary()
+        print("\n--- Run Metrics ---")
+        for kind, stats in sorted(summary['calls'].items()):
+            mean = stats['latency_sum'] / stats['count'] if stats['count'] else 0.0
+            print(f"{kind:<14} {stats['count']:>7} calls  mean {mean * 1000:7.1f} ms  max {stats['latency_max'] * 1000:7.1f} ms  "
+                  f"{stats['retries']} retries  {stats['failed']} failed  {stats['units']} units  "
+                  f"{stats['response_bytes'] / 1024:.0f} KiB")
+        for name, seconds in summary['stages'].items():
+            print(f"{name:<14} {seconds:8.2f} s")
+        print(f"{'total':<14} {summary['duration_seconds']:8.2f} s")
+
+RUN_METRICS = RunMetrics()
+
+# --- End Run Metrics ---
+
+
+# --- Request Scheduling ---
+
+THROTTLE_REASONS = (b'rateLimitExceeded', b'userRateLimitExceeded')
+
+def is_throttle_error(error):
+    """True if the error means Gmail is rate limiting us (429, or 403 rateLimitExceeded)."""
+    if not isinstance(error, HttpError):
+        return False
+    status = error.resp.status
+    return status == 429 or (status == 403 and any(r in (error.content or b'') for r in THROTTLE_REASONS))
+
+def make_http_error(status, content=b'', reason='', headers=None, uri=None):
+    """Builds an HttpError the way googleapiclient raises it, for API clients other than the service object."""
+    import httplib2
+    resp = httplib2.Response(dict(headers or {}, status=status))
+    resp.reason = reason
+    return HttpError(resp, content, uri=uri)
+
+def is_fatal_error(error):
+    """True for errors that stop a whole scan: an exhausted daily quota or a rejected token (401, 403)."""
+    if not isinstance(error, HttpError) or is_throttle_error(error):
+        return False
+    return error.resp.status in (401, 403)
+
+def is_gone_error(error):
+    """True if the message was deleted after it was listed (404); it no longer counts."""
+    return isinstance(error, HttpError) and error.resp.status == 404
+
+def is_retryable_error(error):
+    """True for throttling, server-side (5xx) and network errors that are worth retrying."""
+    if isinstance(error, HttpError):
+        return is_throttle_error(error) or error.resp.status in (500, 502, 503, 504)
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+class RequestScheduler:
+    """
+    Central scheduler for Gmail API calls.
+
+    - A token bucket limits the quota units spent per second (per user).
+    - Throttled and transient errors are retried with jittered exponential backoff,
+      honoring the Retry-After header when Gmail sends one.
+    - The number of calls in flight adapts AIMD-style: it is halved whenever Gmail
+      throttles us and grows by roughly one per window of successful calls.
+    It is thread-safe; all worker threads share one instance. In multi-account mode,
+    `global_slots` is a semaphore shared by all account processes that caps the total
+    number of calls in flight.
+    """
+
+    def __init__(self, units_per_second=QUOTA_UNITS_PER_SECOND, burst_units=QUOTA_BURST_UNITS,
+                 initial_concurrency=INITIAL_CONCURRENCY, max_concurrency=MAX_CONCURRENCY, max_retries=MAX_RETRIES):
+        self.units_per_second = units_per_second
+        self.burst_units = burst_units
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.concurrency = float(initial_concurrency)
+        self._tokens = float(burst_units)
+        self._last_refill = time.monotonic()
+        self._in_flight = 0
+        self._cond = threading.Condition()
+        # Futures of coroutines waiting for a concurrency slot; resolved (thread-safely) when one may be free
+        self._async_waiters = []
+        self._slot_executor = None
+        self.global_slots = None
+
+    def _acquire(self, units):
+        """Waits for a concurrency slot and for enough quota units, then takes both."""
+        with self._cond:
+            while self._in_flight >= max(1, int(self.concurrency)):
+                self._cond.wait()
+            self._in_flight += 1
+
+            while True:
+                wait = self._take_units(units)
+                if wait == 0:
+                    return
+                self._cond.wait(wait)
+
+    def _take_units(self, units):
+        """Refills the bucket and takes `units` if enough are available (returns 0), else returns the seconds to wait."""
+        now = time.monotonic()
+        self._tokens = min(self.burst_units,
+                           self._tokens + (now - self._last_refill) * self.units_per_second)
+        self._last_refill = now
+        # Calls larger than the bucket (big batches) may drive it negative; later calls then wait.
+        needed = min(units, self.burst_units)
+        if self._tokens >= needed:
+            self._tokens -= units
+            return 0
+        return (needed - self._tokens) / self.units_per_second
+
+    async def _acquire_async(self, units):
+        """
+        Like _acquire, but without blocking the event loop: a coroutine waiting for a concurrency
+        slot awaits a future that _notify resolves, and one waiting for quota units sleeps until
+        they have refilled. The cross-process global_slots semaphore is acquired in a helper thread.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            waiter = None
+            with self._cond:
+                if self._in_flight < max(1, int(self.concurrency)):
+                    wait = self._take_units(units)
+                    if wait == 0:
+                        self._in_flight += 1
+                        break
+                else:
+                    waiter = loop.create_future()
+                    self._async_waiters.append(waiter)
+            if waiter is None:
+                await asyncio.sleep(wait)
+                continue
+            try:
+                await waiter
+            finally:
+                with self._cond:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+        if self.global_slots is not None and not self.global_slots.acquire(False):
+            try:
+                await self._acquire_global_slot(loop)
+            except BaseException:
+                self._release()  # cancelled while waiting; give the local slot back
+                raise
+
+    async def _acquire_global_slot(self, loop):
+        """Waits for a global_slots slot in a dedicated thread, so waiting coroutines cannot use up the default executor."""
+        if self._slot_executor is None:
+            self._slot_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='global-slots')
+        acquiring = loop.run_in_executor(self._slot_executor, self.global_slots.acquire)
+        try:
+            await asyncio.shield(acquiring)
+        except asyncio.CancelledError:
+            # The thread still takes the slot; hand it back once it has it
+            acquiring.add_done_callback(lambda future: future.cancelled() or self.global_slots.release())
+            raise
+
+    def _notify(self):
+        """Wakes the threads and coroutines waiting for a concurrency slot. Call with self._cond held."""
+        self._cond.notify_all()
+        for waiter in self._async_waiters:
+            waiter.get_loop().call_soon_threadsafe(lambda w=waiter: w.done() or w.set_result(None))
+        self._async_waiters.clear()
+
+    def _release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._notify()
+
+    def record_success(self):
+        """Additive increase of the concurrency limit."""
+        with self._cond:
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            self._notify()
+
+    def record_throttle(self):
+        """Multiplicative decrease of the concurrency limit."""
+        with self._cond:
+            self.concurrency = max(1.0, self.concurrency / 2)
+
+    def backoff_delay(self, attempt, error=None):
+        """Seconds to wait before retry number `attempt` (1-based)."""
+        retry_after = None
+        if isinstance(error, HttpError):
+            retry_after = error.resp.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass  # HTTP-date form; fall back to exponential backoff
+        # "Full jitter" exponential backoff
+        return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+
+    def execute(self, request, kind=None, units=None):
+        """
+        Executes an API request (or batch) under the rate limit, retrying throttled and transient errors.
+        `kind` is a QUOTA_UNITS key; `units` overrides the cost (used for batches).
+        Raises the last error if the request still fails after max_retries retries.
+        """
+        if units is None:
+            units = QUOTA_UNITS.get(kind, 5)
+
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            self._acquire(units)
+            if self.global_slots is not None:
+                self.global_slots.acquire()
+            try:
+                response = request.execute()
+            except Exception as error:
+                if not is_retryable_error(error) or attempt >= self.max_retries:
+                    RUN_METRICS.record_call(kind or 'batch', time.perf_counter() - started, retries=attempt,
+                                            units=units * (attempt + 1), failed=True)
+                    raise
+                if is_throttle_error(error):
+                    self.record_throttle()
+                attempt += 1
+                delay = self.backoff_delay(attempt, error)
+            else:
+                self.record_success()
+                RUN_METRICS.record_call(kind or 'batch', time.perf_counter() - started, retries=attempt,
+                                        units=units * (attempt + 1))
+                return response
+            finally:
+                if self.global_slots is not None:
+                    self.global_slots.release()
+                self._release()
+            # Sleep outside the concurrency slot so other calls can proceed.
+            time.sleep(delay)
+
+    async def execute_async(self, send, kind=None, units=None):
+        """
+        asyncio counterpart of execute(): `send` is a coroutine function that performs one
+        attempt of the call (see AsyncGmailClient). Same quota, retry and concurrency rules.
+        """
+        if units is None:
+            units = QUOTA_UNITS.get(kind, 5)
+
+        started = time.perf_counter()
+        attempt = 0
+        while True:
+            await self._acquire_async(units)
+            try:
+                response = await send()
+            except Exception as error:
+                if not is_retryable_error(error) or attempt >= self.max_retries:
+                    RUN_METRICS.record_call(kind, time.perf_counter() - started, retries=attempt,
+                                            units=units * (attempt + 1), failed=True)
+                    raise
+                if is_throttle_error(error):
+                    self.record_throttle()
+                attempt += 1
+                delay = self.backoff_delay(attempt, error)
+            else:
+                self.record_success()
+                RUN_METRICS.record_call(kind, time.perf_counter() - started, retries=attempt,
+                                        units=units * (attempt + 1))
+                return response
+            finally:
+                if self.global_slots is not None:
+                    self.global_slots.release()
+                self._release()
+            await asyncio.sleep(delay)
+
+REQUEST_SCHEDULER = RequestScheduler()
+
+# --- End Request Scheduling ---
+
+def get_credentials(token_file=TOKEN_FILE, credentials_file=CREDENTIALS_FILE, interactive=True):
+    """
+    Loads, refreshes or (via the console flow) creates the user's OAuth credentials.
+    With interactive=False no console flow is started; None is returned if the token cannot be used.
+    """
     creds = None
     # The token.json file stores the user's access and refresh tokens.
-    if os.path.exists(TOKEN_FILE):
-        creds = Credentials.from_authorized_user_file(TOKEN_FILE, SCOPES)
+    if os.path.exists(token_file):
+        from google.oauth2.credentials import Credentials
+        creds = Credentials.from_authorized_user_file(token_file, SCOPES)
     
     # If there are no (valid) credentials available, or they are expired, handle login/refresh.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
+            from google.auth.transport.requests import Request
             print("Refreshing existing token...")
             creds.refresh(Request())
         else:
-            if not os.path.exists(CREDENTIALS_FILE):
-                print(f"Error: {CREDENTIALS_FILE} not found.")
+            if not interactive:
+                print(f"Error: {token_file} is missing or cannot be refreshed; run the script once for this account.")
+                return None
+            if not os.path.exists(credentials_file):
+                print(f"Error: {credentials_file} not found.")
                 print("Please download your credentials file from the Google API Console.")
                 return None
             
+            from google_auth_oauthlib.flow import InstalledAppFlow
+
             # Use 'urn:ietf:wg:oauth:2.0:oob' (Out-of-Band) for reliable manual console flow.
             flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_FILE, SCOPES)
+                credentials_file, SCOPES)
             
             # Set the redirect URI for the Out-of-Band flow (copy/paste from browser).
             flow.redirect_uri = 'urn:ietf:wg:oauth:2.0:oob'
@@ -132,145 +1009,2017 @@ def authenticate_gmail():
                 return None
         
         # Save the credentials for the next run
-        with open(TOKEN_FILE, 'w') as token:
-            token.write(creds.to_json())
-            print(f"Token saved to {TOKEN_FILE}.")
-            
+        save_token(creds, token_file)
+        print(f"Token saved to {token_file}.")
+
+    return creds
+
+def save_token(creds, token_file):
+    """Writes the credentials to token_file atomically, so a crash never leaves a truncated token."""
+    with open(token_file + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(creds.to_json())
+    os.replace(token_file + '.tmp', token_file)
+
+# --- HTTP Transport ---
+
+class SharedCredentials:
+    """
+    Holds an account's OAuth credentials for all of its worker threads (and the async client).
+    The access token is refreshed TOKEN_REFRESH_MARGIN_SECONDS before it expires, by a single
+    thread under a lock; the others keep using the still-valid token meanwhile and only wait
+    if it has actually expired. Refreshed tokens are saved to token_file.
+    """
+
+    def __init__(self, creds, token_file=None, refresh_margin=TOKEN_REFRESH_MARGIN_SECONDS):
+        self.creds = creds
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+
+    def expires_within(self, seconds):
+        if self.creds.token is None:
+            return True
+        expiry = self.creds.expiry  # naive UTC, as google-auth stores it
+        if expiry is None:
+            return False
+        return expiry - datetime.now(timezone.utc).replace(tzinfo=None) <= timedelta(seconds=seconds)
+
+    def needs_refresh(self):
+        return self.expires_within(self.refresh_margin)
+
+    def access_token(self):
+        """Returns a valid access token, refreshing it first if it is about to expire."""
+        if self.needs_refresh():
+            # Block only when the current token can no longer be used
+            if self._lock.acquire(blocking=self.expires_within(0)):
+                try:
+                    if self.needs_refresh():  # not already refreshed by another thread
+                        self._refresh()
+                finally:
+                    self._lock.release()
+        return self.creds.token
+
+    def invalidate(self, token):
+        """Refreshes the credentials after `token` was rejected, unless another thread already replaced it."""
+        with self._lock:
+            if self.creds.token == token:
+                self._refresh()
+
+    def _refresh(self):
+        from google.auth.transport.requests import Request
+        from google.auth.exceptions import RefreshError
+        try:
+            self.creds.refresh(Request())
+        except RefreshError as error:
+            # Surfaced like the API's own auth errors, so callers report it instead of crashing
+            raise make_http_error(401, str(error).encode(), 'Token refresh failed') from error
+        if self.token_file:
+            save_token(self.creds, self.token_file)
+
+class PooledHttp:
+    """
+    httplib2-compatible transport for the Gmail service objects on a requests.Session, whose
+    urllib3 pool keeps up to pool_size connections alive. The session is thread-safe, so every
+    service object of an account shares one PooledHttp (and its connections); each request is
+    authorized with a token from the account's SharedCredentials.
+    """
+
+    def __init__(self, shared_creds, pool_size=HTTP_POOL_SIZE, timeout=HTTP_TIMEOUT_SECONDS):
+        import requests
+        self.requests = requests
+        self.shared_creds = shared_creds
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        import httplib2
+        headers = dict(headers or {})
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        for attempt in range(2):
+            token = self.shared_creds.access_token()
+            headers['authorization'] = f"Bearer {token}"
+            try:
+                response = self.session.request(method, uri, data=body, headers=headers,
+                                                timeout=self.timeout, allow_redirects=redirections > 0)
+            except self.requests.Timeout as error:
+                # Retried by the scheduler like httplib2's socket errors
+                raise TimeoutError(f"{type(error).__name__}: {error}") from error
+            except self.requests.ConnectionError as error:
+                raise ConnectionError(f"{type(error).__name__}: {error}") from error
+            if response.status_code == 401 and attempt == 0:
+                self.shared_creds.invalidate(token)  # token revoked or expired early
+                continue
+            break
+        RUN_METRICS.add(api_call_kind(uri), response_bytes=len(response.content))
+        # requests has already decoded a gzip body, so the encoding header no longer applies
+        info = {key.lower(): value for key, value in response.headers.items() if key.lower() != 'content-encoding'}
+        resp = httplib2.Response(dict(info, status=response.status_code))
+        resp.reason = response.reason
+        return resp, response.content
+
+    def close(self):
+        self.session.close()
+
+# --- End HTTP Transport ---
+
+_discovery_document = None
+
+def load_discovery_document():
+    """
+    Returns the Gmail v1 discovery document bundled with google-api-python-client, read once
+    per process. Building a service never fetches the document, and it always matches the
+    installed library version.
+    """
+    global _discovery_document
+    if _discovery_document is None:
+        from googleapiclient.discovery_cache import get_static_doc
+        _discovery_document = get_static_doc('gmail', 'v1')
+        if _discovery_document is None:
+            raise RuntimeError("No bundled Gmail discovery document found; upgrade google-api-python-client.")
+    return _discovery_document
+
+def build_gmail(http):
+    """Builds a Gmail service object on the given PooledHttp from the cached discovery document (no discovery request)."""
+    from googleapiclient.discovery import build_from_document
+    return build_from_document(load_discovery_document(), http=http)
+
+def build_service(http):
+    """Builds a Gmail API service object on the given PooledHttp."""
     try:
         # Build the Gmail service
-        service = build('gmail', 'v1', credentials=creds)
+        service = build_gmail(http)
         return service
     except HttpError as error:
         print(f"An HTTP error occurred: {error}")
         return None
 
-def get_messages_count(service, user_id='me', search_query=''):
+def open_transport(creds, token_file=TOKEN_FILE, pool_size=HTTP_POOL_SIZE):
+    """Wraps an account's credentials in its SharedCredentials and pooled transport."""
+    return PooledHttp(SharedCredentials(creds, token_file), pool_size=pool_size)
+
+def authenticate_gmail():
+    """Shows user authentication flow using console and returns a Gmail API service object."""
+    creds = get_credentials()
+    if not creds:
+        return None
+    return build_service(open_transport(creds))
+
+class ThreadLocalServices:
+    """
+    Hands out one Gmail service object per thread, all on the same PooledHttp (connection
+    pool and SharedCredentials). `creds` is the SharedCredentials, for the async client.
+    With a `recorder`, the service objects record their responses (see RecordingService).
+    """
+
+    def __init__(self, http, recorder=None):
+        self.http = http
+        self.creds = http.shared_creds
+        self.recorder = recorder
+        self._local = threading.local()
+
+    def get(self):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = build_gmail(self.http)
+            if self.recorder is not None:
+                service = RecordingService(service, self.recorder)
+            self._local.service = service
+        return service
+
+def iter_message_pages(service, query, user_id='me', page_size=LIST_PAGE_SIZE, page_token=None):
+    """
+    Yields the raw messages.list responses for the query, one page at a time, as the pages arrive.
+    Only the message IDs, the page token and the result estimate are requested, so each page is small.
+    Listing starts at page_token if one is given (e.g. from a ScanCheckpoint).
+    Raises HttpError if a page cannot be fetched.
+    """
+
+    while True:
+        # Call the list method with the query. 
+        with RUN_METRICS.stage('listing'):
+            response = REQUEST_SCHEDULER.execute(service.users().messages().list(
+                userId=user_id, 
+                q=query, 
+                maxResults=page_size,
+                fields=LIST_FIELDS,
+                pageToken=page_token
+            ), 'messages.list')
+
+        yield response
+
+        # Get the token for the next page. If no token, we are done.
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+def iter_message_ids(service, query, user_id='me', page_size=LIST_PAGE_SIZE):
+    """
+    Yields the IDs of all messages matching the query as the pages arrive.
+    Raises HttpError if a page cannot be fetched.
+    """
+    for response in iter_message_pages(service, query, user_id=user_id, page_size=page_size):
+        for msg in response.get('messages', []):
+            yield msg['id']
+
+def get_messages_count(service, user_id='me', search_query=''):
+    """
+    Counts the EXACT number of emails matching a specific search query 
+    by iterating through all pages (without keeping the message IDs in memory).
+    """
+    try:
+        return sum(1 for _ in iter_message_ids(service, search_query, user_id=user_id))
+    except HttpError as error:
+        print(f"An error occurred during the API call: {error}")
+        return 0
+
+def fetch_message_metadata(service, message_ids, user_id='me', batch_size=METADATA_BATCH_SIZE, fields=METADATA_FIELDS,
+                           metadata_headers=METADATA_HEADERS, show_progress=True):
+    """
+    Fetches metadata for the given message IDs using Gmail batch requests
+    (up to 100 'get' calls per HTTP round trip).
+    Returns a tuple (metadata, errors): metadata maps message ID -> response dict,
+    errors maps message ID -> the exception raised for that message.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    metadata = {}
+    errors = {}
+    total = len(message_ids)
+
+    for start in range(0, total, batch_size):
+        pending = message_ids[start:start + batch_size]
+        attempt = 0
+
+        while pending:
+            retry = {}
+
+            def handle_response(request_id, response, exception):
+                # Called once per message in the batch; request_id is the message ID.
+                if exception is None:
+                    metadata[request_id] = response
+                elif is_retryable_error(exception):
+                    retry[request_id] = exception
+                else:
+                    errors[request_id] = exception
+
+            batch = service.new_batch_http_request(callback=handle_response)
+            for msg_id in pending:
+                batch.add(
+                    service.users().messages().get(
+                        userId=user_id,
+                        id=msg_id,
+                        format='metadata',
+                        metadataHeaders=metadata_headers,
+                        fields=fields
+                    ),
+                    request_id=msg_id
+                )
+
+            try:
+                with RUN_METRICS.stage('metadata'):
+                    REQUEST_SCHEDULER.execute(batch, 'batch', units=QUOTA_UNITS['messages.get'] * len(pending))
+            except HttpError as error:
+                # The whole batch failed; record the error against every message in it.
+                for msg_id in pending:
+                    errors[msg_id] = error
+                break
+
+            if not retry:
+                break
+
+            # Individual calls inside the batch were throttled; retry just those after a backoff.
+            RUN_METRICS.add('batch', retries=len(retry))
+            attempt += 1
+            if attempt > REQUEST_SCHEDULER.max_retries:
+                errors.update(retry)
+                break
+            first_error = next(iter(retry.values()))
+            if any(is_throttle_error(e) for e in retry.values()):
+                REQUEST_SCHEDULER.record_throttle()
+            with RUN_METRICS.stage('metadata'):
+                time.sleep(REQUEST_SCHEDULER.backoff_delay(attempt, first_error))
+            pending = list(retry)
+
+        # Print progress update
+        if show_progress:
+            print(f"Progress: {min(start + batch_size, total)}/{total} messages analyzed...", end='\r', flush=True)
+
+    return metadata, errors
+
+def list_message_ids(service, query, user_id='me'):
+    """
+    Lists the IDs of all messages matching the query by iterating through all pages.
+    Raises HttpError if a page cannot be fetched.
+    """
+    return list(iter_message_ids(service, query, user_id=user_id))
+
+def resolve_message_records(service, message_ids, batch_size=METADATA_BATCH_SIZE, cache=None, require_headers=False,
+                            show_progress=True):
+    """
+    Looks the given IDs up in the cache and fetches the rest with batched requests.
+    Returns (records, errors, cached_count) without printing a summary.
+    """
+    records = cache.get_many(message_ids) if cache is not None else {}
+    if require_headers:
+        records = {msg_id: r for msg_id, r in records.items() if r['subject'] is not None}
+    cached_count = len(records)
+    missing_ids = [msg_id for msg_id in message_ids if msg_id not in records]
+
+    # Fetch internalDate for the remaining messages using batched requests
+    metadata, errors = fetch_message_metadata(service, missing_ids, batch_size=batch_size, show_progress=show_progress)
+    fetched = {msg_id: metadata_to_record(resp) for msg_id, resp in metadata.items() if resp.get('internalDate')}
+    if cache is not None:
+        cache.put_many(fetched)
+    records.update(fetched)
+    return records, errors, cached_count
+
+def report_fetch_errors(errors):
+    """Prints a short summary of messages whose metadata could not be fetched."""
+    if errors:
+        print(f"\nWarning: {len(errors)} message(s) could not be fetched and were skipped.")
+        for msg_id, error in list(errors.items())[:5]:
+            print(f"  - {msg_id}: {error}")
+
+def get_message_records(service, message_ids, batch_size=METADATA_BATCH_SIZE, cache=None, require_headers=False):
+    """
+    Returns {message_id: record} for the given IDs, where a record holds the internalDate
+    and headers (see metadata_to_record). Messages already in the cache are not fetched again,
+    unless require_headers is set and the cached record was stored without headers.
+    Messages that could not be fetched are reported and left out of the result.
+    """
+    records, errors, cached_count = resolve_message_records(
+        service, message_ids, batch_size=batch_size, cache=cache, require_headers=require_headers
+    )
+    if cache is not None:
+        print(f"Cache: {cached_count} of {len(message_ids)} messages already known, "
+              f"fetched {len(message_ids) - cached_count}.")
+    report_fetch_errors(errors)
+    return records
+
+def get_timestamps_for_ids(service, message_ids, batch_size=METADATA_BATCH_SIZE, cache=None):
+    """Returns the internalDate (epoch milliseconds, int64 array) of the given message IDs."""
+    if not message_ids:
+        return np.empty(0, dtype=np.int64)
+
+    records = get_message_records(service, message_ids, batch_size=batch_size, cache=cache)
+    return records_to_timestamps(message_ids, records)
+
+def records_to_timestamps(message_ids, records):
+    """Returns the internalDate of each message in message_ids as an int64 epoch-ms array, skipping unknown IDs."""
+    return np.fromiter(
+        (records[msg_id]['internalDate'] for msg_id in message_ids if msg_id in records),
+        dtype=np.int64
+    )
+
+def iter_checkpointed_ids(service, query, checkpoint):
+    """
+    Like iter_message_ids, but starts at the checkpoint's page token and records the token of
+    each page in checkpoint.listing_token before yielding its IDs.
+    """
+    page_token = checkpoint.page_token
+    pages = iter_message_pages(service, query, page_token=page_token)
+    try:
+        first_page = next(pages)
+    except HttpError as error:
+        if not page_token or error.resp.status != 400:
+            raise
+        # Page tokens expire; list from the start again (processed messages are still skipped)
+        print("Stored page token is no longer valid; listing from the first page.")
+        page_token = None
+        pages = iter_message_pages(service, query)
+        first_page = next(pages)
+
+    for response in itertools.chain([first_page], pages):
+        checkpoint.listing_token = page_token
+        for msg in response.get('messages', []):
+            yield msg['id']
+        page_token = response.get('nextPageToken')
+
+def scan_message_dates(service, full_query, batch_size=METADATA_BATCH_SIZE, cache=None, message_ids=None,
+                       on_batch=None, checkpoint=None):
+    """
+    Lists the messages matching the full query and fetches their internal dates in one pass.
+    Metadata for each batch of `batch_size` IDs is resolved (from the cache or the API) as soon
+    as the batch is listed, so fetching starts with the first page of results.
+    `message_ids` may be an iterable of IDs (e.g. a sharded listing) to use instead of listing full_query.
+    `on_batch(chunk_ids, records)` is called for every resolved batch (e.g. to stream rows to an export).
+    With a ScanCheckpoint, progress is saved as batches complete and messages it already lists as
+    processed are skipped; the listing resumes at its page token unless `message_ids` is given.
+    Returns (total_count, timestamps), where total_count is the number of matching messages and
+    timestamps is an int64 array of their internalDate in epoch milliseconds.
+    Raises IncompleteScanError (after saving the checkpoint) if the listing fails, the quota is
+    exhausted, the token is rejected or some messages could not be fetched.
+    """
+    print("\nStarting analysis of message dates (this may take a moment)...")
+
+    listed_count = 0
+    cached_count = 0
+    # One compact int64 array per processed batch, concatenated at the end
+    timestamp_chunks = []
+    errors = {}
+
+    if checkpoint is not None and checkpoint.done_ids:
+        print(f"Resuming from checkpoint: {len(checkpoint.done_ids)} messages already processed.")
+        listed_count = len(checkpoint.done_ids)
+        timestamp_chunks.append(checkpoint.timestamps())
+        replay_checkpoint(checkpoint, cache, on_batch, batch_size)
+
+    def process(chunk):
+        nonlocal cached_count
+        records, chunk_errors, chunk_cached = resolve_message_records(
+            service, chunk, batch_size=batch_size, cache=cache, show_progress=False
+        )
+        cached_count += chunk_cached
+        # Deleted messages are done; everything else that failed is fetched again on resume
+        failed = {msg_id: error for msg_id, error in chunk_errors.items() if not is_gone_error(error)}
+        errors.update(failed)
+        timestamps = records_to_timestamps(chunk, records)
+        timestamp_chunks.append(timestamps)
+        if on_batch is not None:
+            on_batch(chunk, records)
+        if checkpoint is not None:
+            checkpoint.add_processed([msg_id for msg_id in chunk if msg_id not in failed], timestamps,
+                                     failed=bool(failed))
+            checkpoint.maybe_save()
+        fatal = next((error for error in failed.values() if is_fatal_error(error)), None)
+        if fatal is not None:
+            raise fatal  # quota or token: every further call would fail the same way
+        print(f"Progress: {listed_count} messages analyzed...", end='\r', flush=True)
+
+    chunk = []
+    try:
+        if message_ids is None:
+            if checkpoint is not None:
+                message_ids = iter_checkpointed_ids(service, full_query, checkpoint)
+            else:
+                message_ids = iter_message_ids(service, full_query)
+        for msg_id in message_ids:
+            if checkpoint is not None and msg_id in checkpoint.done_ids:
+                continue
+            listed_count += 1
+            chunk.append(msg_id)
+            if len(chunk) >= batch_size:
+                process(chunk)
+                chunk = []
+        if chunk:
+            process(chunk)
+    except HttpError as error:
+        report_fetch_errors(errors)
+        raise IncompleteScanError(f"the date scan stopped: {error}{save_scan_progress(checkpoint)}") from error
+    except BaseException:
+        # Crash or Ctrl-C: keep everything processed so far for --resume
+        if checkpoint is not None:
+            checkpoint.save()
+            print("\nProgress was saved; run again with --resume to continue the scan.")
+        raise
+
+    if errors:
+        # The count would no longer match the dates; keep the checkpoint so --resume retries them
+        report_fetch_errors(errors)
+        raise IncompleteScanError(f"{len(errors)} message(s) could not be fetched{save_scan_progress(checkpoint)}")
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    timestamps = concat_timestamps(timestamp_chunks)
+    if listed_count:
+        if cache is not None:
+            print(f"\nCache: {cached_count} of {listed_count} messages already known.", end='')
+        print("\nDate analysis complete.")
+    # Messages deleted since they were listed are not counted, so the total matches the dates
+    return len(timestamps), timestamps
+
+def concat_timestamps(chunks):
+    """Joins per-batch timestamp arrays into one int64 array."""
+    if not chunks:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate(chunks)
+
+def get_message_dates(service, full_query, batch_size=METADATA_BATCH_SIZE, cache=None):
+    """
+    Fetches all messages matching the full query and extracts their internal dates.
+    Metadata is fetched in batches of `batch_size` messages. If a MessageCache is given,
+    only messages not already in the cache are fetched from the API.
+    Returns an int64 array of internalDate values in epoch milliseconds.
+    """
+    _, timestamps = scan_message_dates(service, full_query, batch_size=batch_size, cache=cache)
+    return timestamps
+
+# --- Time-Sharded Listing ---
+
+def split_date_window(days_back, shards):
+    """
+    Splits the look-back window into `shards` consecutive (start, end) date ranges.
+    The first range starts on the same day as create_date_query's after: filter and the
+    last one ends tomorrow, so together they cover the whole window without gaps.
+    """
+    first_day = (datetime.now() - timedelta(days=days_back)).date()
+    end_day = datetime.now().date() + timedelta(days=1)
+    total_days = (end_day - first_day).days
+    shards = max(1, min(shards, total_days))
+
+    boundaries = [first_day + timedelta(days=round(i * total_days / shards)) for i in range(shards + 1)]
+    return [(boundaries[i], boundaries[i + 1]) for i in range(shards)]
+
+def list_shard(services, base_query, window, split_threshold=SHARD_SPLIT_THRESHOLD):
+    """
+    Lists one date shard (after: start, before: end) on the calling thread's own service.
+    Returns (message_ids, sub_windows). If the shard's first page estimates more than
+    split_threshold results, it is not listed further; instead it is split into two halves
+    that the caller should list separately.
+    """
+    start, end = window
+    query = f"({base_query}) after:{start.strftime('%Y/%m/%d')} before:{end.strftime('%Y/%m/%d')}"
+    pages = iter_message_pages(services.get(), query)
+
+    first_page = next(pages)
+    days = (end - start).days
+    if first_page.get('resultSizeEstimate', 0) > split_threshold and days > 1:
+        middle = start + timedelta(days=days // 2)
+        return [], [(start, middle), (middle, end)]
+
+    message_ids = [msg['id'] for msg in first_page.get('messages', [])]
+    for response in pages:
+        message_ids.extend(msg['id'] for msg in response.get('messages', []))
+    return message_ids, []
+
+def iter_message_ids_sharded(services, base_query, days_back, shards, workers=SHARD_WORKERS,
+                             split_threshold=SHARD_SPLIT_THRESHOLD):
+    """
+    Yields the IDs of messages matching base_query within the look-back window by listing
+    date shards in parallel. Dense shards are split adaptively based on Gmail's result estimate.
+    IDs are yielded as each shard completes, deduplicated by message ID.
+    Raises HttpError if any shard cannot be listed.
+    """
+    seen = set()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {
+            pool.submit(list_shard, services, base_query, window, split_threshold): window
+            for window in split_date_window(days_back, shards)
+        }
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del pending[future]
+                    message_ids, sub_windows = future.result()
+                    for window in sub_windows:
+                        pending[pool.submit(list_shard, services, base_query, window, split_threshold)] = window
+                    for msg_id in message_ids:
+                        if msg_id not in seen:
+                            seen.add(msg_id)
+                            yield msg_id
+        finally:
+            for future in pending:
+                future.cancel()
+
+def resolve_shard_count(shards, days_back):
+    """Turns the --shards option ('auto' or a number) into a number of shards."""
+    if shards == 'auto':
+        return max(1, round(days_back / AUTO_SHARD_DAYS))
+    return max(1, int(shards))
+
+def iter_window_ids(service, base_query, days_back, shards=1, services=None):
+    """
+    Yields the IDs of messages matching base_query within the look-back window,
+    using a parallel time-sharded listing when shards > 1.
+    """
+    if shards > 1 and services is not None:
+        return iter_message_ids_sharded(services, base_query, days_back, shards)
+    return iter_message_ids(service, create_date_query(base_query, days_back))
+
+# --- End Time-Sharded Listing ---
+
+# --- Async Backend ---
+
+class AsyncGmailClient:
+    """
+    Minimal asyncio Gmail client (messages.list and messages.get) on an httpx.AsyncClient
+    with a pool of keep-alive connections. It uses the same OAuth credentials as the
+    synchronous service (a SharedCredentials, refreshed before they expire). Non-2xx responses are raised
+    as HttpError, so the scheduler's retry rules apply unchanged. With a `recorder`
+    (see ApiRecorder), every successful response is also written to the --record archive.
+    """
+
+    def __init__(self, creds, user_id='me', max_connections=ASYNC_MAX_CONNECTIONS, api_root=None, recorder=None):
+        try:
+            import httpx
+        except ImportError:
+            raise RuntimeError("--backend async requires httpx. Run 'pip install httpx'.")
+        self.httpx = httpx
+        self.creds = creds
+        self.recorder = recorder
+        self.client = httpx.AsyncClient(
+            base_url=f"{api_root or GMAIL_API_ROOT}{user_id}/",
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=ASYNC_TIMEOUT_SECONDS,
+        )
+
+    async def _access_token(self):
+        # A refresh blocks on the token endpoint, so it runs off the event loop
+        if self.creds.needs_refresh():
+            return await asyncio.to_thread(self.creds.access_token)
+        return self.creds.access_token()
+
+    async def get_json(self, path, params, kind):
+        """GETs path (relative to the user's API root) and returns the decoded JSON response; kind is its metrics call type."""
+        for attempt in range(2):
+            token = await self._access_token()
+            try:
+                response = await self.client.get(path, params=params, headers={'Authorization': f"Bearer {token}"})
+            except self.httpx.TransportError as error:
+                # Retried by the scheduler like the synchronous client's network errors
+                raise ConnectionError(f"{type(error).__name__}: {error}") from error
+            if response.status_code == 401 and attempt == 0:
+                await asyncio.to_thread(self.creds.invalidate, token)  # token revoked or expired early
+                continue
+            break
+        RUN_METRICS.add(kind, response_bytes=len(response.content))
+        if response.status_code >= 400:
+            headers = {key.lower(): value for key, value in response.headers.items()}
+            raise make_http_error(response.status_code, response.content, response.reason_phrase, headers,
+                                  uri=str(response.url))
+        return response.json()
+
+    async def list_messages(self, query, page_token=None, page_size=LIST_PAGE_SIZE):
+        params = {'q': query, 'maxResults': page_size, 'fields': LIST_FIELDS}
+        if page_token:
+            params['pageToken'] = page_token
+        response = await self.get_json('messages', params, 'messages.list')
+        if self.recorder is not None:
+            self.recorder.record_list(query, page_token, response)
+        return response
+
+    async def get_metadata(self, msg_id, fields=METADATA_FIELDS, metadata_headers=METADATA_HEADERS):
+        params = {'format': 'metadata', 'metadataHeaders': list(metadata_headers), 'fields': fields}
+        response = await self.get_json(f"messages/{msg_id}", params, 'messages.get')
+        if self.recorder is not None:
+            self.recorder.record_get(msg_id, response)
+        return response
+
+    async def aclose(self):
+        await self.client.aclose()
+
+class ScanAggregator:
+    """
+    Collects the async pipeline's results as they arrive: the running counts, one int64
+    timestamp chunk per flush, cache writes and on_batch calls. Fetched records are
+    flushed in groups of flush_size so the cache and exports see batch-sized writes.
+    """
+
+    def __init__(self, cache=None, on_batch=None, flush_size=METADATA_BATCH_SIZE, checkpoint=None):
+        self.cache = cache
+        self.on_batch = on_batch
+        self.checkpoint = checkpoint
+        self.flush_size = flush_size
+        self.listed = 0
+        self.cached = 0
+        self.fetched = 0
+        self.errors = {}
+        self.timestamp_chunks = []
+        self._pending = {}
+
+    def add_listed(self, message_ids):
+        """Counts newly listed IDs and returns those that still need to be fetched."""
+        self.listed += len(message_ids)
+        records = self.cache.get_many(message_ids) if self.cache is not None else {}
+        if records:
+            self.cached += len(records)
+            self._add(list(records), records)
+        return [msg_id for msg_id in message_ids if msg_id not in records]
+
+    def add_fetched(self, msg_id, record):
+        self._pending[msg_id] = record
+        if len(self._pending) >= self.flush_size:
+            self.flush()
+
+    def add_error(self, msg_id, error):
+        if is_gone_error(error):
+            # Deleted since it was listed: done, but not counted
+            if self.checkpoint is not None:
+                self.checkpoint.done_ids.add(msg_id)
+            return
+        # Left unprocessed, so a resumed scan fetches it again
+        self.errors[msg_id] = error
+
+    def flush(self):
+        if not self._pending:
+            return
+        records, self._pending = self._pending, {}
+        self.fetched += len(records)
+        if self.cache is not None:
+            self.cache.put_many(records)
+        self._add(list(records), records)
+        print(f"Progress: {self.cached + self.fetched}/{self.listed} messages analyzed...", end='\r', flush=True)
+
+    def _add(self, message_ids, records):
+        timestamps = records_to_timestamps(message_ids, records)
+        self.timestamp_chunks.append(timestamps)
+        if self.on_batch is not None:
+            self.on_batch(message_ids, records)
+        if self.checkpoint is not None:
+            self.checkpoint.add_processed(message_ids, timestamps)
+            self.checkpoint.maybe_save()
+
+async def scan_message_dates_async(creds, base_query, days_back, cache=None, shards=1, workers=ASYNC_FETCH_WORKERS,
+                                   queue_size=ASYNC_QUEUE_SIZE, on_batch=None, checkpoint=None, recorder=None):
+    """
+    asyncio version of scan_message_dates over the look-back window. One listing coroutine per
+    date shard puts uncached message IDs into a bounded queue (so listing pauses while the
+    fetchers are behind), `workers` coroutines fetch their metadata, and a ScanAggregator
+    updates the results as each message arrives. If one shard's listing fails, the other
+    shards keep listing and everything listed is still fetched. A quota or auth error, or a
+    cancellation (Ctrl-C), cancels all coroutines. Either way the records fetched so far are
+    flushed to the cache and the HTTP connections are closed. With a ScanCheckpoint, messages
+    it lists as processed are skipped (the listing itself starts over) and progress is saved
+    as results arrive. With an ApiRecorder, the API responses are written to its archive.
+    Returns (total_count, timestamps) like scan_message_dates, and raises IncompleteScanError
+    in the same cases.
+    """
+    print("\nStarting analysis of message dates (async backend)...")
+    if shards > 1:
+        queries = [f"({base_query}) after:{start.strftime('%Y/%m/%d')} before:{end.strftime('%Y/%m/%d')}"
+                   for start, end in split_date_window(days_back, shards)]
+    else:
+        queries = [create_date_query(base_query, days_back)]
+
+    client = AsyncGmailClient(creds, recorder=recorder)
+    aggregator = ScanAggregator(cache=cache, on_batch=on_batch, checkpoint=checkpoint)
+    queue = asyncio.Queue(maxsize=queue_size)
+    seen = set()
+    if checkpoint is not None and checkpoint.done_ids:
+        print(f"Resuming from checkpoint: {len(checkpoint.done_ids)} messages already processed.")
+        seen.update(checkpoint.done_ids)
+        aggregator.listed = len(checkpoint.done_ids)
+        aggregator.timestamp_chunks.append(checkpoint.timestamps())
+        replay_checkpoint(checkpoint, cache, on_batch)
+
+    async def list_window(query):
+        page_token = None
+        while True:
+            with RUN_METRICS.stage('listing'):
+                response = await REQUEST_SCHEDULER.execute_async(
+                    functools.partial(client.list_messages, query, page_token), 'messages.list')
+            new_ids = [msg['id'] for msg in response.get('messages', []) if msg['id'] not in seen]
+            seen.update(new_ids)
+            for msg_id in aggregator.add_listed(new_ids):
+                await queue.put(msg_id)  # waits while the queue is full (backpressure)
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                break
+
+    async def fetch_worker():
+        while True:
+            msg_id = await queue.get()
+            if msg_id is None:
+                return
+            try:
+                with RUN_METRICS.stage('metadata'):
+                    response = await REQUEST_SCHEDULER.execute_async(
+                        functools.partial(client.get_metadata, msg_id), 'messages.get')
+            except (HttpError, ConnectionError, TimeoutError) as error:
+                aggregator.add_error(msg_id, error)
+                if is_fatal_error(error):
+                    raise  # quota or token: stops the whole scan
+            else:
+                aggregator.add_fetched(msg_id, metadata_to_record(response))
+
+    async def list_all():
+        # A failed shard must not stop the others; their IDs are still fetched
+        results = await asyncio.gather(*listers, return_exceptions=True)
+        for _ in fetchers:
+            await queue.put(None)
+        return [result for result in results if isinstance(result, BaseException)]
+
+    listers = [asyncio.ensure_future(list_window(query)) for query in queries]
+    fetchers = [asyncio.ensure_future(fetch_worker()) for _ in range(max(1, workers))]
+    listing = asyncio.ensure_future(list_all())
+    tasks = [listing, *listers, *fetchers]
+    failure = None
+    try:
+        try:
+            # Returns early only if a fetcher stopped on a quota or auth error
+            await asyncio.wait([listing, *fetchers], return_when=asyncio.FIRST_EXCEPTION)
+            failure = next((task.exception() for task in fetchers if task.done() and task.exception()), None)
+            if failure is None and listing.result():
+                failure = listing.result()[0]
+                print(f"Error fetching message IDs for date analysis: {failure}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            aggregator.flush()
+            await client.aclose()
+    except BaseException:
+        # Crash or Ctrl-C: keep everything fetched so far for --resume
+        if checkpoint is not None:
+            checkpoint.save()
+            print("\nProgress was saved; run again with --resume to continue the scan.")
+        raise
+
+    report_fetch_errors(aggregator.errors)
+    if failure is not None:
+        raise IncompleteScanError(f"the date scan stopped: {failure}{save_scan_progress(checkpoint)}") from failure
+    if aggregator.errors:
+        # The count would no longer match the dates; keep the checkpoint so --resume retries them
+        raise IncompleteScanError(f"{len(aggregator.errors)} message(s) could not be fetched"
+                                  f"{save_scan_progress(checkpoint)}")
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    timestamps = concat_timestamps(aggregator.timestamp_chunks)
+    if aggregator.listed:
+        if cache is not None:
+            print(f"\nCache: {aggregator.cached} of {aggregator.listed} messages already known.", end='')
+        print("\nDate analysis complete.")
+    # Counted from what was fetched, so the total matches the dates
+    return len(timestamps), timestamps
+
+def run_async_scan(creds, base_query, days_back, **kwargs):
+    """Runs scan_message_dates_async on a new event loop; see there for the arguments."""
+    return asyncio.run(scan_message_dates_async(creds, base_query, days_back, **kwargs))
+
+# --- End Async Backend ---
+
+# --- Record / Replay ---
+
+class ApiRecorder:
+    """
+    Streams raw Gmail API responses to a gzip-compressed JSON Lines archive (--record).
+    The first line describes the recording; every other line is one messages.list page
+    ({"kind": "messages.list", "q", "pageToken", "response"}) or one metadata response
+    ({"kind": "messages.get", "id", "response"}). Thread-safe.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'wt', encoding='utf-8')
+        self._write({'kind': 'archive', 'version': ARCHIVE_VERSION, 'recorded_on': datetime.now().date().isoformat(),
+                     'days_back': DAYS_TO_LOOK_BACK, 'query': FULL_JOB_APPLICATION_QUERY})
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self.count += 1
+
+    def record_list(self, query, page_token, response):
+        self._write({'kind': 'messages.list', 'q': query, 'pageToken': page_token, 'response': response})
+
+    def record_get(self, msg_id, response):
+        self._write({'kind': 'messages.get', 'id': msg_id, 'response': response})
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+        # The header line is not a response
+        return self.count - 1
+
+class RecordedRequest:
+    """A Gmail API request whose response is passed to `record` once it succeeds."""
+
+    def __init__(self, request, record):
+        self.request = request
+        self.record = record
+
+    def execute(self, *args, **kwargs):
+        response = self.request.execute(*args, **kwargs)
+        self.record(response)
+        return response
+
+class RecordingBatch:
+    """
+    Batch request of a RecordingService. The wrapped batch gets one callback per request,
+    which records the response and then calls the caller's callback.
+    """
+
+    def __init__(self, batch, callback=None):
+        self.batch = batch
+        self.callback = callback
+
+    def add(self, request, callback=None, request_id=None):
+        record = None
+        if isinstance(request, RecordedRequest):
+            request, record = request.request, request.record
+        callback = callback or self.callback
+
+        def on_response(response_id, response, exception):
+            if exception is None and record is not None:
+                record(response)
+            if callback is not None:
+                callback(response_id, response, exception)
+
+        self.batch.add(request, callback=on_response, request_id=request_id)
+
+    def execute(self, *args, **kwargs):
+        return self.batch.execute(*args, **kwargs)
+
+class RecordingService:
+    """
+    Wraps a Gmail service object and records the messages.list and messages.get responses
+    it receives, including those inside batch requests, with an ApiRecorder.
+    Other resources (getProfile, history) are passed through unrecorded.
+    """
+
+    def __init__(self, service, recorder):
+        self.service = service
+        self.recorder = recorder
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, **kwargs):
+        request = self.service.users().messages().list(**kwargs)
+        return RecordedRequest(request, functools.partial(self.recorder.record_list, kwargs.get('q', ''),
+                                                          kwargs.get('pageToken')))
+
+    def get(self, **kwargs):
+        request = self.service.users().messages().get(**kwargs)
+        return RecordedRequest(request, functools.partial(self.recorder.record_get, kwargs['id']))
+
+    def new_batch_http_request(self, callback=None):
+        return RecordingBatch(self.service.new_batch_http_request(), callback)
+
+    def __getattr__(self, name):
+        return getattr(self.service.users(), name)
+
+def archive_decoder():
+    """Returns the fastest available JSON decoder for archive lines (orjson if installed)."""
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        return json.loads
+
+# Query terms understood by the local evaluation: parentheses, OR, field:"phrase", field:value, "phrase", word
+QUERY_TERM = re.compile(r'\(|\)|-?[a-z]+:"[^"]*"|-?"[^"]*"|-?[^\s()"]+')
+QUERY_DATE = re.compile(r'\b(after|before):(\d{4}/\d{2}/\d{2})\b')
+
+def header_text(text):
+    """Normalizes a header for phrase matching: its tokens joined by single spaces, padded with spaces."""
+    return f" {' '.join(normalize_tokens(text))} "
+
+class ReplayArchive:
+    """
+    The responses of an ApiRecorder archive, indexed for replay: list pages by (query, page token)
+    and metadata responses by message ID. A truncated archive (interrupted recording) is read
+    up to the last complete line.
+    """
+
+    def __init__(self, path):
+        loads = archive_decoder()
+        self.header = {}
+        self.pages = {}
+        self.messages = {}
+        self.listed = defaultdict(list)
+        with gzip.open(path, 'rb') as f:
+            try:
+                for line in f:
+                    entry = loads(line)
+                    kind = entry.get('kind')
+                    if kind == 'messages.get':
+                        self.messages[entry['id']] = entry['response']
+                    elif kind == 'messages.list':
+                        self.pages[(entry['q'], entry['pageToken'])] = entry['response']
+                        self.listed[entry['q']].extend(m['id'] for m in entry['response'].get('messages', []))
+                    elif kind == 'archive':
+                        self.header = entry
+            except (EOFError, ValueError) as error:
+                if not self.header:
+                    raise ValueError(f"not a recorded API archive ({error})")
+                print(f"Warning: the archive is truncated ({error}); replaying the responses read so far.")
+        if self.header.get('version') != ARCHIVE_VERSION:
+            raise ValueError(f"unsupported archive version {self.header.get('version')!r}")
+        self._headers = None
+        self._evidence = None
+
+    def headers(self):
+        """{message ID: (internalDate, normalized Subject, normalized From)}, newest first."""
+        if self._headers is None:
+            rows = []
+            for msg_id, response in self.messages.items():
+                record = metadata_to_record(response)
+                rows.append((msg_id, (record['internalDate'], header_text(record['subject']),
+                                      header_text(record['from']))))
+            rows.sort(key=lambda row: -row[1][0])
+            self._headers = dict(rows)
+        return self._headers
+
+    def evidence(self):
+        """
+        {normalized phrase: message IDs known to contain it}, from the recorded single-phrase
+        searches (per-phrase counts and body fallbacks). These cover phrases that occur only
+        in a message body, which the recorded headers cannot show.
+        """
+        if self._evidence is None:
+            self._evidence = defaultdict(set)
+            for query, ids in self.listed.items():
+                terms = QUERY_TERM.findall(query)
+                phrases = [t for t in terms if t not in ('(', ')') and not t.startswith('-') and
+                           (t.startswith('"') or ':' not in t)]
+                if len(phrases) == 1 and 'OR' not in terms:
+                    self._evidence[header_text(phrases[0].strip('"'))].update(ids)
+        return self._evidence
+
+def compile_replay_query(query, archive):
+    """
+    Compiles a Gmail search query into a predicate over ReplayArchive.headers() entries,
+    called as predicate(msg_id, (internal_date, subject, sender)). subject:/from: phrases
+    are matched against the recorded headers; other phrases against both headers and the
+    archive's evidence of body matches. is:draft never matches (drafts are not recorded).
+    Adjacent terms are ANDed and OR binds tighter, as in Gmail.
+    Raises ValueError for operators that cannot be decided from the recording.
+    """
+    terms = QUERY_TERM.findall(query)
+    evidence = archive.evidence()
+    position = 0
+
+    def term(token):
+        field, value = ('', token) if token.startswith('"') or ':' not in token else token.split(':', 1)
+        if field in ('subject', 'from'):
+            phrase = header_text(value.strip('"'))
+            index = 1 if field == 'subject' else 2
+            return lambda msg_id, row: phrase in row[index]
+        if field in ('after', 'before'):
+            if value.isdigit():
+                limit = int(value) * 1000
+            else:
+                limit = int(datetime.strptime(value, '%Y/%m/%d').timestamp() * 1000)
+            if field == 'after':
+                return lambda msg_id, row: row[0] >= limit
+            return lambda msg_id, row: row[0] < limit
+        if field == 'is' and value == 'draft':
+            return lambda msg_id, row: False
+        if field:
+            raise ValueError(f"'{token}' cannot be evaluated from the recorded headers")
+        phrase = header_text(value.strip('"'))
+        known = evidence.get(phrase, ())
+        return lambda msg_id, row: phrase in row[1] or phrase in row[2] or msg_id in known
+
+    def atom():
+        nonlocal position
+        token = terms[position]
+        position += 1
+        if token == '(':
+            predicate = conjunction()
+            position += 1  # ')'
+            return predicate
+        if token.startswith('-') and len(token) > 1:
+            negated = term(token[1:])
+            return lambda msg_id, row: not negated(msg_id, row)
+        return term(token)
+
+    def disjunction():
+        nonlocal position
+        options = [atom()]
+        while position < len(terms) and terms[position] == 'OR':
+            position += 1
+            options.append(atom())
+        if len(options) == 1:
+            return options[0]
+        return lambda msg_id, row: any(option(msg_id, row) for option in options)
+
+    def conjunction():
+        parts = []
+        while position < len(terms) and terms[position] != ')':
+            parts.append(disjunction())
+        return lambda msg_id, row: all(part(msg_id, row) for part in parts)
+
+    return conjunction()
+
+class ReplayRequest:
+    """A request of the ReplayService; execute() answers it from the archive."""
+
+    def __init__(self, answer):
+        self.answer = answer
+
+    def execute(self, http=None, num_retries=0):
+        return self.answer()
+
+class ReplayBatch:
+    """Batch request of the ReplayService, with the callbacks of a googleapiclient batch."""
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        self.requests.append((request, callback, request_id))
+
+    def execute(self, http=None):
+        for request, callback, request_id in self.requests:
+            try:
+                response, exception = request.execute(), None
+            except HttpError as error:
+                response, exception = None, error
+            if callback is not None:
+                callback(request_id, response, exception)
+            if self.callback is not None:
+                self.callback(request_id, response, exception)
+
+class ReplayService:
+    """
+    Stand-in for the Gmail service object that answers messages.list and messages.get from a
+    ReplayArchive, without network or credentials (--replay).
+
+    Recorded queries return exactly the recorded pages. Queries that were not recorded, e.g.
+    after editing the phrase lists, are evaluated locally over the recorded messages with
+    compile_replay_query and paged with synthetic page tokens. Dates in queries are shifted
+    by the days since the recording, so a replay on a later day still sees the recorded window.
+    """
+
+    def __init__(self, archive):
+        self.archive = archive
+        recorded_on = datetime.strptime(archive.header['recorded_on'], '%Y-%m-%d').date()
+        self.day_offset = recorded_on - datetime.now().date()
+        self._results = {}
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return ReplayBatch(callback)
+
+    def list(self, userId='me', q='', maxResults=100, pageToken=None, **kwargs):
+        return ReplayRequest(functools.partial(self._list, self.recorded_query(q), pageToken, maxResults))
+
+    def get(self, userId='me', id=None, **kwargs):
+        return ReplayRequest(functools.partial(self._get, id))
+
+    def recorded_query(self, query):
+        """Shifts the dates of a query to the day of the recording."""
+        if not self.day_offset:
+            return query
+        def shift(match):
+            day = datetime.strptime(match.group(2), '%Y/%m/%d') + self.day_offset
+            return f"{match.group(1)}:{day.strftime('%Y/%m/%d')}"
+        return QUERY_DATE.sub(shift, query)
+
+    def _list(self, query, page_token, page_size):
+        recorded = self.archive.pages.get((query, page_token))
+        if recorded is not None:
+            return recorded
+        if page_token and not page_token.startswith(REPLAY_PAGE_TOKEN_PREFIX):
+            raise make_http_error(400, b'Page token not in the replay archive (incomplete recording)', 'Bad Request')
+
+        ids = self._results.get(query)
+        if ids is None:
+            try:
+                predicate = compile_replay_query(query, self.archive)
+            except (ValueError, IndexError) as error:
+                raise make_http_error(400, f"Invalid query for replay: {error}".encode(), 'Bad Request')
+            ids = [msg_id for msg_id, row in self.archive.headers().items() if predicate(msg_id, row)]
+            self._results[query] = ids
+
+        start = int(page_token[len(REPLAY_PAGE_TOKEN_PREFIX):]) if page_token else 0
+        page = ids[start:start + page_size]
+        response = {'resultSizeEstimate': len(ids)}
+        if page:
+            response['messages'] = [{'id': msg_id} for msg_id in page]
+        if start + page_size < len(ids):
+            response['nextPageToken'] = f"{REPLAY_PAGE_TOKEN_PREFIX}{start + page_size}"
+        return response
+
+    def _get(self, msg_id):
+        response = self.archive.messages.get(msg_id)
+        if response is None:
+            raise make_http_error(404, b'Message not in the replay archive', 'Not Found')
+        return response
+
+class ReplayServices:
+    """ThreadLocalServices counterpart for --replay: the ReplayService has no transport, so all threads share it."""
+
+    creds = None
+    recorder = None
+
+    def __init__(self, service):
+        self.service = service
+
+    def get(self):
+        return self.service
+
+# --- End Record / Replay ---
+
+# --- Phrase Attribution ---
+
+def normalize_tokens(text):
+    """
+    Splits text into search tokens the way Gmail roughly does: Unicode-normalized,
+    case-folded words, with punctuation and whitespace acting as separators.
+    """
+    return re.findall(r'\w+', unicodedata.normalize('NFKC', text).casefold())
+
+class PhraseMatcher:
+    """
+    Multi-pattern phrase matcher over word tokens.
+    Phrases are indexed by their first token, so a text is scanned once and every
+    phrase occurrence (including overlapping ones) is found.
+    """
+
+    def __init__(self, phrases):
+        self.by_first_token = defaultdict(list)
+        for phrase in phrases:
+            tokens = tuple(normalize_tokens(phrase))
+            if tokens:
+                self.by_first_token[tokens[0]].append((tokens, phrase))
+
+    def find(self, text):
+        """Returns the set of phrases that occur in text."""
+        found = set()
+        tokens = normalize_tokens(text)
+        for i, token in enumerate(tokens):
+            for phrase_tokens, phrase in self.by_first_token.get(token, ()):
+                if tuple(tokens[i:i + len(phrase_tokens)]) == phrase_tokens:
+                    found.add(phrase)
+        return found
+
+SUBJECT_MATCHER = PhraseMatcher(SUBJECT_ONLY_PHRASES)
+BODY_OR_SENDER_MATCHER = PhraseMatcher(BODY_OR_SENDER_PHRASES)
+
+def classify_message(record):
+    """Returns the set of phrases a message matches based on its Subject and From headers."""
+    subject = record.get('subject') or ''
+    sender = record.get('from') or ''
+    matched = SUBJECT_MATCHER.find(subject)
+    # Body/sender phrases are searched everywhere by Gmail; the headers are the part we can see.
+    # Each header is matched on its own, so a phrase cannot span the end of one and the start of the other.
+    matched |= BODY_OR_SENDER_MATCHER.find(subject) | BODY_OR_SENDER_MATCHER.find(sender)
+    return matched
+
+def body_fallback_query(phrase):
+    """Base query for the messages that contain a body/sender phrase outside their Subject and From headers."""
+    return f'"{phrase}" -subject:"{phrase}" -from:"{phrase}" -is:draft'
+
+def get_phrase_counts_from_headers(service, message_ids, records, days_back, id_sets=None, body_ids=None):
+    """
+    Derives per-phrase counts for messages of the combined query from their headers.
+
+    Subject phrases are decided entirely from the Subject header. Body/sender phrases can
+    also occur in the message body, which the metadata does not contain, so for each of them
+    one targeted query lists only the messages whose headers do not already contain the phrase.
+    If body_ids ({phrase: IDs}, e.g. kept by sync_matching_ids) is given, those matches are
+    used instead and nothing is listed. Only messages with a record are counted, like the
+    total and the dates derived from the same records.
+    Returns {phrase: count} in CORE_SEARCH_PHRASES order; id_sets receives the matches as in get_phrase_counts.
+    """
+    resolved = {msg_id for msg_id in message_ids if msg_id in records}
+    phrase_ids = defaultdict(set)
+    for msg_id in resolved:
+        for phrase in classify_message(records[msg_id]):
+            phrase_ids[phrase].add(msg_id)
+
+    phrase_counts = {}
+    for phrase in CORE_SEARCH_PHRASES:
+        if phrase in BODY_OR_SENDER_PHRASES and body_ids is not None:
+            phrase_ids[phrase].update(resolved.intersection(body_ids.get(phrase, ())))
+        elif phrase in BODY_OR_SENDER_PHRASES:
+            print(f'Searching for: "{phrase}" (body fallback) ... ', end="", flush=True)
+            body_query = create_date_query(body_fallback_query(phrase), days_back)
+            try:
+                phrase_ids[phrase].update(resolved.intersection(list_message_ids(service, body_query)))
+            except HttpError as error:
+                print(f"An error occurred during the API call: {error}")
+
+        count = len(phrase_ids[phrase])
+        phrase_counts[phrase] = count
+        if id_sets is not None:
+            id_sets[phrase] = phrase_id_array(phrase_ids[phrase])
+        print(f"\r[{count:^5}] matches for phrase: '{phrase}'{' ' * 30}", flush=True)
+
+    return phrase_counts
+
+# --- End Phrase Attribution ---
+
+# --- Phrase Overlap ---
+
+def message_key(msg_id):
+    """
+    Returns a message ID as an unsigned 64-bit int: Gmail IDs are 16 hex digits; other IDs
+    (Message-IDs of mbox messages without a Gmail ID) are hashed to 64 bits.
+    """
+    try:
+        key = int(msg_id, 16)
+        if key < 2 ** 64:
+            return key
+    except ValueError:
+        pass
+    return int.from_bytes(hashlib.blake2b(msg_id.encode(), digest_size=8).digest(), 'big')
+
+def phrase_id_array(message_ids):
+    """Returns message IDs in the compact form used for set operations: a sorted array of unique uint64 keys."""
+    return np.unique(np.fromiter((message_key(msg_id) for msg_id in message_ids), dtype=np.uint64))
+
+def phrase_overlap(id_sets):
+    """
+    Computes how the phrases' matches overlap from {phrase: phrase_id_array}, with sorted-array
+    set operations only (no API calls). Returns a dict with:
+      'phrases' - the phrases, in id_sets order
+      'overlap' - n x n int64 matrix of messages matched by both phrases (the diagonal is each phrase's count)
+      'unique'  - messages matched by no other phrase, i.e. what the union loses if the phrase is dropped
+      'union'   - number of messages matched by any phrase
+      'droppable' - phrases that can be removed together without changing the union (found
+                    greedily, smallest phrase first; phrases with no matches are always included)
+    """
+    phrases = list(id_sets)
+    arrays = [id_sets[phrase] for phrase in phrases]
+    overlap = np.zeros((len(phrases), len(phrases)), dtype=np.int64)
+    for i, ids in enumerate(arrays):
+        overlap[i, i] = ids.size
+        for j in range(i + 1, len(arrays)):
+            overlap[i, j] = overlap[j, i] = np.intersect1d(ids, arrays[j], assume_unique=True).size
+
+    all_ids = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.uint64)
+    keys, occurrences = np.unique(all_ids, return_counts=True)
+    singles = keys[occurrences == 1]
+    unique = np.array([np.isin(ids, singles, assume_unique=True).sum() for ids in arrays], dtype=np.int64)
+
+    # Remaining number of phrases matching each message while phrases are dropped
+    coverage = occurrences.copy()
+    dropped = set()
+    for i in sorted(range(len(arrays)), key=lambda i: arrays[i].size):
+        positions = np.searchsorted(keys, arrays[i])
+        if (coverage[positions] > 1).all():
+            coverage[positions] -= 1
+            dropped.add(i)
+    droppable = [phrase for i, phrase in enumerate(phrases) if i in dropped]
+    return {'phrases': phrases, 'overlap': overlap, 'unique': unique, 'union': int(keys.size), 'droppable': droppable}
+
+def merge_phrase_ids(id_set_list):
+    """Combines several {phrase: phrase_id_array} dicts (e.g. one per account) into their per-phrase unions."""
+    merged = defaultdict(list)
+    for id_sets in id_set_list:
+        for phrase, ids in id_sets.items():
+            merged[phrase].append(ids)
+    return {phrase: np.unique(np.concatenate(arrays)) for phrase, arrays in merged.items()}
+
+def save_phrase_overlap_csv(overlap, output_dir='.'):
+    """Saves the phrase overlap matrix with each phrase's count and unique contribution as CSV."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    filename = os.path.join(output_dir, f"job_application_phrase_overlap_{timestamp}.csv")
+    phrases = overlap['phrases']
+    with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(["Phrase", "Count", "Unique"] + phrases)
+        for i, phrase in enumerate(phrases):
+            writer.writerow([phrase, int(overlap['overlap'][i, i]), int(overlap['unique'][i])]
+                            + [int(count) for count in overlap['overlap'][i]])
+    return filename
+
+def report_phrase_overlap(id_sets, days_back, output_dir='.', renderer=None):
+    """
+    Prints each phrase's unique contribution and closest overlap, saves the overlap CSV and
+    submits the overlap heatmap. Phrases with no unique matches can be dropped from the
+    combined query without changing the total (but not necessarily together; see 'droppable'). Returns the phrase_overlap result (None without phrases).
+    """
+    if not id_sets:
+        return None
+    with RUN_METRICS.stage('analysis'):
+        overlap = phrase_overlap(id_sets)
+    phrases = overlap['phrases']
+    matrix = overlap['overlap']
+
+    print(f"\n--- Phrase Overlap ({overlap['union']} messages matched by any phrase) ---")
+    print("[count] unique: matched by no other phrase | largest overlap with another phrase")
+    for i, phrase in enumerate(phrases):
+        count = int(matrix[i, i])
+        if count == 0:
+            print(f"[{count:^5}] '{phrase}': no matches")
+            continue
+        others = matrix[i].copy()
+        others[i] = -1
+        j = int(others.argmax()) if len(phrases) > 1 else i
+        closest = f"'{phrases[j]}' ({matrix[i, j] / count:.0%})" if j != i else '-'
+        flag = '  <- redundant' if overlap['unique'][i] == 0 else ''
+        print(f"[{count:^5}] '{phrase}': unique {int(overlap['unique'][i])} | {closest}{flag}")
+    if overlap['droppable']:
+        print(f"These {len(overlap['droppable'])} phrase(s) can be dropped together without changing the total: "
+              + ', '.join(f"'{phrase}'" for phrase in overlap['droppable']))
+
+    with RUN_METRICS.stage('export'):
+        filename = save_phrase_overlap_csv(overlap, output_dir)
+    print(f"[Data Exported] Phrase overlap saved as: {filename}")
+    if renderer is not None:
+        renderer.submit(visualize_phrase_overlap, phrases, matrix, days_back)
+    return overlap
+
+# --- End Phrase Overlap ---
+
+# --- Takeout Import ---
+
+MBOX_HEADERS = {b'subject', b'from', b'date', b'message-id', b'x-gm-thrid', b'x-gmail-labels'}
+HTML_TAG = re.compile(r'<[^>]*>')
+
+def decode_mime_header(value):
+    """Decodes a raw header value, including RFC 2047 encoded words, to str."""
+    from email.header import decode_header, make_header
+    text = value.decode('utf-8', 'replace')
+    try:
+        return str(make_header(decode_header(text)))
+    except (ValueError, LookupError, UnicodeError):
+        return text
+
+def parse_mbox_headers(block):
+    """
+    Extracts the MBOX_HEADERS from a raw header block without parsing the others.
+    Returns {lower-case name: decoded value}; folded lines are joined, the first occurrence wins.
+    """
+    raw = {}
+    name = None
+    for line in block.split(b'\n'):
+        line = line.rstrip(b'\r')
+        if line[:1] in (b' ', b'\t'):
+            if name is not None:
+                raw[name] += b' ' + line.strip()
+            continue
+        key, sep, value = line.partition(b':')
+        name = key.strip().lower() if sep else None
+        if name in MBOX_HEADERS and name not in raw:
+            raw[name] = value.strip()
+        else:
+            name = None
+    return {key.decode(): decode_mime_header(value) for key, value in raw.items()}
+
+def mbox_internal_date(from_line, date_header):
+    """
+    Returns the delivery time of an mbox message in epoch milliseconds: from the 'From ' line
+    (which Takeout sets to Gmail's internal date), else from the Date header. None if neither parses.
+    """
+    from email.utils import parsedate_to_datetime
+    parts = from_line.decode('ascii', 'replace').split(None, 2)
+    moment = None
+    if len(parts) == 3:
+        for pattern in ('%a %b %d %H:%M:%S %z %Y', '%a %b %d %H:%M:%S %Y'):
+            try:
+                moment = datetime.strptime(parts[2].strip(), pattern)
+                break
+            except ValueError:
+                continue
+    if moment is None and date_header:
+        try:
+            moment = parsedate_to_datetime(date_header)
+        except (TypeError, ValueError, IndexError):
+            return None
+    if moment is None:
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+def gmail_id(decimal_id):
+    """Converts a decimal Gmail message/thread ID (Takeout) to the hex form the API uses, or None."""
+    return format(int(decimal_id), 'x') if decimal_id and decimal_id.isdigit() else None
+
+def message_text(raw):
+    """Returns the decoded text/plain and text/html (tags stripped) parts of a raw message."""
+    import email
+    import html
+    texts = []
+    for part in email.message_from_bytes(raw).walk():
+        if part.get_content_maintype() != 'text' or part.get_filename():
+            continue
+        payload = part.get_payload(decode=True)
+        if not payload:
+            continue
+        try:
+            text = payload.decode(part.get_content_charset() or 'utf-8', 'replace')
+        except LookupError:
+            text = payload.decode('utf-8', 'replace')
+        if part.get_content_subtype() == 'html':
+            text = html.unescape(HTML_TAG.sub(' ', text))
+        texts.append(text)
+    return '\n'.join(texts)
+
+def parse_mbox_message(mm, start, end, after_ms):
+    """
+    Parses the message at mm[start:end] and applies the rules of FULL_JOB_APPLICATION_QUERY:
+    subject phrases in the Subject, body/sender phrases anywhere (headers or text parts),
+    no drafts, spam or trash, and received at or after after_ms.
+    Returns (message ID, record) for a match, otherwise None. The record has the cache record
+    fields plus 'phrases', the sorted matched phrases.
+    """
+    line_end = mm.find(b'\n', start, end)
+    if line_end == -1:
+        return None
+    limit = min(end, line_end + MBOX_MAX_HEADER_BYTES)
+    blank_lines = [i for i in (mm.find(b'\n\n', line_end, limit), mm.find(b'\n\r\n', line_end, limit)) if i != -1]
+    header_end = min(blank_lines) if blank_lines else limit
+    headers = parse_mbox_headers(mm[line_end + 1:header_end])
+
+    labels = {label.strip().casefold() for label in headers.get('x-gmail-labels', '').split(',')}
+    if labels & MBOX_EXCLUDED_LABELS:
+        return None
+    from_line = mm[start:line_end]
+    internal_date = mbox_internal_date(from_line, headers.get('date'))
+    if internal_date is None or internal_date < after_ms:
+        return None
+
+    record = {
+        'threadId': gmail_id(headers.get('x-gm-thrid')),
+        'internalDate': internal_date,
+        'subject': headers.get('subject', ''),
+        'from': headers.get('from', ''),
+    }
+    phrases = classify_message(record)
+    # The body is only decoded when it can still add a phrase
+    if not phrases.issuperset(BODY_OR_SENDER_PHRASES):
+        phrases |= BODY_OR_SENDER_MATCHER.find(message_text(mm[line_end + 1:min(end, header_end + MBOX_MAX_BODY_BYTES)]))
+    if not phrases:
+        return None
+
+    # Takeout puts the decimal Gmail message ID in the 'From ' line: "From 1779...@xxx <date>"
+    envelope = from_line.split(None, 2)[1] if len(from_line.split(None, 2)) > 1 else b''
+    msg_id = (gmail_id(envelope.split(b'@')[0].decode('ascii', 'replace'))
+              or headers.get('message-id') or f"mbox:{start}")
+    record['phrases'] = sorted(phrases)
+    return msg_id, record
+
+def parse_mbox_chunk(path, start, end, after_ms):
+    """
+    Worker process entry point: parses the messages in bytes [start, end) of the mbox, which
+    must begin at a 'From ' line. Returns (messages scanned, [(message ID, record), ...] of matches).
+    """
+    matches = []
+    scanned = 0
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        position = start
+        while position < end:
+            following = mm.find(b'\nFrom ', position, end)
+            message_end = end if following == -1 else following + 1
+            scanned += 1
+            match = parse_mbox_message(mm, position, message_end, after_ms)
+            if match is not None:
+                matches.append(match)
+            position = message_end
+    return scanned, matches
+
+def iter_mbox_chunks(mm, chunk_bytes=MBOX_CHUNK_BYTES):
+    """Yields (start, end) byte ranges of about chunk_bytes that begin at 'From ' lines."""
+    size = len(mm)
+    start = 0
+    while start < size:
+        boundary = mm.find(b'\nFrom ', start + chunk_bytes) if start + chunk_bytes < size else -1
+        end = size if boundary == -1 else boundary + 1
+        yield start, end
+        start = end
+
+def ingest_mbox(path, days_back, processes=MBOX_PROCESSES, chunk_bytes=MBOX_CHUNK_BYTES, on_batch=None, id_sets=None):
+    """
+    Counts the job application emails in a Google Takeout mbox export within the look-back window.
+    The file is memory-mapped and its chunks are parsed in worker processes, at most two chunks
+    per process at a time, so memory stays bounded whatever the file size; only the matching
+    messages are kept. Duplicates (same Gmail message ID) are counted once. on_batch(ids, records)
+    is called with each chunk's new matches (e.g. RowExporter.write). id_sets receives each
+    phrase's matches as in get_phrase_counts.
+    Returns (total_count, phrase_counts, timestamps); raises OSError or ValueError for unreadable files.
+    """
+    start_date = (datetime.now() - timedelta(days=days_back)).date()
+    after_ms = int(datetime.combine(start_date, datetime.min.time()).timestamp() * 1000)
+    processes = processes or os.cpu_count() or 1
+    phrase_counts = dict.fromkeys(CORE_SEARCH_PHRASES, 0)
+    phrase_ids = {phrase: [] for phrase in CORE_SEARCH_PHRASES}
+    seen = set()
+    timestamp_chunks = []
+    scanned = 0
+    done_bytes = 0
+
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0, phrase_counts, concat_timestamps(timestamp_chunks)  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+                ProcessPoolExecutor(max_workers=processes) as pool:
+            if mm[:5] != b'From ':
+                raise ValueError("not an mbox file (it does not start with a 'From ' line)")
+            total_mb = len(mm) / 1e6
+            chunks = iter_mbox_chunks(mm, chunk_bytes)
+            pending = {}
+            try:
+                while True:
+                    for start, end in itertools.islice(chunks, 2 * processes - len(pending)):
+                        pending[pool.submit(parse_mbox_chunk, path, start, end, after_ms)] = end - start
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        done_bytes += pending.pop(future)
+                        chunk_scanned, matches = future.result()
+                        scanned += chunk_scanned
+                        records = {msg_id: record for msg_id, record in matches if msg_id not in seen}
+                        seen.update(records)
+                        for msg_id, record in records.items():
+                            for phrase in record['phrases']:
+                                if phrase in phrase_counts:
+                                    phrase_counts[phrase] += 1
+                                    phrase_ids[phrase].append(msg_id)
+                        timestamp_chunks.append(records_to_timestamps(records, records))
+                        if on_batch is not None and records:
+                            on_batch(list(records), records)
+                    print(f"Progress: {done_bytes / 1e6:,.0f}/{total_mb:,.0f} MB, {scanned} messages scanned, "
+                          f"{len(seen)} matches...", end='\r', flush=True)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    print(f"\nScanned {scanned} messages.")
+    if id_sets is not None:
+        id_sets.update((phrase, phrase_id_array(ids)) for phrase, ids in phrase_ids.items())
+    return len(seen), phrase_counts, concat_timestamps(timestamp_chunks)
+
+# --- End Takeout Import ---
+
+# --- Incremental Sync ---
+
+def get_current_history_id(service, user_id='me'):
+    """Returns the mailbox's current historyId."""
+    profile = REQUEST_SCHEDULER.execute(service.users().getProfile(userId=user_id), 'getProfile')
+    return profile['historyId']
+
+def get_history_changes(service, start_history_id, user_id='me'):
+    """
+    Lists mailbox changes since start_history_id using users.history.list.
+    Returns (added_ids, deleted_ids, latest_history_id).
+    Raises HttpError (status 404) if start_history_id is too old to be used.
+    """
+    added_ids = set()
+    deleted_ids = set()
+    latest_history_id = start_history_id
+    page_token = None
+
+    while True:
+        response = REQUEST_SCHEDULER.execute(service.users().history().list(
+            userId=user_id,
+            startHistoryId=start_history_id,
+            historyTypes=['messageAdded', 'messageDeleted'],
+            pageToken=page_token
+        ), 'history.list')
+
+        # History records are returned in chronological order.
+        for record in response.get('history', []):
+            for item in record.get('messagesAdded', []):
+                added_ids.add(item['message']['id'])
+                deleted_ids.discard(item['message']['id'])
+            for item in record.get('messagesDeleted', []):
+                deleted_ids.add(item['message']['id'])
+                added_ids.discard(item['message']['id'])
+
+        latest_history_id = response.get('historyId', latest_history_id)
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+
+    return added_ids, deleted_ids, latest_history_id
+
+def sync_matching_ids(service, cache, base_query, days_back, batch_size=METADATA_BATCH_SIZE, shards=1, services=None,
+                      body_ids=None):
+    """
+    Returns the IDs of all messages matching base_query within the look-back window.
+
+    The first run performs a full scan and records the mailbox historyId. Later runs only
+    ask the history API for messages added or deleted since then, test the added ones
+    against the query and update the stored results. If the stored historyId has expired,
+    a full scan is performed again. All returned messages have their metadata in the cache.
+    Full scans are time-sharded when shards > 1 (see iter_window_ids).
+
+    If body_ids is a dict, the body fallback matches of each BODY_OR_SENDER_PHRASES phrase
+    (see body_fallback_query) among the returned IDs are kept in the sync state the same way
+    and stored in it as {phrase: set of IDs}, for get_phrase_counts_from_headers.
+    """
+    query_key = f"{base_query}|{days_back}"
+    full_query = create_date_query(base_query, days_back)
+    state = cache.get_sync_state(query_key)
+    added_records = {}
+
+    if state is not None:
+        try:
+            added_ids, deleted_ids, history_id = get_history_changes(service, state['history_id'])
+        except HttpError as error:
+            if error.resp.status != 404:
+                raise
+            print("Stored historyId has expired; falling back to a full scan.")
+            state = None
+
+    if state is None:
+        print("Performing full scan for incremental sync...")
+        # Record the historyId before listing so no change made during the scan is missed.
+        history_id = get_current_history_id(service)
+        matched_ids = list(iter_window_ids(service, base_query, days_back, shards=shards, services=services))
+        get_message_records(service, matched_ids, batch_size=batch_size, cache=cache)
+    else:
+        print(f"Incremental sync: {len(added_ids)} added, {len(deleted_ids)} deleted since last run.")
+        matched = set(state['ids']) - deleted_ids
+
+        if added_ids:
+            # Only list the date range covered by the new messages, then keep those that match the query.
+            added_records = get_message_records(service, sorted(added_ids), batch_size=batch_size, cache=cache)
+            if added_records:
+                earliest_s = min(r['internalDate'] for r in added_records.values()) // 1000
+                candidate_ids = set(list_message_ids(service, f"({full_query}) after:{earliest_s - 1}"))
+                added_records = {msg_id: r for msg_id, r in added_records.items() if msg_id in candidate_ids}
+                matched |= set(added_records)
+
+        # Drop messages that have moved out of the look-back window since the last run.
+        records = get_message_records(service, sorted(matched), batch_size=batch_size, cache=cache)
+        # Same day boundary as the after: filter built by create_date_query.
+        start_date = (datetime.now() - timedelta(days=days_back)).replace(hour=0, minute=0, second=0, microsecond=0)
+        cutoff_ms = int(start_date.timestamp() * 1000)
+        matched_ids = [msg_id for msg_id in matched if msg_id in records and records[msg_id]['internalDate'] >= cutoff_ms]
+        # Keep the listing order of the API (newest first).
+        matched_ids.sort(key=lambda msg_id: records[msg_id]['internalDate'], reverse=True)
+
+    if body_ids is not None:
+        body_ids.update(sync_body_matches(service, cache, query_key, state, days_back, history_id,
+                                          matched_ids, added_records))
+    cache.save_sync_state(query_key, history_id, matched_ids)
+    return matched_ids
+
+def sync_body_matches(service, cache, query_key, state, days_back, history_id, matched_ids, added_records):
+    """
+    Updates the body fallback matches kept next to the sync state of query_key and returns them
+    as {phrase: set of IDs}. After a full scan (state is None), or if a phrase has no state for
+    the same historyId yet, its fallback query is listed over the whole window. Otherwise only
+    the date range of the newly matched messages (added_records) is listed, and messages that
+    left the results are dropped.
+    """
+    matched = set(matched_ids)
+    earliest_s = min((r['internalDate'] for r in added_records.values()), default=0) // 1000
+    body_ids = {}
+    for phrase in BODY_OR_SENDER_PHRASES:
+        body_key = f"{query_key}|body:{phrase}"
+        body_query = create_date_query(body_fallback_query(phrase), days_back)
+        body_state = cache.get_sync_state(body_key) if state is not None else None
+        if body_state is None or body_state['history_id'] != str(state['history_id']):
+            ids = set(list_message_ids(service, body_query))
+        else:
+            ids = set(body_state['ids'])
+            if added_records:
+                ids |= set(list_message_ids(service, f"({body_query}) after:{earliest_s - 1}")) & set(added_records)
+        body_ids[phrase] = ids & matched
+        cache.save_sync_state(body_key, history_id, sorted(body_ids[phrase]))
+    return body_ids
+
+# --- End Incremental Sync ---
+
+# --- Analysis Functions ---
+# All date analyses work on one int64 array of epoch milliseconds (internalDate) and are computed
+# with vectorized NumPy operations in a single pass (see analyze_timestamps).
+
+DAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MS_PER_HOUR = 3_600_000
+MS_PER_DAY = 86_400_000
+
+class SystemTimezone(tzinfo):
+    """
+    The system's local timezone rules as the time module applies them (TZ or /etc/localtime),
+    for systems whose zone has no IANA name. Unlike datetime.now().astimezone().tzinfo, which is
+    today's fixed offset, the offset follows DST.
+    """
+
+    def utcoffset(self, dt):
+        stamp = time.mktime((dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, 0, 0, -1))
+        return timedelta(seconds=time.localtime(stamp).tm_gmtoff)
+
+    def dst(self, dt):
+        stamp = time.mktime((dt.year, dt.month, dt.day, dt.hour, dt.minute, dt.second, 0, 0, -1))
+        is_dst = time.localtime(stamp).tm_isdst > 0
+        return timedelta(seconds=time.timezone - time.altzone) if is_dst else timedelta(0)
+
+    def tzname(self, dt):
+        return time.tzname[self.dst(dt) != timedelta(0)]
+
+    def fromutc(self, dt):
+        stamp = (dt.replace(tzinfo=None) - datetime(1970, 1, 1)).total_seconds()
+        return dt + timedelta(seconds=time.localtime(stamp).tm_gmtoff)
+
+def system_timezone():
     """
-    Counts the EXACT number of emails matching a specific search query 
-    by iterating through all pages.
+    Returns the system's local timezone: a ZoneInfo if TZ or the /etc/localtime link names an
+    IANA zone, otherwise a SystemTimezone.
     """
+    name = os.environ.get('TZ')
+    if name is None:
+        target = os.path.realpath('/etc/localtime')
+        name = target.partition('zoneinfo' + os.sep)[2] if 'zoneinfo' + os.sep in target else ''
     try:
-        messages = []
-        page_token = None
-        
-        while True:
-            # Call the list method with the query. 
-            response = service.users().messages().list(
-                userId=user_id, 
-                q=search_query, 
-                pageToken=page_token
-            ).execute()
-
-            # Extend the list with the messages from the current page.
-            messages.extend(response.get('messages', [])) 
+        return ZoneInfo(name.lstrip(':')) if name.lstrip(':') else SystemTimezone()
+    except (ZoneInfoNotFoundError, ValueError, OSError):
+        return SystemTimezone()
 
-            # Get the token for the next page. If no token, we are done.
-            page_token = response.get('nextPageToken')
-            if not page_token:
-                break
-        
-        return len(messages)
+def resolve_timezone(name=None):
+    """Returns a tzinfo for an IANA timezone name, or the system's local timezone if name is None."""
+    if name:
+        return ZoneInfo(name)
+    return system_timezone()
 
-    except HttpError as error:
-        print(f"An error occurred during the API call: {error}")
-        return 0
+def timezone_label(tz):
+    """Short label for charts, e.g. 'Europe/Berlin' or 'CET/CEST'."""
+    if getattr(tz, 'key', None):
+        return tz.key
+    if isinstance(tz, SystemTimezone):
+        return '/'.join(dict.fromkeys(time.tzname))
+    return datetime.now(tz).tzname()
 
-def get_message_dates(service, full_query):
+def to_local_ms(timestamps_ms, tz):
     """
-    Fetches all messages matching the full query and extracts their internal dates.
-    Returns a list of datetime objects.
+    Shifts UTC epoch-ms timestamps to local wall-clock epoch-ms in timezone tz.
+    The UTC offset is looked up once per distinct hour (DST changes happen on hour
+    boundaries), then applied to the whole array at once.
     """
-    print("\nStarting analysis of message dates (this may take a moment)...")
-    
-    messages = []
-    page_token = None
-    
-    # 1. Fetch all message IDs
-    while True:
-        try:
-            response = service.users().messages().list(
-                userId='me', 
-                q=full_query, 
-                pageToken=page_token
-            ).execute()
-            messages.extend(response.get('messages', [])) 
-            page_token = response.get('nextPageToken')
-            if not page_token:
-                break
-        except HttpError as error:
-            print(f"Error fetching message IDs for date analysis: {error}")
-            return []
+    timestamps_ms = np.asarray(timestamps_ms, dtype=np.int64)
+    if timestamps_ms.size == 0:
+        return timestamps_ms
+    hours, inverse = np.unique(timestamps_ms // MS_PER_HOUR, return_inverse=True)
+    offsets_ms = np.fromiter(
+        (datetime.fromtimestamp(int(h) * 3600, tz).utcoffset().total_seconds() * 1000 for h in hours),
+        dtype=np.int64, count=len(hours)
+    )
+    return timestamps_ms + offsets_ms[inverse.reshape(-1)]
 
-    if not messages:
-        return []
+def analyze_timestamps(timestamps_ms, tz=None):
+    """
+    Computes all date histograms in one vectorized pass over the timestamps.
+    Returns a dict with:
+      'monthly':      {YYYY-MM: count}
+      'day_of_week':  {DayName: count} (Monday..Sunday)
+      'hourly':       {Hour: count} (0..23)
+      'weekday_hour': 7x24 int array of counts (row 0 = Monday)
+    """
+    tz = tz or resolve_timezone()
+    local_ms = to_local_ms(timestamps_ms, tz)
 
-    date_objects = []
-    
-    # 2. Process messages to get internalDate
-    for i, msg in enumerate(messages):
-        try:
-            msg_detail = service.users().messages().get(
-                userId='me', 
-                id=msg['id'], 
-                format='metadata'
-            ).execute()
-            
-            internal_date_ms = msg_detail.get('internalDate')
-            
-            if internal_date_ms:
-                # Convert milliseconds since epoch to datetime object
-                dt_object = datetime.fromtimestamp(int(internal_date_ms) / 1000) 
-                date_objects.append(dt_object)
-                
-        except HttpError as e:
-            # Silently fail on individual message fetch error
-            continue 
+    # Months since 1970-01 via datetime64 arithmetic
+    months = local_ms.astype('datetime64[ms]').astype('datetime64[M]').astype(np.int64)
+    # 1970-01-01 was a Thursday, so shift by 3 to make Monday 0
+    weekdays = (local_ms // MS_PER_DAY + 3) % 7
+    hours = (local_ms // MS_PER_HOUR) % 24
 
-        # Print progress update
-        if (i + 1) % 50 == 0 or (i + 1) == len(messages):
-            print(f"Progress: {i + 1}/{len(messages)} messages analyzed...", end='\r', flush=True)
+    monthly = {}
+    if months.size:
+        first_month = months.min()
+        month_counts = np.bincount(months - first_month)
+        labels = np.datetime_as_string(np.arange(first_month, first_month + len(month_counts)).astype('datetime64[M]'))
+        monthly = {label: int(count) for label, count in zip(labels, month_counts) if count}
 
-    print("\nDate analysis complete.")
-    return date_objects
+    weekday_hour = np.bincount(weekdays * 24 + hours, minlength=7 * 24).reshape(7, 24)
 
-# --- Analysis Functions ---
+    return {
+        'monthly': monthly,
+        'day_of_week': {day: int(count) for day, count in zip(DAY_NAMES, weekday_hour.sum(axis=1))},
+        'hourly': {hour: int(count) for hour, count in enumerate(weekday_hour.sum(axis=0))},
+        'weekday_hour': weekday_hour,
+    }
 
-def get_monthly_counts(date_objects):
+def get_monthly_counts(timestamps_ms, tz=None):
     """Returns a dictionary of monthly counts {YYYY-MM: count}."""
-    monthly_counts = defaultdict(int)
-    for dt in date_objects:
-        monthly_counts[dt.strftime("%Y-%m")] += 1
-    return dict(monthly_counts)
-
-def get_day_of_week_counts(date_objects):
-    """Returns a dictionary of day of week counts {DayName: count}."""
-    day_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-    day_counts = defaultdict(int)
-    for dt in date_objects:
-        # weekday() returns 0 for Monday, 6 for Sunday
-        day_name = day_names[dt.weekday()]
-        day_counts[day_name] += 1
-    
-    # Ensure all days are present in the correct order for visualization
-    return {day: day_counts.get(day, 0) for day in day_names}
-
-def get_hourly_counts(date_objects):
-    """Returns a dictionary of hourly counts {Hour: count}."""
-    hourly_counts = defaultdict(int)
-    for dt in date_objects:
-        # Hour is 0-23
-        hourly_counts[dt.hour] += 1
-    
-    # Ensure all 24 hours are present in order
-    return {hour: hourly_counts.get(hour, 0) for hour in range(24)}
+    return analyze_timestamps(timestamps_ms, tz)['monthly']
+
+def get_day_of_week_counts(timestamps_ms, tz=None):
+    """Returns a dictionary of day of week counts {DayName: count}, Monday first."""
+    return analyze_timestamps(timestamps_ms, tz)['day_of_week']
+
+def get_hourly_counts(timestamps_ms, tz=None):
+    """Returns a dictionary of hourly counts {Hour: count} for all 24 hours."""
+    return analyze_timestamps(timestamps_ms, tz)['hourly']
 
 # --- End Analysis Functions ---
 
-def save_to_csv(monthly_counts, day_of_week_counts, hourly_counts, total_count, days_back):
+# --- Row-Level Export ---
+
+def sender_domain(sender):
+    """Returns the lower-case domain of a From header, e.g. 'greenhouse.io', or '' if there is none."""
+    _, address = parseaddr(sender or '')
+    return address.rpartition('@')[2].lower() if '@' in address else ''
+
+class RowExporter:
+    """
+    Writes one row per message (id, threadId, internalDate, matched phrases, sender domain)
+    as compressed Parquet or Arrow IPC files, partitioned by month (UTC):
+
+        <export_dir>/month=YYYY-MM/part-<run timestamp>.parquet
+
+    Rows are buffered per month and appended as row groups / record batches of `row_group_size`
+    while the scan is running. Each run only adds new files; when a MessageCache is given,
+    messages exported by an earlier run are skipped. Matched phrases come from the records'
+    own 'phrases' (mbox imports) or the run's per-phrase ID sets (see set_phrase_ids), so they
+    include body matches like the phrase counts; without either they are derived from the
+    Subject/From headers (see classify_message).
+    """
+
+    def __init__(self, export_dir, export_format='parquet', cache=None, row_group_size=EXPORT_ROW_GROUP_SIZE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+            import pyarrow.ipc
+        except ImportError:
+            raise RuntimeError("Row-level export requires 'pyarrow'. Run 'pip install pyarrow' to enable it.")
+        self.pa = pyarrow
+        self.export_dir = export_dir
+        self.export_format = export_format
+        self.cache = cache
+        self.row_group_size = row_group_size
+        self.run_id = datetime.now().strftime("%Y%m%d_%H%M%S")
+        self.schema = pyarrow.schema([
+            ('id', pyarrow.string()),
+            ('thread_id', pyarrow.string()),
+            ('internal_date', pyarrow.timestamp('ms', tz='UTC')),
+            ('matched_phrases', pyarrow.list_(pyarrow.string())),
+            ('sender_domain', pyarrow.string()),
+        ])
+        self._buffers = defaultdict(list)
+        self._writers = {}
+        self._written_ids = []
+        self._phrases_by_key = None
+        self.rows_written = 0
+
+    def set_phrase_ids(self, id_sets):
+        """Takes the matched phrases of each message from {phrase: phrase_id_array} (see get_phrase_counts)."""
+        phrases_by_key = defaultdict(list)
+        for phrase, keys in id_sets.items():
+            for key in keys.tolist():
+                phrases_by_key[key].append(phrase)
+        self._phrases_by_key = phrases_by_key
+
+    def matched_phrases(self, msg_id, record):
+        if 'phrases' in record:
+            return sorted(record['phrases'])
+        if self._phrases_by_key is not None:
+            return sorted(self._phrases_by_key.get(message_key(msg_id), ()))
+        return sorted(classify_message(record))
+
+    def write(self, message_ids, records):
+        """Buffers rows for the given messages and flushes full row groups."""
+        started = time.perf_counter()
+        message_ids = [msg_id for msg_id in message_ids if msg_id in records]
+        if self.cache is not None:
+            message_ids = self.cache.filter_unexported(message_ids)
+        for msg_id in message_ids:
+            record = records[msg_id]
+            month = datetime.fromtimestamp(record['internalDate'] / 1000, timezone.utc).strftime("%Y-%m")
+            buffer = self._buffers[month]
+            buffer.append((
+                msg_id,
+                record.get('threadId'),
+                record['internalDate'],
+                self.matched_phrases(msg_id, record),
+                sender_domain(record.get('from')),
+            ))
+            if len(buffer) >= self.row_group_size:
+                self._flush(month)
+        RUN_METRICS.add_stage_time('export', time.perf_counter() - started)
+
+    def _flush(self, month):
+        rows = self._buffers.pop(month, [])
+        if not rows:
+            return
+        columns = list(zip(*rows))
+        table = self.pa.Table.from_arrays(
+            [self.pa.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+            schema=self.schema
+        )
+        writer = self._writers.get(month)
+        if writer is None:
+            partition_dir = os.path.join(self.export_dir, f"month={month}")
+            os.makedirs(partition_dir, exist_ok=True)
+            if self.export_format == 'arrow':
+                path = os.path.join(partition_dir, f"part-{self.run_id}.arrow")
+                writer = self.pa.ipc.new_file(path, self.schema,
+                                              options=self.pa.ipc.IpcWriteOptions(compression='zstd'))
+            else:
+                path = os.path.join(partition_dir, f"part-{self.run_id}.parquet")
+                writer = self.pa.parquet.ParquetWriter(path, self.schema, compression='zstd')
+            self._writers[month] = writer
+        writer.write_table(table)
+        self._written_ids.extend(columns[0])
+        self.rows_written += len(rows)
+
+    def close(self):
+        """Flushes the remaining rows, closes all files and records the exported IDs in the cache."""
+        with RUN_METRICS.stage('export'):
+            for month in list(self._buffers):
+                self._flush(month)
+            for writer in self._writers.values():
+                writer.close()
+            if self.cache is not None:
+                self.cache.mark_exported(self._written_ids)
+        print(f"\n[Data Exported] {self.rows_written} message rows written to {self.export_dir} "
+              f"({self.export_format}, {len(self._writers)} month partition(s)).")
+
+# --- End Row-Level Export ---
+
+def save_to_csv(monthly_counts, day_of_week_counts, hourly_counts, total_count, days_back, weekday_hour_counts=None,
+                output_dir='.'):
     """Saves all date analysis results to a single CSV file for Power BI."""
     
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"job_application_data_{timestamp}.csv"
+    filename = os.path.join(output_dir, f"job_application_data_{timestamp}.csv")
     
     with open(filename, 'w', newline='', encoding='utf-8') as csvfile:
         writer = csv.writer(csvfile)
@@ -301,6 +3050,15 @@ def save_to_csv(monthly_counts, day_of_week_counts, hourly_counts, total_count,
             # Time_Period format 0-23
             writer.writerow(["Hourly", hour, count])
 
+        # 5. Write Day-of-Week x Hour Data
+        if weekday_hour_counts is not None:
+            writer.writerow([])
+            writer.writerow(["Analysis_Type", "Time_Period", "Count"])
+            for day_index, day in enumerate(DAY_NAMES):
+                for hour in range(24):
+                    # Time_Period format "DayName HH"
+                    writer.writerow(["DayOfWeekHour", f"{day} {hour:02d}", int(weekday_hour_counts[day_index][hour])])
+
     print(f"\n[Data Exported] Application data successfully saved for Power BI as: {filename}")
     return filename
 
@@ -316,11 +3074,115 @@ def create_date_query(base_query, days_back):
     full_query = f"({base_query}) after:{formatted_date}"
     return full_query
 
-def visualize_results(phrase_counts, days_back):
+# --- Chart Rendering ---
+
+_chart_style_applied = False
+
+def use_chart_style():
+    """Applies CHART_STYLE once per process instead of once per chart."""
+    global _chart_style_applied
+    if not _chart_style_applied:
+        plt.style.use(CHART_STYLE)
+        _chart_style_applied = True
+
+def save_chart(fig, name, formats, description, output_dir='.'):
+    """Saves the figure as <output_dir>/job_application_<name>_<timestamp>.<format> for each format, then closes it."""
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    for fmt in formats:
+        filename = os.path.join(output_dir, f"job_application_{name}_{timestamp}.{fmt}")
+        fig.savefig(filename)
+        print(f"[Visualization Saved] The {description} has been saved as: {filename}")
+    plt.close(fig) # Close the figure to free up memory
+
+def lttb_indices(x, y, max_points):
+    """
+    Largest-Triangle-Three-Buckets downsampling: returns the sorted indices of at most max_points
+    points of the series (x ascending) that keep its visual shape. The first and last points are
+    always kept; every bucket in between contributes the point forming the largest triangle with
+    the previously kept point and the average of the next bucket. max_points of 0 (or a series
+    that already fits) keeps every point.
+    """
+    n = len(x)
+    if not max_points or n <= max(max_points, 2):
+        return np.arange(n)
+    if max_points < 3:
+        return np.array([0, n - 1])
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+
+    # Bucket boundaries for the n - 2 inner points, plus the last point as a final bucket
+    edges = np.append(np.linspace(1, n - 1, max_points - 1).astype(np.int64), n)
+    sizes = np.diff(edges)
+    average_x = np.add.reduceat(x, edges[:-1]) / sizes
+    average_y = np.add.reduceat(y, edges[:-1]) / sizes
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = previous = 0
+    for bucket in range(max_points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        area = np.abs((x[previous] - average_x[bucket + 1]) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (average_y[bucket + 1] - y[previous]))
+        previous = start + int(area.argmax())
+        selected[bucket + 1] = previous
+    selected[-1] = n - 1
+    return selected
+
+class ChartRenderer:
+    """
+    Renders charts in a pool of worker processes (Agg backend) so they are drawn in parallel
+    with each other and with the rest of the run. Charts are submitted as soon as their
+    (small, pre-aggregated) inputs are ready; close() waits for all of them.
+    With parallel=False charts are rendered immediately in this process.
+    max_points / max_trend_points are the point budgets report_results uses for the
+    cumulative and monthly trend charts.
+    """
+
+    # Number of charts main() renders (phrase breakdown, monthly, weekday, hourly, heatmap,
+    # cumulative and phrase overlap); no point in starting more workers than that.
+    MAX_CHARTS = 7
+
+    def __init__(self, formats=CHART_FORMATS, parallel=True, workers=RENDER_WORKERS, output_dir='.',
+                 max_points=CUMULATIVE_MAX_POINTS, max_trend_points=TREND_MAX_POINTS):
+        self.formats = tuple(formats)
+        self.output_dir = output_dir
+        self.max_points = max_points
+        self.max_trend_points = max_trend_points
+        self._futures = []
+        self._pool = None
+        if parallel and HAVE_MATPLOTLIB:
+            workers = workers or min(self.MAX_CHARTS, os.cpu_count() or 1)
+            self._pool = ProcessPoolExecutor(max_workers=workers)
+
+    def submit(self, chart_function, *args, **kwargs):
+        """Renders chart_function(*args, formats=..., output_dir=..., **kwargs) in a worker process (or inline)."""
+        kwargs['formats'] = self.formats
+        kwargs['output_dir'] = self.output_dir
+        if self._pool is None:
+            with RUN_METRICS.stage('render'):
+                chart_function(*args, **kwargs)
+        else:
+            self._futures.append((chart_function.__name__, self._pool.submit(chart_function, *args, **kwargs)))
+
+    def close(self):
+        """Waits for all submitted charts and reports any that failed."""
+        if self._pool is None:
+            return
+        # Only the time spent waiting for the workers counts; rendering overlaps with the other stages.
+        with RUN_METRICS.stage('render'):
+            for name, future in self._futures:
+                try:
+                    future.result()
+                except Exception as error:
+                    print(f"Error rendering chart ({name}): {error}")
+            self._pool.shutdown()
+
+# --- End Chart Rendering ---
+
+def visualize_results(phrase_counts, days_back, formats=CHART_FORMATS, output_dir='.'):
     """Generates and saves a horizontal bar chart of the individual phrase counts."""
     
-    if plt is None:
-        print("\nVisualization requires 'matplotlib' and 'numpy'. Please install them.")
+    if not HAVE_MATPLOTLIB:
+        print("\nVisualization requires 'matplotlib'. Please install it.")
         return
 
     # Filter out phrases with zero counts for cleaner visualization
@@ -335,7 +3197,7 @@ def visualize_results(phrase_counts, days_back):
     y_pos = np.arange(len(phrases))
 
     # Set up the plot aesthetics
-    plt.style.use('seaborn-v0_8-darkgrid')
+    use_chart_style()
     fig, ax = plt.subplots(figsize=(10, 6))
 
     # Create the horizontal bars
@@ -362,19 +3224,18 @@ def visualize_results(phrase_counts, days_back):
     ax.set_xlim(right=max(counts) * 1.1) # Extend x-limit for labels
 
     plt.tight_layout()
-    
-    # --- SAVE THE PLOT TO FILE ---
-    # Generate a unique filename based on the current timestamp
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"job_application_count_breakdown_{timestamp}.png"
-    plt.savefig(filename)
-    print(f"\n[Visualization Saved] The bar chart has been saved as: {filename}")
-    plt.close(fig) # Close the figure to free up memory
 
-def visualize_monthly_results(monthly_counts, days_back):
-    """Generates and saves a line plot of the monthly application trend."""
+    save_chart(fig, 'count_breakdown', formats, 'bar chart', output_dir)
 
-    if plt is None:
+def visualize_monthly_results(monthly_counts, days_back, formats=CHART_FORMATS, output_dir='.',
+                              max_points=TREND_MAX_POINTS):
+    """
+    Generates and saves a line plot of the monthly application trend.
+    With more than max_points months, the line still connects every month, but only the
+    months selected by LTTB get a marker and a count label, and every n-th month an axis label.
+    """
+
+    if not HAVE_MATPLOTLIB:
         return
 
     if not monthly_counts:
@@ -389,17 +3250,23 @@ def visualize_monthly_results(monthly_counts, days_back):
 
     # Use Month/Year labels for x-axis
     labels = [date.strftime('%b %Y') for date in dates]
+    positions = np.arange(len(counts))
+    # Label only the months that carry the trend's shape (peaks and dips) when there are too many
+    keep = lttb_indices(positions, counts, max_points).tolist()
 
     # Set up the plot aesthetics
-    plt.style.use('seaborn-v0_8-darkgrid')
+    use_chart_style()
     fig, ax = plt.subplots(figsize=(12, 6))
 
     # Create the line plot
-    ax.plot(labels, counts, marker='o', linestyle='-', color='#0077B6', linewidth=2)
+    ax.plot(positions, counts, marker='o', markevery=keep, linestyle='-', color='#0077B6', linewidth=2)
     
-    # Add data labels for each point
-    for i, count in enumerate(counts):
-        ax.annotate(str(count), (labels[i], counts[i] + 0.5), ha='center', fontsize=9, color='#333333')
+    # Add data labels for each labeled point
+    for i in keep:
+        ax.annotate(str(counts[i]), (positions[i], counts[i] + 0.5), ha='center', fontsize=9, color='#333333')
+    step = -(-len(positions) // max_points) if max_points else 1
+    ax.set_xticks(positions[::step])
+    ax.set_xticklabels(labels[::step])
 
     # Add labels and title
     ax.set_ylabel('Number of Applications', fontsize=12)
@@ -412,18 +3279,13 @@ def visualize_monthly_results(monthly_counts, days_back):
     ax.set_ylim(bottom=0) # Start y-axis at 0
 
     plt.tight_layout()
-    
-    # --- SAVE THE PLOT TO FILE ---
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"job_application_monthly_trend_{timestamp}.png"
-    plt.savefig(filename)
-    print(f"[Visualization Saved] The monthly trend chart has been saved as: {filename}")
-    plt.close(fig)
 
-def visualize_day_of_week_results(day_counts, days_back):
+    save_chart(fig, 'monthly_trend', formats, 'monthly trend chart', output_dir)
+
+def visualize_day_of_week_results(day_counts, days_back, formats=CHART_FORMATS, output_dir='.'):
     """Generates and saves a bar chart of the day of week application breakdown."""
     
-    if plt is None:
+    if not HAVE_MATPLOTLIB:
         return
 
     days = list(day_counts.keys())
@@ -433,7 +3295,7 @@ def visualize_day_of_week_results(day_counts, days_back):
         print("No day-of-week data found to visualize.")
         return
 
-    plt.style.use('seaborn-v0_8-darkgrid')
+    use_chart_style()
     fig, ax = plt.subplots(figsize=(9, 5))
 
     ax.bar(days, counts, color=['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2'])
@@ -447,17 +3309,13 @@ def visualize_day_of_week_results(day_counts, days_back):
     ax.set_ylim(top=max(counts) * 1.1) # Extend y-limit for labels
     
     plt.tight_layout()
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"job_application_day_of_week_{timestamp}.png"
-    plt.savefig(filename)
-    print(f"[Visualization Saved] The day-of-week chart has been saved as: {filename}")
-    plt.close(fig)
 
-def visualize_hourly_results(hourly_counts, days_back):
+    save_chart(fig, 'day_of_week', formats, 'day-of-week chart', output_dir)
+
+def visualize_hourly_results(hourly_counts, days_back, tz_label='local time', formats=CHART_FORMATS, output_dir='.'):
     """Generates and saves a bar chart of the hourly application breakdown."""
     
-    if plt is None:
+    if not HAVE_MATPLOTLIB:
         return
 
     hours = list(hourly_counts.keys())
@@ -467,7 +3325,7 @@ def visualize_hourly_results(hourly_counts, days_back):
         print("No hourly data found to visualize.")
         return
 
-    plt.style.use('seaborn-v0_8-darkgrid')
+    use_chart_style()
     fig, ax = plt.subplots(figsize=(12, 6))
 
     ax.bar(hours, counts, color='#39A78E')
@@ -475,40 +3333,76 @@ def visualize_hourly_results(hourly_counts, days_back):
     ax.set_xticks(hours)
     ax.set_xticklabels([f'{h:02d}:00' for h in hours], rotation=45, ha='right')
 
-    ax.set_title(f'Applications by Time of Day (UTC, Last {days_back} Days)', fontsize=14, pad=15)
+    ax.set_title(f'Applications by Time of Day ({tz_label}, Last {days_back} Days)', fontsize=14, pad=15)
     ax.set_xlabel('Hour of Day', fontsize=12)
     ax.set_ylabel('Number of Applications', fontsize=12)
     ax.set_ylim(bottom=0)
     
     plt.tight_layout()
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"job_application_hourly_trend_{timestamp}.png"
-    plt.savefig(filename)
-    print(f"[Visualization Saved] The hourly trend chart has been saved as: {filename}")
-    plt.close(fig)
 
-def visualize_cumulative_results(date_objects, days_back):
-    """Generates and saves a line plot of the cumulative application total."""
+    save_chart(fig, 'hourly_trend', formats, 'hourly trend chart', output_dir)
+
+def visualize_weekday_hour_heatmap(weekday_hour_counts, days_back, tz_label='local time', formats=CHART_FORMATS, output_dir='.'):
+    """Generates and saves a heatmap of applications by day of week and hour of day."""
+
+    if not HAVE_MATPLOTLIB:
+        return
+
+    weekday_hour_counts = np.asarray(weekday_hour_counts)
+    if not weekday_hour_counts.any():
+        print("No day-of-week/hour data found to visualize.")
+        return
+
+    use_chart_style()
+    fig, ax = plt.subplots(figsize=(12, 5))
+
+    image = ax.imshow(weekday_hour_counts, aspect='auto', cmap='cividis')
+    fig.colorbar(image, ax=ax, label='Number of Applications')
+
+    ax.set_yticks(np.arange(7))
+    ax.set_yticklabels(DAY_NAMES)
+    ax.set_xticks(np.arange(24))
+    ax.set_xticklabels([f'{h:02d}' for h in range(24)])
+    ax.set_xlabel('Hour of Day', fontsize=12)
+    ax.set_title(f'Applications by Day of Week and Hour ({tz_label}, Last {days_back} Days)', fontsize=14, pad=15)
+    ax.grid(False)
+
+    plt.tight_layout()
+
+    save_chart(fig, 'weekday_hour_heatmap', formats, 'day-of-week/hour heatmap', output_dir)
+
+def visualize_cumulative_results(timestamps_ms, days_back, tz=None, formats=CHART_FORMATS, output_dir='.',
+                                 max_points=CUMULATIVE_MAX_POINTS):
+    """
+    Generates and saves a line plot of the cumulative application total.
+    Only max_points points (selected with LTTB) are drawn; markers are shown when every message is.
+    """
     
-    if plt is None:
+    if not HAVE_MATPLOTLIB:
         return
 
-    if not date_objects:
+    if len(timestamps_ms) == 0:
         print("No application data found for cumulative visualization.")
         return
 
-    # Sort dates chronologically
-    sorted_dates = sorted(date_objects)
+    # Sort dates chronologically (as local wall-clock datetime64 values)
+    sorted_dates = np.sort(to_local_ms(timestamps_ms, tz or resolve_timezone())).astype('datetime64[ms]')
     
     # Create cumulative counts
-    cumulative_counts = np.cumsum(np.ones(len(sorted_dates)))
+    cumulative_counts = np.arange(1, len(sorted_dates) + 1)
+
+    # One point per message is far more than the plot has pixels; keep the ones that shape the curve
+    keep = lttb_indices(sorted_dates.astype(np.int64), cumulative_counts, max_points)
+    downsampled = len(keep) < len(sorted_dates)
+    sorted_dates = sorted_dates[keep]
+    cumulative_counts = cumulative_counts[keep]
 
-    plt.style.use('seaborn-v0_8-darkgrid')
+    use_chart_style()
     fig, ax = plt.subplots(figsize=(12, 6))
 
     # Plot dates vs cumulative count
-    ax.plot(sorted_dates, cumulative_counts, marker='.', linestyle='-', color='#765D98', linewidth=2)
+    ax.plot(sorted_dates, cumulative_counts, marker=None if downsampled else '.', linestyle='-', color='#765D98',
+            linewidth=2)
     
     ax.set_title(f'Cumulative Job Applications Over Time (Last {days_back} Days)', fontsize=16, pad=20)
     ax.set_xlabel('Date', fontsize=12)
@@ -519,77 +3413,895 @@ def visualize_cumulative_results(date_objects, days_back):
     fig.autofmt_xdate(rotation=45) 
     
     plt.tight_layout()
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"job_application_cumulative_total_{timestamp}.png"
-    plt.savefig(filename)
-    print(f"[Visualization Saved] The cumulative chart has been saved as: {filename}")
-    plt.close(fig)
 
-def main():
-    """Authenticates, constructs the query, calculates counts, and prints/visualizes results."""
-    
-    # 1. Authenticate and get the service object
-    service = authenticate_gmail()
-    if not service:
-        print("\nCould not initialize Gmail service. Check 'credentials.json' and network.")
+    save_chart(fig, 'cumulative_total', formats, 'cumulative chart', output_dir)
+
+def visualize_phrase_overlap(phrases, overlap, days_back, formats=CHART_FORMATS, output_dir='.'):
+    """
+    Generates and saves a heatmap of how the phrases' matches overlap. Cell (row, column) is the
+    share of the row phrase's messages that the column phrase also matches, labeled with the count.
+    """
+
+    if not HAVE_MATPLOTLIB:
+        return
+
+    overlap = np.asarray(overlap)
+    counts = overlap.diagonal()
+    if not counts.any():
+        print("No phrase overlap data found to visualize.")
         return
 
+    share = overlap / np.maximum(counts, 1)[:, None]
+    labels = [phrase if len(phrase) <= 32 else phrase[:31] + '…' for phrase in phrases]
+
+    use_chart_style()
+    size = max(6, 0.55 * len(phrases) + 3)
+    fig, ax = plt.subplots(figsize=(size + 2, size))
+
+    image = ax.imshow(share, cmap='cividis', vmin=0, vmax=1)
+    fig.colorbar(image, ax=ax, label="Share of the row phrase's matches")
+    for i in range(len(phrases)):
+        for j in range(len(phrases)):
+            if overlap[i, j]:
+                ax.text(j, i, int(overlap[i, j]), ha='center', va='center', fontsize=7,
+                        color='black' if share[i, j] > 0.6 else 'white')
+
+    ax.set_xticks(np.arange(len(phrases)))
+    ax.set_xticklabels(labels, rotation=60, ha='right')
+    ax.set_yticks(np.arange(len(phrases)))
+    ax.set_yticklabels(labels)
+    ax.set_title(f'Phrase Overlap (Last {days_back} Days)', fontsize=14, pad=15)
+    ax.grid(False)
+
+    plt.tight_layout()
+
+    save_chart(fig, 'phrase_overlap', formats, 'phrase overlap heatmap', output_dir)
+
+def phrase_search_scope(phrase):
+    """Returns the search term for a phrase: 'subject:' or general (whole message)."""
+    if phrase in SUBJECT_ONLY_PHRASES:
+        return f'subject:"{phrase}"'
+    return f'"{phrase}"'
+
+def list_phrase_ids(service, phrase, days_back):
+    """
+    Lists the messages matching a single phrase within the look-back window.
+    Returns them as a phrase_id_array. Raises HttpError on failure.
+    """
+    individual_base_query = f'{phrase_search_scope(phrase)} -is:draft'
+    individual_full_query = create_date_query(individual_base_query, days_back)
+    return phrase_id_array(iter_message_ids(service, individual_full_query))
+
+def get_phrase_counts(service, days_back, workers=1, services=None, id_sets=None):
+    """
+    Runs one search per phrase in CORE_SEARCH_PHRASES and returns {phrase: count}.
+    With workers > 1 the searches run concurrently, each worker thread using its own
+    service object from `services`; results are still printed in CORE_SEARCH_PHRASES order.
+    Phrases whose search failed are reported and counted as 0.
+    If id_sets is a dict, the matches of every successful search are stored in it as
+    {phrase: phrase_id_array} (for phrase_overlap).
+    """
     phrase_counts = {}
+    failures = {}
     
-    # 2. Get individual keyword counts
     print("\n--- Individual Term Counts (Searches performed on whole message where appropriate) ---")
-    
-    for phrase in CORE_SEARCH_PHRASES:
-        # Determine the search scope: 'subject:' or general (whole message)
-        if phrase in SUBJECT_ONLY_PHRASES:
-            search_scope = f'subject:"{phrase}"'
-        else:
-            search_scope = f'"{phrase}"'
-            
-        individual_base_query = f'{search_scope} -is:draft'
-        individual_full_query = create_date_query(individual_base_query, DAYS_TO_LOOK_BACK)
-        
-        # NOTE: Using a single query to show what it is searching for
-        print(f"Searching for: {search_scope} ... ", end="", flush=True)
 
-        count = get_messages_count(service, search_query=individual_full_query)
-        phrase_counts[phrase] = count
-        
+    def report(phrase, ids, error):
+        if error is not None:
+            failures[phrase] = error
+            print(f"\r[{'ERROR':^5}] matches for phrase: '{phrase}'{' ' * 30}", flush=True)
+            phrase_counts[phrase] = 0
+            return
         # Overwrite the previous print to show the count result
-        print(f"\r[{count:^5}] matches for phrase: '{phrase}'{' ' * 30}", flush=True)
+        print(f"\r[{ids.size:^5}] matches for phrase: '{phrase}'{' ' * 30}", flush=True)
+        phrase_counts[phrase] = int(ids.size)
+        if id_sets is not None:
+            id_sets[phrase] = ids
+
+    if workers > 1 and services is not None:
+        def run(phrase):
+            try:
+                return list_phrase_ids(services.get(), phrase, days_back), None
+            except HttpError as error:
+                return None, error
+
+        print(f"Searching for {len(CORE_SEARCH_PHRASES)} phrases using {workers} workers...", flush=True)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # map() yields results in submission order, so the output order is stable.
+            for phrase, (ids, error) in zip(CORE_SEARCH_PHRASES, pool.map(run, CORE_SEARCH_PHRASES)):
+                report(phrase, ids, error)
+    else:
+        for phrase in CORE_SEARCH_PHRASES:
+            # NOTE: Using a single query to show what it is searching for
+            print(f"Searching for: {phrase_search_scope(phrase)} ... ", end="", flush=True)
+            try:
+                report(phrase, list_phrase_ids(service, phrase, days_back), None)
+            except HttpError as error:
+                report(phrase, None, error)
+
+    if failures:
+        print(f"\nWarning: {len(failures)} phrase search(es) failed and are counted as 0:")
+        for phrase, error in failures.items():
+            print(f"  - '{phrase}': {error}")
 
+    return phrase_counts
 
-    # 3. Get the overall query (for total count and monthly analysis)
+def parse_args(argv=None):
+    """Parses the command-line options."""
+    parser = argparse.ArgumentParser(description="Count and analyze job application emails in Gmail.")
+    parser.add_argument('--no-cache', action='store_true',
+                        help=f"Bypass the local message metadata cache ({CACHE_FILE}) and fetch everything from the API.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Only fetch changes since the previous run using the Gmail history API (requires the cache).")
+    parser.add_argument('--single-pass', action='store_true',
+                        help="List the combined query once and derive per-phrase counts from the Subject/From headers "
+                             "instead of running one search per phrase.")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of concurrent per-phrase searches. Default: 1 (one after another).")
+    parser.add_argument('--export-rows', metavar='DIR', default=None,
+                        help="Also write one row per message (ID, thread ID, date, matched phrases, sender domain) "
+                             "to DIR, partitioned by month. Requires pyarrow.")
+    parser.add_argument('--export-format', choices=['parquet', 'arrow'], default='parquet',
+                        help="File format for --export-rows: Parquet or Arrow IPC (both zstd-compressed). Default: parquet.")
+    parser.add_argument('--no-plots', action='store_true',
+                        help="Skip chart rendering entirely (CSV and other exports are still written).")
+    parser.add_argument('--formats', default=','.join(CHART_FORMATS),
+                        help="Comma-separated chart file formats, e.g. 'png,svg'. Default: png.")
+    parser.add_argument('--serial-plots', action='store_true',
+                        help="Render charts one after another in this process instead of in worker processes.")
+    parser.add_argument('--max-points', type=int, default=CUMULATIVE_MAX_POINTS,
+                        help="Point budget of the cumulative chart; longer series are downsampled (LTTB). "
+                             f"0 draws every message. Default: {CUMULATIVE_MAX_POINTS}.")
+    parser.add_argument('--max-trend-points', type=int, default=TREND_MAX_POINTS,
+                        help="Point budget (labeled months) of the monthly trend chart; 0 shows every month. "
+                             f"Default: {TREND_MAX_POINTS}.")
+    parser.add_argument('--timezone', default=None,
+                        help="IANA timezone (e.g. Europe/Berlin) used for the month, weekday and hour analyses. "
+                             "Default: the system's local timezone.")
+    parser.add_argument('--shards', default='1',
+                        help="Split the look-back window into this many date ranges and list them in parallel "
+                             f"('auto' uses about one shard per {AUTO_SHARD_DAYS} days). Default: 1 (no sharding).")
+    parser.add_argument('--output-dir', default='.',
+                        help="Directory for the CSV file and charts. Default: the current directory.")
+    parser.add_argument('--accounts', metavar='PATH', default=None,
+                        help="Analyze several mailboxes: a directory of token .json files, or a text file listing "
+                             "one token file per line. Each account gets its own subdirectory of --output-dir, "
+                             "and a combined rollup is written to --output-dir itself.")
+    parser.add_argument('--max-processes', type=int, default=ACCOUNT_PROCESSES,
+                        help=f"Number of accounts processed in parallel with --accounts. Default: {ACCOUNT_PROCESSES}.")
+    parser.add_argument('--max-requests', type=int, default=MAX_GLOBAL_REQUESTS,
+                        help="Maximum number of Gmail API calls in flight across all accounts with --accounts. "
+                             f"Default: {MAX_GLOBAL_REQUESTS}.")
+    parser.add_argument('--resume', action='store_true',
+                        help="Continue the full date scan from the checkpoint of an interrupted run "
+                             f"({os.path.basename(CHECKPOINT_FILE)}) instead of starting over.")
+    parser.add_argument('--backend', choices=['sync', 'async'], default='sync',
+                        help="'async' lists and fetches message metadata concurrently on an asyncio event loop "
+                             "(requires httpx). Not available with --incremental or --single-pass. Default: sync.")
+    parser.add_argument('--pool-size', type=int, default=HTTP_POOL_SIZE,
+                        help="Keep-alive HTTP connections shared by the worker threads of each account "
+                             f"(synchronous backend). Default: {HTTP_POOL_SIZE}.")
+    parser.add_argument('--fetch-workers', type=int, default=ASYNC_FETCH_WORKERS,
+                        help=f"Number of concurrent metadata fetches with --backend async. Default: {ASYNC_FETCH_WORKERS}.")
+    parser.add_argument('--record', metavar='FILE', default=None,
+                        help="Write every messages.list/get response of this run to FILE (gzip-compressed JSON Lines) "
+                             "for --replay. The message cache is not used while recording.")
+    parser.add_argument('--replay', metavar='FILE', default=None,
+                        help="Run the analysis from a --record archive instead of Gmail (no network or login). "
+                             "Queries that were not recorded, e.g. after editing the phrase lists, are evaluated "
+                             "locally on the recorded headers.")
+    parser.add_argument('--mbox', metavar='FILE', default=None,
+                        help="Analyze a Google Takeout .mbox export instead of querying Gmail (no network or login). "
+                             "The file is parsed in parallel worker processes in bounded memory.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Run as a daemon: keep the counts in memory, refresh them with an incremental sync every "
+                             "--watch-interval minutes and serve them as JSON on http://127.0.0.1:PORT/counts.")
+    parser.add_argument('--watch-interval', type=float, default=WATCH_INTERVAL_MINUTES,
+                        help=f"Minutes between refreshes with --watch. Default: {WATCH_INTERVAL_MINUTES}.")
+    parser.add_argument('--port', type=int, default=WATCH_PORT,
+                        help=f"Local port of the --watch HTTP endpoint. Default: {WATCH_PORT}.")
+    parser.add_argument('--profile', action='store_true',
+                        help=f"Run under cProfile, print the slowest functions and save the statistics to "
+                             f"--output-dir/{PROFILE_FILE}.")
+    return parser.parse_args(argv)
+
+def analyze_mailbox(service, services, args, shards, cache_file=CACHE_FILE, export_dir=None, renderer=None,
+                    checkpoint_file=CHECKPOINT_FILE):
+    """
+    Runs the queries for one mailbox: phrase counts, total count and message dates.
+    The phrase chart is submitted to `renderer` as soon as the counts are known.
+    The full date scan saves its progress to checkpoint_file (continued with args.resume).
+    cache_file=None / checkpoint_file=None run without the metadata cache / checkpoints.
+    Returns {'total_count', 'phrase_counts', 'phrase_ids', 'timestamps'}, or None if the analysis failed
+    ('phrase_ids' holds each phrase's matches for report_phrase_overlap).
+    """
+    # 2. Get the overall query (for total count and monthly analysis)
     full_query = create_date_query(FULL_JOB_APPLICATION_QUERY, DAYS_TO_LOOK_BACK)
-    
-    # 4. Get the total (non-redundant) count 
-    total_count = get_messages_count(service, search_query=full_query)
 
-    # 5. Get the dates for ALL matching emails (needed for all advanced date analyses)
-    date_objects = get_message_dates(service, full_query)
+    cache = None if args.no_cache or cache_file is None else MessageCache(cache_file)
+    exporter = None
+    try:
+        if export_dir:
+            try:
+                exporter = RowExporter(export_dir, args.export_format, cache=cache)
+            except RuntimeError as error:
+                print(f"Error: {error}")
+                return None
+
+        matched_ids = None
+        body_ids = None
+        phrase_ids = {}
+        if args.incremental:
+            # Update the stored results, body fallback matches included, from the mailbox history
+            body_ids = {}
+            try:
+                matched_ids = sync_matching_ids(service, cache, FULL_JOB_APPLICATION_QUERY, DAYS_TO_LOOK_BACK,
+                                                shards=shards, services=services, body_ids=body_ids)
+            except HttpError as error:
+                print(f"Error during incremental sync: {error}")
+                return None
+        elif args.single_pass:
+            # List the combined query once; everything else is derived from these messages
+            try:
+                matched_ids = list(iter_window_ids(service, FULL_JOB_APPLICATION_QUERY, DAYS_TO_LOOK_BACK,
+                                                   shards=shards, services=services))
+            except HttpError as error:
+                print(f"Error listing messages for the combined query: {error}")
+                return None
+
+        if matched_ids is not None:
+            # 3. Attribute messages to phrases locally from their Subject/From headers
+            # (with --incremental the body fallback matches come from the sync state too)
+            records = get_message_records(service, matched_ids, cache=cache, require_headers=True)
+            print("\n--- Individual Term Counts (derived from message headers) ---")
+            with RUN_METRICS.stage('phrase_counts'):
+                phrase_counts = get_phrase_counts_from_headers(service, matched_ids, records, DAYS_TO_LOOK_BACK,
+                                                               id_sets=phrase_ids, body_ids=body_ids)
+            if exporter is not None:
+                exporter.set_phrase_ids(phrase_ids)
+            if renderer is not None:
+                renderer.submit(visualize_results, phrase_counts, DAYS_TO_LOOK_BACK)
+
+            # 4/5. Total count and dates come from the same messages; ones that could not be
+            # fetched are left out of both (they were reported above)
+            timestamps = records_to_timestamps(matched_ids, records)
+            total_count = len(timestamps)
+            if exporter is not None:
+                exporter.write(matched_ids, records)
+        else:
+            # 3. Get individual keyword counts
+            with RUN_METRICS.stage('phrase_counts'):
+                phrase_counts = get_phrase_counts(service, DAYS_TO_LOOK_BACK, workers=args.workers, services=services,
+                                                  id_sets=phrase_ids)
+            if exporter is not None:
+                # The rows list the same matches as the counts, body matches included
+                exporter.set_phrase_ids(phrase_ids)
+            # The phrase chart only needs the counts, so render it while the dates are fetched
+            if renderer is not None:
+                renderer.submit(visualize_results, phrase_counts, DAYS_TO_LOOK_BACK)
+
+            checkpoint = None
+            if checkpoint_file:
+                checkpoint = ScanCheckpoint(checkpoint_file, full_query)
+                if args.resume:
+                    if not checkpoint.load():
+                        print("No checkpoint to resume from; starting a full scan.")
+                elif checkpoint.exists():
+                    print("Note: the checkpoint of an interrupted scan is replaced (use --resume to continue it).")
+
+            if args.backend == 'async':
+                # 4/5. Same as below, with listing and metadata fetches overlapping on one event loop
+                try:
+                    total_count, timestamps = run_async_scan(
+                        services.creds, FULL_JOB_APPLICATION_QUERY, DAYS_TO_LOOK_BACK, cache=cache,
+                        shards=shards, workers=args.fetch_workers, checkpoint=checkpoint, recorder=services.recorder,
+                        on_batch=exporter.write if exporter is not None else None
+                    )
+                except RuntimeError as error:
+                    print(f"Error: {error}")
+                    return None
+            else:
+                # 4/5. Get the total (non-redundant) count and the dates for ALL matching emails
+                # (needed for all advanced date analyses) from a single listing of the combined query
+                combined_ids = None
+                if shards > 1:
+                    combined_ids = iter_window_ids(service, FULL_JOB_APPLICATION_QUERY, DAYS_TO_LOOK_BACK,
+                                                   shards=shards, services=services)
+                try:
+                    total_count, timestamps = scan_message_dates(
+                        service, full_query, cache=cache, message_ids=combined_ids, checkpoint=checkpoint,
+                        on_batch=exporter.write if exporter is not None else None
+                    )
+                except IncompleteScanError as error:
+                    # No results for a partial scan: the counts and charts would be wrong
+                    print(f"Error: {error}")
+                    return None
+    finally:
+        if exporter is not None:
+            exporter.close()
+        if cache is not None:
+            cache.close()
+
+    return {'total_count': total_count, 'phrase_counts': phrase_counts, 'phrase_ids': phrase_ids,
+            'timestamps': timestamps}
 
-    # 6. Perform advanced date analyses
-    monthly_counts = get_monthly_counts(date_objects)
-    day_of_week_counts = get_day_of_week_counts(date_objects)
-    hourly_counts = get_hourly_counts(date_objects)
+def report_results(total_count, timestamps, tz, output_dir='.', renderer=None, title=None):
+    """Analyzes the message dates, prints the summary, writes the CSV and submits the date charts."""
+    # 6. Perform advanced date analyses (one vectorized pass)
+    with RUN_METRICS.stage('analysis'):
+        analysis = analyze_timestamps(timestamps, tz)
+    RUN_METRICS.set_value('applications', total_count)
+    monthly_counts = analysis['monthly']
+    day_of_week_counts = analysis['day_of_week']
+    hourly_counts = analysis['hourly']
     
     # 7. Output the console result
     start_date = (datetime.now() - timedelta(days=DAYS_TO_LOOK_BACK)).strftime("%Y/%m/%d")
-    print("\n--- JOB APPLICATION COUNT SUMMARY ---")
+    print(f"\n--- {title or 'JOB APPLICATION COUNT SUMMARY'} ---")
     print(f"Search Period: Emails received after {start_date} (Last {DAYS_TO_LOOK_BACK} days)")
     print(f"Total applications found (Non-Redundant): {total_count}")
     print("-------------------------------------")
     
     # 8. Export to CSV for Power BI
-    save_to_csv(monthly_counts, day_of_week_counts, hourly_counts, total_count, DAYS_TO_LOOK_BACK)
-
-    # 9. Visualize all results
-    visualize_results(phrase_counts, DAYS_TO_LOOK_BACK)
-    visualize_monthly_results(monthly_counts, DAYS_TO_LOOK_BACK)
-    visualize_day_of_week_results(day_of_week_counts, DAYS_TO_LOOK_BACK)
-    visualize_hourly_results(hourly_counts, DAYS_TO_LOOK_BACK)
-    visualize_cumulative_results(date_objects, DAYS_TO_LOOK_BACK)
+    with RUN_METRICS.stage('export'):
+        save_to_csv(monthly_counts, day_of_week_counts, hourly_counts, total_count, DAYS_TO_LOOK_BACK,
+                    weekday_hour_counts=analysis['weekday_hour'], output_dir=output_dir)
+
+    # 9. Visualize all results (the phrase chart is submitted by the caller)
+    if renderer is not None:
+        renderer.submit(visualize_monthly_results, monthly_counts, DAYS_TO_LOOK_BACK,
+                        max_points=renderer.max_trend_points)
+        renderer.submit(visualize_day_of_week_results, day_of_week_counts, DAYS_TO_LOOK_BACK)
+        renderer.submit(visualize_hourly_results, hourly_counts, DAYS_TO_LOOK_BACK, tz_label=timezone_label(tz))
+        renderer.submit(visualize_weekday_hour_heatmap, analysis['weekday_hour'], DAYS_TO_LOOK_BACK,
+                        tz_label=timezone_label(tz))
+        renderer.submit(visualize_cumulative_results, timestamps, DAYS_TO_LOOK_BACK, tz=tz,
+                        max_points=renderer.max_points)
+
+def chart_formats(args):
+    """Returns the chart formats selected with --formats."""
+    return [fmt.strip().lower() for fmt in args.formats.split(',') if fmt.strip()]
+
+def chart_options(args):
+    """Returns the ChartRenderer options selected on the command line (formats and point budgets)."""
+    return {'formats': chart_formats(args), 'max_points': args.max_points, 'max_trend_points': args.max_trend_points}
+
+# --- Multi-Account Mode ---
+
+def discover_accounts(path):
+    """
+    Returns [(name, token_file), ...] for --accounts. `path` is either a directory of token
+    .json files or a manifest listing one token file per line (blank lines and '#' comments
+    are skipped, relative paths are relative to the manifest). The name is the file name
+    without .json and must be unique.
+    """
+    if os.path.isdir(path):
+        token_files = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                       if name.endswith('.json') and name != os.path.basename(CREDENTIALS_FILE)]
+    else:
+        base_dir = os.path.dirname(os.path.abspath(path))
+        token_files = []
+        with open(path, encoding='utf-8') as manifest:
+            for line in manifest:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    token_files.append(os.path.join(base_dir, os.path.expanduser(line)))
+
+    accounts = []
+    seen = set()
+    for token_file in token_files:
+        name = os.path.splitext(os.path.basename(token_file))[0]
+        if name in seen:
+            raise ValueError(f"Duplicate account name '{name}' ({token_file}).")
+        seen.add(name)
+        accounts.append((name, token_file))
+    return accounts
+
+def init_account_worker(global_slots):
+    """Process pool initializer: shares the global request cap with this process's scheduler."""
+    REQUEST_SCHEDULER.global_slots = global_slots
+
+def run_account(name, token_file, args, shards, tz, output_root):
+    """
+    Analyzes one account in a worker process. Output (CSV, charts, run.log) goes to
+    <output_root>/<name>/ and the metadata cache is <name>.message_cache.sqlite3 next to the token.
+    Returns a result dict with 'name', 'seconds' and either the analyze_mailbox results or 'error'.
+    """
+    import traceback
+    global RUN_METRICS, REQUEST_SCHEDULER
+
+    # Pool processes are reused for several accounts; start each with fresh metrics and quota state.
+    RUN_METRICS = RunMetrics()
+    global_slots = REQUEST_SCHEDULER.global_slots
+    REQUEST_SCHEDULER = RequestScheduler()
+    REQUEST_SCHEDULER.global_slots = global_slots
+
+    account_dir = os.path.join(output_root, name)
+    os.makedirs(account_dir, exist_ok=True)
+    token_dir = os.path.dirname(os.path.abspath(token_file))
+    cache_file = os.path.join(token_dir, f"{name}.message_cache.sqlite3")
+    checkpoint_file = os.path.join(token_dir, f"{name}.scan_checkpoint.json")
+    export_dir = os.path.join(args.export_rows, name) if args.export_rows else None
+    started = time.perf_counter()
+
+    result = None
+    error = None
+    with open(os.path.join(account_dir, 'run.log'), 'w', encoding='utf-8') as log, \
+            contextlib.redirect_stdout(log):
+        try:
+            # Worker processes cannot prompt for a login; tokens must already exist
+            with RUN_METRICS.stage('auth'):
+                creds = get_credentials(token_file, interactive=False)
+                http = open_transport(creds, token_file, args.pool_size) if creds else None
+                service = build_service(http) if http else None
+            if not service:
+                error = "could not initialize the Gmail service (see run.log)"
+            else:
+                renderer = None if args.no_plots else ChartRenderer(**chart_options(args), parallel=False,
+                                                                    output_dir=account_dir)
+                result = analyze_mailbox(service, ThreadLocalServices(http), args, shards,
+                                         cache_file=cache_file, export_dir=export_dir, renderer=renderer,
+                                         checkpoint_file=checkpoint_file)
+                if result is None:
+                    error = "analysis failed (see run.log)"
+                else:
+                    report_phrase_overlap(result['phrase_ids'], DAYS_TO_LOOK_BACK, output_dir=account_dir,
+                                          renderer=renderer)
+                    report_results(result['total_count'], result['timestamps'], tz,
+                                   output_dir=account_dir, renderer=renderer, title=f"{name}: SUMMARY")
+                if renderer is not None:
+                    renderer.close()
+        except Exception as exc:
+            traceback.print_exc(file=log)
+            error = f"{type(exc).__name__}: {exc}"
+        RUN_METRICS.print_summary()
+        RUN_METRICS.write(account_dir)
+
+    result = dict(result or {}, name=name, seconds=time.perf_counter() - started, metrics=RUN_METRICS.summary())
+    if error:
+        result['error'] = error
+    return result
+
+def run_accounts(args, shards, tz):
+    """Processes every account from --accounts in a process pool and writes the combined rollup."""
+    import multiprocessing
+
+    try:
+        accounts = discover_accounts(args.accounts)
+    except (OSError, ValueError) as error:
+        print(f"Error reading --accounts: {error}")
+        return
+    if not accounts:
+        print(f"Error: no token files found in {args.accounts}.")
+        return
+
+    processes = max(1, min(args.max_processes, len(accounts)))
+    print(f"Analyzing {len(accounts)} account(s) with {processes} process(es), "
+          f"at most {args.max_requests} API calls in flight...")
+    global_slots = multiprocessing.Semaphore(max(1, args.max_requests))
+
+    results = []
+    with ProcessPoolExecutor(max_workers=processes, initializer=init_account_worker,
+                             initargs=(global_slots,)) as pool:
+        futures = [pool.submit(run_account, name, token_file, args, shards, tz, args.output_dir)
+                   for name, token_file in accounts]
+        # Report accounts as they finish; slow mailboxes don't hold up the progress output
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                results.append(result)
+                RUN_METRICS.merge(result['metrics'])
+                status = f"failed: {result['error']}" if 'error' in result else f"{result['total_count']} applications"
+                print(f"  [{len(results)}/{len(accounts)}] {result['name']}: {status} ({result['seconds']:.1f}s)")
+
+    succeeded = sorted((r for r in results if 'error' not in r), key=lambda r: r['name'])
+    failed = len(results) - len(succeeded)
+    if failed:
+        print(f"Warning: {failed} account(s) failed; they are not included in the rollup.")
+    if not succeeded:
+        return
+
+    # Rollup: the same tables over all accounts' messages combined
+    phrase_counts = {}
+    for result in succeeded:
+        for phrase, count in result['phrase_counts'].items():
+            phrase_counts[phrase] = phrase_counts.get(phrase, 0) + count
+    total_count = sum(result['total_count'] for result in succeeded)
+    timestamps = concat_timestamps([result['timestamps'] for result in succeeded])
+
+    renderer = None if args.no_plots else ChartRenderer(**chart_options(args), parallel=not args.serial_plots,
+                                                        output_dir=args.output_dir)
+    try:
+        if renderer is not None:
+            renderer.submit(visualize_results, phrase_counts, DAYS_TO_LOOK_BACK)
+        report_phrase_overlap(merge_phrase_ids(result['phrase_ids'] for result in succeeded), DAYS_TO_LOOK_BACK,
+                              output_dir=args.output_dir, renderer=renderer)
+        report_results(total_count, timestamps, tz, output_dir=args.output_dir, renderer=renderer,
+                       title=f"ROLLUP OF {len(succeeded)} ACCOUNT(S)")
+    finally:
+        if renderer is not None:
+            renderer.close()
+
+# --- End Multi-Account Mode ---
+
+# --- Watch Mode ---
+
+LIVE_SECTIONS = ('total', 'monthly', 'day_of_week', 'hourly', 'weekday_hour', 'phrases')
+
+def compute_live_counts(service, services, cache, shards, tz):
+    """
+    Brings the matching messages up to date with an incremental sync (a full scan the first
+    time) and returns the counts the watch endpoint serves. Phrases are attributed from the
+    cached headers and the body fallback matches kept by the sync, so a refresh only lists
+    the date range of what changed. Raises HttpError if the sync fails.
+    """
+    body_ids = {}
+    matched_ids = sync_matching_ids(service, cache, FULL_JOB_APPLICATION_QUERY, DAYS_TO_LOOK_BACK,
+                                    shards=shards, services=services, body_ids=body_ids)
+    records = get_message_records(service, matched_ids, cache=cache, require_headers=True)
+    phrase_counts = get_phrase_counts_from_headers(service, matched_ids, records, DAYS_TO_LOOK_BACK, body_ids=body_ids)
+    timestamps = records_to_timestamps(matched_ids, records)
+    analysis = analyze_timestamps(timestamps, tz)
+    start_date = (datetime.now() - timedelta(days=DAYS_TO_LOOK_BACK)).strftime("%Y-%m-%d")
+    return {
+        'search_start': start_date,
+        'days_back': DAYS_TO_LOOK_BACK,
+        'timezone': timezone_label(tz),
+        'total': len(timestamps),
+        'monthly': analysis['monthly'],
+        'day_of_week': analysis['day_of_week'],
+        'hourly': {str(hour): count for hour, count in analysis['hourly'].items()},
+        'weekday_hour': analysis['weekday_hour'].tolist(),
+        'phrases': phrase_counts,
+    }
+
+def etag_matches(if_none_match, etag):
+    """True if an If-None-Match header value matches etag (weak comparison, as RFC 9110 requires)."""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in tags or any(tag.removeprefix('W/') == etag for tag in tags)
+
+class LiveCounts:
+    """
+    The watch daemon's current results. Every document the endpoint serves ('/counts' and
+    '/counts/<section>') is encoded once per refresh together with its ETag, so requests only
+    look up bytes. publish() swaps in the new documents with a single assignment; request
+    threads see either the old or the new set, never a mix.
+    """
+
+    def __init__(self, interval_seconds):
+        self.interval_seconds = interval_seconds
+        self.documents = {}
+        self.refreshes = 0
+        self.failures = 0
+        self.last_refresh = None
+        self.last_refresh_seconds = None
+        self.last_error = None
+        self.updated_at = None
+        self._counts_key = None
+
+    def publish(self, counts, seconds):
+        """Stores the result of a refresh. Returns True if the counts changed since the last one."""
+        self.refreshes += 1
+        self.last_refresh = datetime.now().isoformat(timespec='seconds')
+        self.last_refresh_seconds = round(seconds, 3)
+        self.last_error = None
+        counts_key = json.dumps(counts, sort_keys=True)
+        if counts_key == self._counts_key:
+            return False  # unchanged documents keep their ETags
+        self._counts_key = counts_key
+        self.updated_at = self.last_refresh
+        payloads = [('/counts', dict(counts, updated_at=self.updated_at))]
+        payloads += [(f'/counts/{section}', counts[section]) for section in LIVE_SECTIONS]
+        documents = {}
+        for path, payload in payloads:
+            body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+            documents[path] = (body, f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"')
+        self.documents = documents
+        return True
+
+    def fail(self, error):
+        self.failures += 1
+        self.last_refresh = datetime.now().isoformat(timespec='seconds')
+        self.last_error = f"{type(error).__name__}: {error}"
+
+    def status(self):
+        """The /status document (built per request: it changes with every refresh)."""
+        return {
+            'ready': bool(self.documents),
+            'refreshes': self.refreshes,
+            'failures': self.failures,
+            'last_refresh': self.last_refresh,
+            'last_refresh_seconds': self.last_refresh_seconds,
+            'last_error': self.last_error,
+            'updated_at': self.updated_at,
+            'interval_seconds': self.interval_seconds,
+        }
+
+def start_live_server(live, host=WATCH_HOST, port=WATCH_PORT):
+    """
+    Serves `live` over HTTP from a background thread and returns the server (stop it with
+    shutdown()). GET/HEAD /counts and /counts/<section> answer If-None-Match with 304 Not
+    Modified; /status is never cached. Raises OSError if the port is not available.
+    """
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class LiveCountsHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep-alive for polling dashboards
+
+        def do_GET(self):
+            self.respond(send_body=True)
+
+        def do_HEAD(self):
+            self.respond(send_body=False)
+
+        def respond(self, send_body):
+            path = self.path.split('?', 1)[0].rstrip('/') or '/counts'
+            if path == '/status':
+                body = json.dumps(live.status(), separators=(',', ':')).encode('utf-8')
+                return self.send(200, body, send_body, cache_control='no-store')
+            document = live.documents.get(path)
+            if document is None:
+                if path == '/counts' or path.removeprefix('/counts/') in LIVE_SECTIONS:
+                    # Known path, but the first refresh has not finished yet
+                    body = json.dumps({'error': 'counts not available yet', 'status': live.status()}).encode('utf-8')
+                    return self.send(503, body, send_body, cache_control='no-store', retry_after='30')
+                body = json.dumps({'error': f"unknown path {path}",
+                                   'paths': ['/counts', '/status'] + [f'/counts/{s}' for s in LIVE_SECTIONS]})
+                return self.send(404, body.encode('utf-8'), send_body, cache_control='no-store')
+            body, etag = document
+            if etag_matches(self.headers.get('If-None-Match'), etag):
+                return self.send(304, b'', False, etag=etag)
+            return self.send(200, body, send_body, etag=etag)
+
+        def send(self, status, body, send_body, etag=None, cache_control='no-cache', retry_after=None):
+            self.send_response(status)
+            if status != 304:
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+            if etag:
+                self.send_header('ETag', etag)
+            # no-cache: clients may store the document but must revalidate it (cheaply, via the ETag)
+            self.send_header('Cache-Control', cache_control)
+            if retry_after:
+                self.send_header('Retry-After', retry_after)
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # polling would flood the refresh log
+
+    server = ThreadingHTTPServer((host, port), LiveCountsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='live-counts', daemon=True).start()
+    return server
+
+def run_watch(args, shards, tz):
+    """Runs the watch daemon for token.json until Ctrl-C: refreshes the counts on a schedule and serves them."""
+    with RUN_METRICS.stage('auth'):
+        creds = get_credentials()
+        http = open_transport(creds, TOKEN_FILE, args.pool_size) if creds else None
+        service = build_service(http) if http else None
+    if not service:
+        print("\nCould not initialize Gmail service. Check 'credentials.json' and network.")
+        return
+    # The service, its connection pool and the cache stay open between refreshes
+    services = ThreadLocalServices(http)
+    interval_seconds = args.watch_interval * 60
+    live = LiveCounts(interval_seconds)
+    try:
+        server = start_live_server(live, WATCH_HOST, args.port)
+    except OSError as error:
+        print(f"Error: cannot listen on {WATCH_HOST}:{args.port}: {error}")
+        return
+    print(f"Serving live counts on http://{WATCH_HOST}:{server.server_port}/counts "
+          f"(refreshed every {args.watch_interval:g} minutes; Ctrl-C to stop).")
+
+    cache = MessageCache(CACHE_FILE)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                with RUN_METRICS.stage('refresh'):
+                    counts = compute_live_counts(service, services, cache, shards, tz)
+            except (HttpError, ConnectionError, TimeoutError) as error:
+                live.fail(error)
+                print(f"[{live.last_refresh}] Refresh failed, still serving the previous counts: {error}")
+            else:
+                changed = live.publish(counts, time.perf_counter() - started)
+                print(f"[{live.last_refresh}] Refreshed in {live.last_refresh_seconds:.1f} s: "
+                      f"{counts['total']} applications ({'changed' if changed else 'unchanged'}).")
+            time.sleep(max(0.0, interval_seconds - (time.perf_counter() - started)))
+    except KeyboardInterrupt:
+        print("\nStopping the watch daemon.")
+    finally:
+        server.shutdown()
+        server.server_close()
+        cache.close()
+
+# --- End Watch Mode ---
+
+def run(args):
+    """Authenticates, constructs the query, calculates counts, and prints/visualizes results."""
+    try:
+        shards = resolve_shard_count(args.shards, DAYS_TO_LOOK_BACK)
+    except ValueError:
+        print(f"Error: --shards must be a number or 'auto', got '{args.shards}'.")
+        return
+    try:
+        tz = resolve_timezone(args.timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        print(f"Error: unknown timezone '{args.timezone}'.")
+        return
+    if args.incremental and args.no_cache:
+        print("Error: --incremental stores its state in the message cache and cannot be used with --no-cache.")
+        return
+    if args.resume and (args.incremental or args.single_pass):
+        print("Error: --resume only applies to the full scan (not --incremental or --single-pass).")
+        return
+    if args.backend == 'async' and (args.incremental or args.single_pass):
+        print("Error: --backend async only supports the full scan (not --incremental or --single-pass).")
+        return
+    if args.record or args.replay:
+        if args.record and args.replay:
+            print("Error: --record and --replay cannot be used together.")
+            return
+        if args.accounts or args.incremental or args.resume:
+            print("Error: --record and --replay work on complete single-account runs "
+                  "(not --accounts, --incremental or --resume).")
+            return
+        if args.replay and args.backend == 'async':
+            print("Error: --replay runs on the sync backend (recordings of either backend can be replayed).")
+            return
+    if args.mbox and (args.accounts or args.record or args.replay or args.incremental or args.resume):
+        print("Error: --mbox reads a Takeout export instead of Gmail and cannot be combined with "
+              "--accounts, --record, --replay, --incremental or --resume.")
+        return
+    if args.watch:
+        if args.accounts or args.record or args.replay or args.mbox or args.resume or args.export_rows:
+            print("Error: --watch serves one account's counts and cannot be combined with --accounts, --record, "
+                  "--replay, --mbox, --resume or --export-rows.")
+            return
+        if args.no_cache or args.backend == 'async':
+            print("Error: --watch refreshes with incremental syncs, which need the message cache and the sync backend.")
+            return
+        if args.watch_interval <= 0:
+            print(f"Error: --watch-interval must be positive, got {args.watch_interval:g}.")
+            return
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    try:
+        if args.watch:
+            run_watch(args, shards, tz)
+        elif args.mbox:
+            run_mbox(args, tz)
+        elif args.accounts:
+            run_accounts(args, shards, tz)
+        else:
+            run_single_account(args, shards, tz)
+    finally:
+        # Written even if the run failed, so a scraper sees the failed calls
+        RUN_METRICS.print_summary()
+        paths = RUN_METRICS.write(args.output_dir)
+        print(f"[Metrics Saved] {' and '.join(paths)}")
+
+def run_single_account(args, shards, tz):
+    """Analyzes the mailbox of token.json, or the API responses recorded in args.replay."""
+    global REQUEST_SCHEDULER
+    cache_file = CACHE_FILE
+    checkpoint_file = CHECKPOINT_FILE
+    recorder = None
+    if args.replay:
+        # 1. Load the recorded responses instead of authenticating
+        try:
+            with RUN_METRICS.stage('load_archive'):
+                archive = ReplayArchive(args.replay)
+        except (OSError, ValueError, KeyError) as error:
+            print(f"Error: cannot replay '{args.replay}': {error}")
+            return
+        print(f"Replaying {len(archive.pages)} list pages and {len(archive.messages)} messages "
+              f"recorded on {archive.header['recorded_on']} (no network access).")
+        service = ReplayService(archive)
+        services = ReplayServices(service)
+        # Replayed calls cost no quota; the results must not mix with the live cache
+        REQUEST_SCHEDULER = RequestScheduler(units_per_second=1e12, burst_units=1e12)
+        cache_file = checkpoint_file = None
+    else:
+        # 1. Authenticate and get the service object
+        with RUN_METRICS.stage('auth'):
+            creds = get_credentials()
+            http = open_transport(creds, TOKEN_FILE, args.pool_size) if creds else None
+            service = build_service(http) if http else None
+        if not service:
+            print("\nCould not initialize Gmail service. Check 'credentials.json' and network.")
+            return
+        if args.record:
+            # Cached messages would be missing from the archive, so everything is fetched
+            recorder = ApiRecorder(args.record)
+            service = RecordingService(service, recorder)
+            cache_file = checkpoint_file = None
+        # Worker threads (sharded listing, phrase searches) each get their own service object on the shared pool
+        services = ThreadLocalServices(http, recorder=recorder)
+
+    # Charts are rendered in worker processes as soon as their inputs are ready
+    renderer = None
+    if not args.no_plots:
+        renderer = ChartRenderer(**chart_options(args), parallel=not args.serial_plots, output_dir=args.output_dir)
+    
+    try:
+        result = analyze_mailbox(service, services, args, shards, cache_file=cache_file, export_dir=args.export_rows,
+                                 renderer=renderer, checkpoint_file=checkpoint_file)
+        if result is not None:
+            report_phrase_overlap(result['phrase_ids'], DAYS_TO_LOOK_BACK, output_dir=args.output_dir, renderer=renderer)
+            report_results(result['total_count'], result['timestamps'], tz,
+                           output_dir=args.output_dir, renderer=renderer)
+    finally:
+        if renderer is not None:
+            renderer.close()
+        if recorder is not None:
+            print(f"[Recording Saved] {recorder.close()} API responses written to {args.record}")
+
+def run_mbox(args, tz):
+    """Analyzes the Google Takeout mbox export args.mbox with the same outputs as a Gmail run."""
+    renderer = None
+    if not args.no_plots:
+        renderer = ChartRenderer(**chart_options(args), parallel=not args.serial_plots, output_dir=args.output_dir)
+    exporter = None
+    try:
+        if args.export_rows:
+            try:
+                exporter = RowExporter(args.export_rows, args.export_format)
+            except RuntimeError as error:
+                print(f"Error: {error}")
+                return
+        print(f"\nReading the Takeout export {args.mbox} ...")
+        phrase_ids = {}
+        try:
+            with RUN_METRICS.stage('mbox'):
+                total_count, phrase_counts, timestamps = ingest_mbox(
+                    args.mbox, DAYS_TO_LOOK_BACK, id_sets=phrase_ids,
+                    on_batch=exporter.write if exporter is not None else None
+                )
+        except (OSError, ValueError) as error:
+            print(f"Error: cannot read '{args.mbox}': {error}")
+            return
+
+        print("\n--- Individual Term Counts (from the mbox export) ---")
+        for phrase, count in phrase_counts.items():
+            print(f"[{count:^5}] matches for phrase: '{phrase}'")
+        if renderer is not None:
+            renderer.submit(visualize_results, phrase_counts, DAYS_TO_LOOK_BACK)
+        report_phrase_overlap(phrase_ids, DAYS_TO_LOOK_BACK, output_dir=args.output_dir, renderer=renderer)
+        report_results(total_count, timestamps, tz, output_dir=args.output_dir, renderer=renderer)
+    finally:
+        if exporter is not None:
+            exporter.close()
+        if renderer is not None:
+            renderer.close()
+
+def main(argv=None):
+    """Parses the options and runs the analysis, under cProfile if --profile is given."""
+    args = parse_args(argv)
+    if not args.profile:
+        run(args)
+        return
+
+    import cProfile
+    import pstats
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run, args)
+    finally:
+        os.makedirs(args.output_dir, exist_ok=True)
+        path = os.path.join(args.output_dir, PROFILE_FILE)
+        profiler.dump_stats(path)
+        print(f"\n--- Profile (top {PROFILE_TOP_FUNCTIONS} by cumulative time) ---")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_TOP_FUNCTIONS)
+        print(f"[Profile Saved] Full statistics written to {path} (open with 'python -m pstats {path}').")
 
 if __name__ == '__main__':
     main()
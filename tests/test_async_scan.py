@@ -0,0 +1,162 @@
+import asyncio
+import os
+
+import numpy as np
+import pytest
+
+import benchmark
+import job_application_counter as jac
+
+SHARDS = 4
+
+
+class FakeAsyncClient:
+    """Stands in for AsyncGmailClient; `creds` is the benchmark's fake Gmail service."""
+
+    def __init__(self, creds, recorder=None):
+        self.service = creds
+
+    async def list_messages(self, query, page_token=None, page_size=jac.LIST_PAGE_SIZE):
+        failing = self.service.failing_shard
+        if failing is not None and f"after:{failing:%Y/%m/%d}" in query:
+            raise benchmark.http_error(400, 'invalidArgument')
+        await asyncio.sleep(0.005)  # the other shards are still listing when one fails
+        return self.service.list(q=query, pageToken=page_token, maxResults=page_size).execute()
+
+    async def get_metadata(self, msg_id, **kwargs):
+        service = self.service
+        if service.gets_left is not None:
+            if service.gets_left <= 0:
+                raise benchmark.http_error(403, 'dailyLimitExceeded')
+            service.gets_left -= 1
+        return service.get(id=msg_id, format='metadata', metadataHeaders=jac.METADATA_HEADERS).execute()
+
+    async def aclose(self):
+        pass
+
+
+@pytest.fixture
+def service(monkeypatch):
+    monkeypatch.setattr(jac, 'AsyncGmailClient', FakeAsyncClient)
+    fake = benchmark.FakeGmailService(3000, seed=11, page_limit=50)
+    fake.failing_shard = None
+    fake.gets_left = None
+    return fake
+
+
+def scan(service, checkpoint=None):
+    return jac.run_async_scan(service, jac.FULL_JOB_APPLICATION_QUERY, jac.DAYS_TO_LOOK_BACK, shards=SHARDS,
+                              workers=4, checkpoint=checkpoint)
+
+
+def make_checkpoint(path):
+    return jac.ScanCheckpoint(path, jac.create_date_query(jac.FULL_JOB_APPLICATION_QUERY, jac.DAYS_TO_LOOK_BACK))
+
+
+def test_failed_shard_keeps_the_other_shards(service, tmp_path):
+    expected_total, expected_timestamps = scan(service)
+
+    path = str(tmp_path / 'scan_checkpoint.json')
+    service.failing_shard = jac.split_date_window(jac.DAYS_TO_LOOK_BACK, SHARDS)[0][0]
+    with pytest.raises(jac.IncompleteScanError):
+        scan(service, make_checkpoint(path))
+    interrupted = make_checkpoint(path)
+    assert interrupted.load()
+    # Everything the three other shards listed was fetched
+    assert 0 < len(interrupted.done_ids) == len(interrupted.timestamps()) < expected_total
+
+    service.failing_shard = None
+    checkpoint = make_checkpoint(path)
+    checkpoint.load()
+    total, timestamps = scan(service, checkpoint)
+    assert total == expected_total
+    np.testing.assert_array_equal(np.sort(timestamps), np.sort(expected_timestamps))
+    assert not os.path.exists(path)
+
+
+def test_resume_after_quota_error(service, tmp_path):
+    expected_total, expected_timestamps = scan(service)
+
+    path = str(tmp_path / 'scan_checkpoint.json')
+    service.gets_left = 100
+    with pytest.raises(jac.IncompleteScanError):
+        scan(service, make_checkpoint(path))
+    interrupted = make_checkpoint(path)
+    assert interrupted.load()
+    assert len(interrupted.done_ids) == len(interrupted.timestamps()) == 100
+
+    service.gets_left = None
+    checkpoint = make_checkpoint(path)
+    checkpoint.load()
+    total, timestamps = scan(service, checkpoint)
+    assert total == expected_total
+    np.testing.assert_array_equal(np.sort(timestamps), np.sort(expected_timestamps))
+    assert not os.path.exists(path)
+
+
+def run_calls(scheduler, count, monkeypatch):
+    """Runs `count` concurrent execute_async calls; returns (peak calls in flight, asyncio.sleep calls made while waiting)."""
+    real_sleep = asyncio.sleep
+    sleeps = []
+    state = {'in_flight': 0, 'peak': 0}
+
+    async def counting_sleep(delay, *args, **kwargs):
+        sleeps.append(delay)
+        return await real_sleep(delay, *args, **kwargs)
+
+    async def send():
+        state['in_flight'] += 1
+        state['peak'] = max(state['peak'], state['in_flight'])
+        await real_sleep(0.02)
+        state['in_flight'] -= 1
+        return {}
+
+    async def main():
+        monkeypatch.setattr(asyncio, 'sleep', counting_sleep)
+        await asyncio.gather(*(scheduler.execute_async(send, 'messages.get') for _ in range(count)))
+
+    asyncio.run(main())
+    return state['peak'], sleeps
+
+
+def test_async_callers_wait_for_a_slot_without_polling(monkeypatch):
+    scheduler = jac.RequestScheduler(units_per_second=1e12, burst_units=1e12, initial_concurrency=2, max_concurrency=2)
+    peak, sleeps = run_calls(scheduler, 12, monkeypatch)
+    assert peak == 2
+    assert sleeps == []
+
+
+def test_async_callers_share_the_global_slots(monkeypatch):
+    scheduler = jac.RequestScheduler(units_per_second=1e12, burst_units=1e12, initial_concurrency=8, max_concurrency=8)
+    scheduler.global_slots = jac.threading.Semaphore(1)
+    peak, sleeps = run_calls(scheduler, 6, monkeypatch)
+    assert peak == 1
+    assert sleeps == []
+    assert scheduler.global_slots.acquire(False)
+
+
+def test_cancelled_waiter_returns_its_slots():
+    scheduler = jac.RequestScheduler(units_per_second=1e12, burst_units=1e12, initial_concurrency=4, max_concurrency=4)
+    scheduler.global_slots = jac.threading.Semaphore(1)
+
+    async def main():
+        release = asyncio.Event()
+
+        async def hold():
+            await release.wait()
+            return {}
+
+        holder = asyncio.ensure_future(scheduler.execute_async(hold, 'messages.get'))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(scheduler.execute_async(hold, 'messages.get'))
+        await asyncio.sleep(0.01)
+        waiter.cancel()
+        release.set()
+        await holder
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        await asyncio.sleep(0.05)  # the helper thread hands the slot it took for the cancelled call back
+
+    asyncio.run(main())
+    assert scheduler._in_flight == 0
+    assert scheduler.global_slots.acquire(False)
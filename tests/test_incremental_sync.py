@@ -0,0 +1,71 @@
+import benchmark
+import job_application_counter as jac
+
+DAYS = jac.DAYS_TO_LOOK_BACK
+
+
+def sync(service, cache, body_ids=None):
+    body_ids = {} if body_ids is None else body_ids
+    matched_ids = jac.sync_matching_ids(service, cache, jac.FULL_JOB_APPLICATION_QUERY, DAYS, body_ids=body_ids)
+    records = jac.get_message_records(service, matched_ids, cache=cache, require_headers=True)
+    return jac.get_phrase_counts_from_headers(service, matched_ids, records, DAYS, body_ids=body_ids)
+
+
+def searched_counts(service, cache):
+    """Phrase counts of a --single-pass run: full listing plus one body fallback query per phrase."""
+    matched_ids = list(jac.iter_window_ids(service, jac.FULL_JOB_APPLICATION_QUERY, DAYS))
+    records = jac.get_message_records(service, matched_ids, cache=cache, require_headers=True)
+    return jac.get_phrase_counts_from_headers(service, matched_ids, records, DAYS)
+
+
+def test_incremental_phrase_counts_only_list_the_changes(tmp_path):
+    service = benchmark.FakeGmailService(2000, seed=3)
+    cache = jac.MessageCache(str(tmp_path / 'cache.sqlite3'))
+    try:
+        body_ids = {}
+        first = sync(service, cache, body_ids)
+        assert first == searched_counts(service, cache)
+        assert any(first[phrase] for phrase in jac.BODY_OR_SENDER_PHRASES)
+
+        service.api_calls = {}
+        assert sync(service, cache) == first
+        assert service.api_calls.get('history.list') == 1
+        assert 'messages.list' not in service.api_calls
+
+        for _ in range(40):
+            service.add_message()
+        # A message that only matches a body/sender phrase through its body
+        service.delete_message(next(iter(body_ids[max(body_ids, key=lambda p: len(body_ids[p]))])))
+        service.api_calls = {}
+        updated = sync(service, cache)
+        # One date-limited listing for the combined query and one per body/sender phrase
+        assert service.api_calls['messages.list'] == 1 + len(jac.BODY_OR_SENDER_PHRASES)
+        assert updated == searched_counts(service, cache)
+    finally:
+        cache.close()
+
+
+class MissingFake(benchmark.FakeGmailService):
+    """Fake Gmail whose messages.get fails with 404 for the IDs in `missing`."""
+
+    missing = frozenset()
+
+    def get(self, userId='me', id=None, **kwargs):
+        if id in self.missing:
+            def run():
+                raise benchmark.http_error(404, 'notFound')
+            return benchmark.FakeRequest(self, 'messages.get', run)
+        return super().get(userId=userId, id=id, **kwargs)
+
+
+def test_total_only_counts_fetched_messages(tmp_path):
+    service = MissingFake(2000, seed=5)
+    matched = list(jac.iter_window_ids(service, jac.FULL_JOB_APPLICATION_QUERY, DAYS))
+    service.missing = frozenset(matched[:3])
+    cache = jac.MessageCache(str(tmp_path / 'cache.sqlite3'))
+    try:
+        counts = jac.compute_live_counts(service, None, cache, 1, jac.resolve_timezone('UTC'))
+    finally:
+        cache.close()
+    assert counts['total'] == len(matched) - 3
+    assert counts['total'] == sum(counts['monthly'].values()) == sum(counts['hourly'].values())
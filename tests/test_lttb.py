@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+import job_application_counter as jac
+
+
+@pytest.mark.parametrize('n, max_points', [(10, 3), (10, 9), (11, 10), (1000, 50), (12345, 997)])
+def test_output_length_and_endpoints(n, max_points):
+    rng = np.random.default_rng(n)
+    x = np.arange(n)
+    y = rng.normal(size=n).cumsum()
+    indices = jac.lttb_indices(x, y, max_points)
+    assert len(indices) == max_points
+    assert indices[0] == 0
+    assert indices[-1] == n - 1
+    assert (np.diff(indices) > 0).all()
+
+
+@pytest.mark.parametrize('n, max_points', [(0, 10), (1, 10), (5, 5), (5, 10), (100, 0), (100, None)])
+def test_series_that_fits_keeps_every_point(n, max_points):
+    x = np.arange(n)
+    assert list(jac.lttb_indices(x, x, max_points)) == list(range(n))
+
+
+@pytest.mark.parametrize('max_points', [1, 2])
+def test_tiny_budget_keeps_only_endpoints(max_points):
+    x = np.arange(100)
+    assert list(jac.lttb_indices(x, x, max_points)) == [0, 99]
+
+
+def test_spike_is_kept():
+    x = np.arange(1000)
+    y = np.zeros(1000)
+    y[437] = 50.0
+    assert 437 in jac.lttb_indices(x, y, 20)
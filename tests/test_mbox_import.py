@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import job_application_counter as jac
+
+
+def from_line(decimal_id, days_ago):
+    moment = datetime.now(timezone.utc) - timedelta(days=days_ago)
+    return f"From {decimal_id}@xxx {moment.strftime('%a %b %d %H:%M:%S +0000 %Y')}"
+
+
+def message(decimal_id, days_ago, subject, sender='Acme <jobs@acme.example>', labels='Inbox', body='Hello.'):
+    return (f"{from_line(decimal_id, days_ago)}\n"
+            f"X-GM-THRID: {decimal_id}\n"
+            f"X-Gmail-Labels: {labels}\n"
+            f"From: {sender}\n"
+            f"Subject: {subject}\n"
+            f"Content-Type: text/plain; charset=utf-8\n"
+            f"\n{body}\n\n")
+
+
+GERMAN = '=?utf-8?b?VmllbGVuIERhbmsgZsO8ciBJaHJlIEJld2VyYnVuZw==?='  # Vielen Dank für Ihre Bewerbung
+MAILBOX = [
+    message(1000000000000000001, 5, GERMAN),
+    message(1000000000000000002, 6, 'Thank you for applying', labels='Spam'),
+    message(1000000000000000003, 7, 'Thank you for applying', labels='Drafts'),
+    message(1000000000000000004, 800, 'Thank you for applying'),
+    message(1000000000000000005, 8, 'Catching up', body='Our talent team will be in touch.'),
+    message(1000000000000000006, 9, 'Lunch on Friday?'),
+    message(1000000000000000007, 10, '=?iso-8859-1?q?Your_application_to?=\n =?iso-8859-1?q?_Globex?='),
+    message(1000000000000000001, 5, GERMAN),  # the same message exported from a second label
+]
+
+
+def write_mbox(tmp_path, messages=MAILBOX):
+    path = tmp_path / 'mail.mbox'
+    path.write_text(''.join(messages), encoding='utf-8')
+    return str(path)
+
+
+def test_decode_mime_header():
+    assert jac.decode_mime_header(GERMAN.encode()) == 'Vielen Dank für Ihre Bewerbung'
+    assert jac.decode_mime_header(b'=?iso-8859-1?q?Caf=E9?= team') == 'Café team'
+    assert jac.decode_mime_header(b'Plain subject') == 'Plain subject'
+
+
+def test_parse_mbox_headers_joins_folded_lines_and_keeps_first():
+    block = (b'Subject: =?utf-8?q?Your_application?=\r\n =?utf-8?q?_to_Globex?=\r\n'
+             b'Received: from somewhere\n\tby elsewhere\n'
+             b'Subject: second\n'
+             b'From: Globex <hr@globex.example>\n')
+    headers = jac.parse_mbox_headers(block)
+    assert headers == {'subject': 'Your application to Globex', 'from': 'Globex <hr@globex.example>'}
+
+
+def test_ingest_mbox_filters_and_deduplicates(tmp_path):
+    path = write_mbox(tmp_path)
+    rows = {}
+    id_sets = {}
+    # Small chunks so the messages are spread over several worker tasks
+    total, phrase_counts, timestamps = jac.ingest_mbox(
+        path, 365, processes=2, chunk_bytes=200, on_batch=lambda ids, records: rows.update(records), id_sets=id_sets)
+
+    assert total == 3
+    assert len(timestamps) == 3
+    assert set(rows) == {format(1000000000000000001, 'x'), format(1000000000000000005, 'x'),
+                         format(1000000000000000007, 'x')}
+    assert rows[format(1000000000000000001, 'x')]['subject'] == 'Vielen Dank für Ihre Bewerbung'
+    assert rows[format(1000000000000000007, 'x')]['subject'] == 'Your application to Globex'
+    assert phrase_counts['Vielen Dank für Ihre Bewerbung'] == 1
+    assert phrase_counts['Ihre Bewerbung'] == 1
+    assert phrase_counts['talent team'] == 1
+    assert phrase_counts['your application to'] == 1
+    assert phrase_counts['thank you for applying'] == 0
+    assert len(id_sets['Vielen Dank für Ihre Bewerbung']) == 1
+
+
+def test_ingest_mbox_rejects_other_files(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text('Subject: not an mbox\n')
+    with pytest.raises(ValueError):
+        jac.ingest_mbox(str(path), 365, processes=1)
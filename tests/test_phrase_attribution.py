@@ -0,0 +1,14 @@
+import job_application_counter as jac
+
+
+def test_phrase_does_not_span_subject_and_sender():
+    # "talent" ends the subject and "team" starts the sender
+    record = {'subject': 'Meet our talent', 'from': 'Team Lead <lead@example.com>'}
+    assert 'talent team' not in jac.classify_message(record)
+
+
+def test_phrases_in_each_header_are_found():
+    record = {'subject': 'Your application to Acme', 'from': 'Acme Talent Team <jobs@acme.example>'}
+    matched = jac.classify_message(record)
+    assert 'talent team' in matched
+    assert 'your application to' in matched
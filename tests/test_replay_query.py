@@ -0,0 +1,65 @@
+import pytest
+
+import job_application_counter as jac
+
+# (ID, internalDate, Subject, From)
+MESSAGES = [
+    ('18c0000000000001', '2026-03-01', 'Thank you for applying - Data Analyst', 'Acme <jobs@acme.example>'),
+    ('18c0000000000002', '2026-02-01', 'Weekly digest', 'Acme Talent Team <talent@acme.example>'),
+    ('18c0000000000003', '2026-01-15', 'Lunch?', 'Bob <bob@example.com>'),
+    ('18c0000000000004', '2024-01-01', 'Your application to Globex', 'Globex <hr@globex.example>'),
+]
+# Recorded body fallback search: message 3 mentions the application portal only in its body
+BODY_QUERY = '"application portal" -subject:"application portal" -from:"application portal" -is:draft after:2025/01/01'
+
+
+def timestamp_ms(day):
+    return int(jac.datetime.strptime(day, '%Y-%m-%d').timestamp() * 1000)
+
+
+@pytest.fixture(scope='module')
+def archive(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('replay') / 'archive.jsonl.gz')
+    recorder = jac.ApiRecorder(path)
+    for msg_id, day, subject, sender in MESSAGES:
+        recorder.record_get(msg_id, {
+            'id': msg_id, 'threadId': msg_id, 'internalDate': str(timestamp_ms(day)),
+            'payload': {'headers': [{'name': 'Subject', 'value': subject}, {'name': 'From', 'value': sender}]},
+        })
+    recorder.record_list(BODY_QUERY, None, {'messages': [{'id': '18c0000000000003'}], 'resultSizeEstimate': 1})
+    recorder.close()
+    return jac.ReplayArchive(path)
+
+
+def matches(query, archive):
+    predicate = jac.compile_replay_query(query, archive)
+    return {msg_id[-1] for msg_id, row in archive.headers().items() if predicate(msg_id, row)}
+
+
+@pytest.mark.parametrize('query, expected', [
+    ('subject:"thank you for applying"', {'1'}),
+    ('subject:"THANK YOU, for applying!"', {'1'}),  # case and punctuation are ignored
+    ('"talent team"', {'2'}),  # from the From header
+    ('"application portal"', {'3'}),  # only known from the recorded body search
+    ('subject:"talent team"', set()),
+    ('subject:"thank you for applying" OR from:"talent team"', {'1', '2'}),
+    ('(subject:"your application to" OR "talent team") after:2025/01/01', {'2'}),
+    ('subject:"your application to" before:2025/01/01', {'4'}),
+    ('"talent team" -subject:"weekly digest"', set()),
+    # OR binds tighter than the implicit AND: bob AND (lunch OR talent team)
+    ('from:"bob" subject:"lunch" OR "talent team"', {'3'}),
+    ('subject:"lunch" OR "talent team" -is:draft', {'2', '3'}),
+    ('is:draft', set()),
+])
+def test_compiled_query_matches_fixture(archive, query, expected):
+    assert matches(query, archive) == expected
+
+
+def test_full_query_is_evaluated_locally(archive):
+    query = jac.create_date_query(jac.FULL_JOB_APPLICATION_QUERY, 3650)
+    assert matches(query, archive) == {'1', '2', '3', '4'}
+
+
+def test_unsupported_operator_raises(archive):
+    with pytest.raises(ValueError):
+        jac.compile_replay_query('label:inbox "talent team"', archive)
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+import benchmark
+import job_application_counter as jac
+
+FULL_QUERY = jac.create_date_query(jac.FULL_JOB_APPLICATION_QUERY, jac.DAYS_TO_LOOK_BACK)
+
+
+class QuotaFake(benchmark.FakeGmailService):
+    """Fake Gmail whose daily quota runs out after `gets_left` messages.get calls (403 dailyLimitExceeded)."""
+
+    def __init__(self, *args, gets_left=None, fail_listing=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.gets_left = gets_left
+        self.fail_listing = fail_listing
+
+    def call(self, request, latency=True):
+        if request.kind == 'messages.get' and self.gets_left is not None:
+            if self.gets_left <= 0:
+                raise benchmark.http_error(403, 'dailyLimitExceeded')
+            self.gets_left -= 1
+        if request.kind == 'messages.list' and self.fail_listing and self.api_calls.get('messages.list'):
+            raise benchmark.http_error(400, 'invalidArgument')  # every page after the first
+        return super().call(request, latency)
+
+
+def make_fake(**kwargs):
+    # Small pages so the scan spans several page tokens
+    return QuotaFake(3000, seed=7, page_limit=50, **kwargs)
+
+
+def scan(service, checkpoint=None):
+    return jac.scan_message_dates(service, FULL_QUERY, batch_size=40, checkpoint=checkpoint)
+
+
+def test_resume_after_quota_error_matches_uninterrupted_scan(tmp_path):
+    service = make_fake()
+    expected_total, expected_timestamps = scan(service)
+    assert expected_total == len(expected_timestamps) > 200
+
+    path = str(tmp_path / 'scan_checkpoint.json')
+    service.gets_left = 100  # runs out in the middle of the third batch
+    with pytest.raises(jac.IncompleteScanError):
+        scan(service, jac.ScanCheckpoint(path, FULL_QUERY))
+    assert os.path.exists(path)
+
+    interrupted = jac.ScanCheckpoint(path, FULL_QUERY)
+    assert interrupted.load()
+    assert len(interrupted.done_ids) == 100  # only the messages that were fetched
+    assert len(interrupted.timestamps()) == 100
+
+    service.gets_left = None  # quota reset
+    checkpoint = jac.ScanCheckpoint(path, FULL_QUERY)
+    assert checkpoint.load()
+    total, timestamps = scan(service, checkpoint)
+
+    assert total == expected_total
+    np.testing.assert_array_equal(np.sort(timestamps), np.sort(expected_timestamps))
+    assert not os.path.exists(path)
+
+
+def test_listing_error_raises_and_keeps_checkpoint(tmp_path):
+    path = str(tmp_path / 'scan_checkpoint.json')
+    with pytest.raises(jac.IncompleteScanError):
+        scan(make_fake(fail_listing=True), jac.ScanCheckpoint(path, FULL_QUERY))
+
+    checkpoint = jac.ScanCheckpoint(path, FULL_QUERY)
+    assert checkpoint.load()
+    assert checkpoint.page_token is None  # the failed second page is listed again on resume
+    assert len(checkpoint.done_ids) == len(checkpoint.timestamps()) > 0
+
+
+def test_deleted_messages_are_not_counted(tmp_path):
+    service = make_fake()
+    expected_total, _ = scan(service)
+    listed = service._matching(FULL_QUERY)
+    deleted = {message['id'] for message in listed[:3]}
+    get = service.get
+
+    def get_or_404(userId='me', id=None, **kwargs):
+        request = get(userId=userId, id=id, **kwargs)
+        if id in deleted:
+            request.run = lambda: (_ for _ in ()).throw(benchmark.http_error(404, 'notFound'))
+        return request
+    service.get = get_or_404
+
+    path = str(tmp_path / 'scan_checkpoint.json')
+    total, timestamps = scan(service, jac.ScanCheckpoint(path, FULL_QUERY))
+    assert total == len(timestamps) == expected_total - len(deleted)
+    assert not os.path.exists(path)
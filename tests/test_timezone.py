@@ -0,0 +1,49 @@
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+import job_application_counter as jac
+
+# 10:30 UTC in summer and in winter: 12:30 CEST and 11:30 CET
+SUMMER = int(datetime(2025, 7, 1, 10, 30, tzinfo=timezone.utc).timestamp() * 1000)
+WINTER = int(datetime(2025, 1, 15, 10, 30, tzinfo=timezone.utc).timestamp() * 1000)
+
+
+@pytest.fixture
+def system_tz(monkeypatch):
+    """Sets the process timezone (TZ) for the duration of a test."""
+    def set_tz(name):
+        monkeypatch.setenv('TZ', name)
+        time.tzset()
+    yield set_tz
+    monkeypatch.undo()
+    time.tzset()
+
+
+def local_hours(tz):
+    hourly = jac.analyze_timestamps(np.array([SUMMER, WINTER]), tz)['hourly']
+    return {hour for hour, count in hourly.items() if count}
+
+
+@pytest.mark.parametrize('tz_name', ['Europe/Berlin', 'CET-1CEST,M3.5.0,M10.5.0/3'])
+def test_system_timezone_follows_dst(system_tz, tz_name):
+    system_tz(tz_name)
+    assert local_hours(None) == {12, 11}
+    assert local_hours(jac.resolve_timezone()) == {12, 11}
+
+
+def test_posix_tz_falls_back_to_system_rules(system_tz):
+    system_tz('CET-1CEST,M3.5.0,M10.5.0/3')
+    tz = jac.resolve_timezone()
+    assert isinstance(tz, jac.SystemTimezone)
+    assert jac.timezone_label(tz) == 'CET/CEST'
+    assert datetime.fromtimestamp(SUMMER / 1000, tz).tzname() == 'CEST'
+    assert datetime.fromtimestamp(WINTER / 1000, tz).tzname() == 'CET'
+
+
+def test_named_timezone_overrides_system(system_tz):
+    system_tz('UTC')
+    assert local_hours(jac.resolve_timezone('Europe/Berlin')) == {12, 11}
+    assert local_hours(None) == {10}